@@ -0,0 +1,92 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python benchmark.py --n_words 50000 --emb_dim 300 --n_langs 3 --output bench.json
+# python benchmark.py --n_words 50000 --emb_dim 300 --n_langs 3 --baseline bench.json --threshold 0.1
+
+import os
+import io
+import sys
+import json
+import argparse
+import tempfile
+from collections import OrderedDict
+import torch
+
+from src.utils import bool_flag, initialize_exp, FAISS_AVAILABLE
+from src.benchmark import BENCHMARKS, BenchmarkData, run_benchmark, compare_results
+
+
+# main
+parser = argparse.ArgumentParser(description='Benchmark of the alignment hot paths, on synthetic inputs')
+parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic inputs")
+parser.add_argument("--verbose", type=int, default=1, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--exp_path", type=str, default="", help="Where to store experiment logs and results")
+parser.add_argument("--exp_name", type=str, default="benchmark", help="Experiment name")
+parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
+parser.add_argument("--cuda", type=bool_flag, default=False, help="Run on GPU")
+# synthetic inputs
+parser.add_argument("--n_words", type=int, default=50000, help="Vocabulary size of each language")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--n_langs", type=int, default=3, help="Number of languages (a source and target languages)")
+# benchmarks
+parser.add_argument("--benchmarks", type=str, default="", help="Comma-separated benchmarks to run (default: all): %s" % ', '.join(BENCHMARKS))
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each benchmark")
+parser.add_argument("--warmup", type=int, default=1, help="Number of untimed runs of each benchmark")
+parser.add_argument("--output", type=str, default="", help="Results file (JSON, default: benchmark.json in the experiment folder)")
+parser.add_argument("--baseline", type=str, default="", help="Results of a previous run to compare to")
+parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown / memory increase reported as a regression")
+
+
+# parse parameters
+params = parser.parse_args()
+params.benchmarks = [x for x in params.benchmarks.split(',') if len(x) > 0] or list(BENCHMARKS)
+
+# check parameters
+assert not params.cuda or torch.cuda.is_available()
+assert params.n_words >= 2 and params.emb_dim >= 1 and params.n_langs >= 2
+assert all(name in BENCHMARKS for name in params.benchmarks)
+assert params.repeat >= 1 and params.warmup >= 0
+assert not params.baseline or os.path.isfile(params.baseline)
+assert params.threshold >= 0
+
+# build logger / synthetic inputs
+logger = initialize_exp(params)
+params.data_path = tempfile.mkdtemp(prefix='muse-benchmark-')
+data = BenchmarkData(params)
+
+# run the benchmarks
+results = OrderedDict()
+results['config'] = OrderedDict([
+    ('n_words', params.n_words), ('emb_dim', params.emb_dim), ('n_langs', params.n_langs),
+    ('cuda', params.cuda), ('faiss', FAISS_AVAILABLE), ('threads', torch.get_num_threads()),
+])
+results['benchmarks'] = OrderedDict()
+for name in params.benchmarks:
+    logger.info('============ %s ============' % name)
+    results['benchmarks'][name] = run_benchmark(name, data, params.repeat, params.warmup)
+
+# clean the synthetic files
+for filename in os.listdir(params.data_path):
+    os.remove(os.path.join(params.data_path, filename))
+os.rmdir(params.data_path)
+
+output = params.output if params.output else os.path.join(params.exp_path, 'benchmark.json')
+with io.open(output, 'w', encoding='utf-8') as f:
+    json.dump(results, f, indent=2)
+logger.info('Wrote the results to %s' % output)
+
+# compare to the baseline (a non-zero exit code reports regressions)
+if params.baseline:
+    with io.open(params.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, params.threshold)
+    for regression in regressions:
+        logger.warning('Regression: %s' % regression)
+    if len(regressions) > 0:
+        sys.exit(1)
+    logger.info('No regression above %.0f%%.' % (100 * params.threshold))
@@ -15,6 +15,8 @@ from src.utils import bool_flag, initialize_exp
 from src.models import build_model
 from src.trainer import Trainer
 from src.evaluation import Evaluator
+from src.instrument import log_stage_summary
+from src.profiler import PROFILERS, init_profiler, profile
 
 # main
 parser = argparse.ArgumentParser(description='Evaluation')
@@ -27,35 +29,64 @@ parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
 parser.add_argument("--src_lang", type=str, default="", help="Source language")
 parser.add_argument("--tgt_lang", type=str, default="", help="Target language")
 parser.add_argument("--dico_eval", type=str, default="default", help="Path to evaluation dictionary")
+parser.add_argument("--dico_path", type=str, default="", help="Folder of the default train / evaluation dictionaries (default: $MUSE_DIC_EVAL_PATH, or data/crosslingual/dictionaries)")
 # reload pre-trained embeddings
 parser.add_argument("--src_emb", type=str, default="", help="Reload source embeddings")
 parser.add_argument("--tgt_emb", type=str, default="", help="Reload target embeddings")
+parser.add_argument("--bundle", type=str, default="", help="Reload the source and target embeddings from an aligned bundle (see --export bundle)")
 parser.add_argument("--max_vocab", type=int, default=200000, help="Maximum vocabulary size (-1 to disable)")
 parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
 parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--emb_dtype", type=str, default="float32", help="Storage precision of the embeddings (float32 / float16 / bfloat16). Reduced precision embeddings are frozen")
+parser.add_argument("--shared_embeddings", type=bool_flag, default=False, help="Share the loaded embeddings with the other jobs of the host (memory-mapped, read-only)")
+parser.add_argument("--shared_dir", type=str, default="", help="Directory of the shared embeddings (default: /dev/shm)")
+# profiling
+parser.add_argument("--profile", type=str, default="", help="Stages to profile, comma-separated (e.g. \"iteration\", \"build_dictionary/candidates\", \"eval.word_translation\": see the stages of the log)")
+parser.add_argument("--profile_iters", type=str, default="", help="Iterations to profile, comma-separated (default: all)")
+parser.add_argument("--profiler", type=str, default="cprofile", help="Profilers (cprofile / torch / cprofile,torch)")
+parser.add_argument("--profile_top", type=int, default=20, help="Number of hot functions of the profile summaries")
 
 
 # parse parameters
 params = parser.parse_args()
 
 # check parameters
+if params.bundle:
+    assert os.path.isfile(params.bundle) and not params.src_emb and not params.tgt_emb
+    params.src_emb = params.bundle
+    params.tgt_emb = ' '.join([params.bundle] * len(params.tgt_lang.split()))
+params.tgt_lang = params.tgt_lang.split()
+params.tgt_emb = params.tgt_emb.split()
 assert params.src_lang, "source language undefined"
 assert os.path.isfile(params.src_emb)
-assert not params.tgt_lang or os.path.isfile(params.tgt_emb)
+assert len(params.tgt_lang) == len(params.tgt_emb)
+assert all(os.path.isfile(emb) for emb in params.tgt_emb)
 assert params.dico_eval == 'default' or os.path.isfile(params.dico_eval)
+assert not params.dico_path or os.path.isdir(params.dico_path)
+assert params.emb_dtype in ["float32", "float16", "bfloat16"]
+assert not params.shared_embeddings or params.emb_dtype != "bfloat16", "shared embeddings are stored in float32 / float16"
+assert not params.shared_dir or os.path.isdir(params.shared_dir)
+assert all(x in PROFILERS for x in params.profiler.split(','))
+assert all(x.isdigit() for x in params.profile_iters.split(',') if x)
+assert params.profile_top > 0
 
 # build logger / model / trainer / evaluator
 logger = initialize_exp(params)
+init_profiler(params)
 src_emb, tgt_emb, mapping, _ = build_model(params, False)
 trainer = Trainer(src_emb, tgt_emb, mapping, None, params)
 evaluator = Evaluator(trainer)
 
 # run evaluations
 to_log = OrderedDict({'n_iter': 0})
-evaluator.monolingual_wordsim(to_log)
-# evaluator.monolingual_wordanalogy(to_log)
-if params.tgt_lang:
-    evaluator.crosslingual_wordsim(to_log)
-    evaluator.word_translation(to_log)
-    evaluator.sent_translation(to_log)
-    # evaluator.dist_mean_cosine(to_log)
+with profile('iteration'):
+    evaluator.monolingual_wordsim(to_log)
+    # evaluator.monolingual_wordanalogy(to_log)
+    if params.tgt_lang:
+        evaluator.crosslingual_wordsim(to_log)
+        evaluator.word_translation(to_log)
+        evaluator.sent_translation(to_log)
+        # evaluator.dist_mean_cosine(to_log)
+
+# time / memory of each evaluation
+log_stage_summary()
@@ -0,0 +1,78 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python generate.py --langs "en es it" --n_words 200000 --emb_dim 300 --output_dir data/synthetic
+
+import os
+import argparse
+from logging import getLogger
+
+from src.logger import create_logger
+from src.synthetic import generate_languages, get_translation_pairs, get_dictionary_splits
+from src.synthetic import write_txt_embeddings, write_bin_embeddings, write_dictionary
+
+
+# main
+parser = argparse.ArgumentParser(description='Generate synthetic multilingual embeddings with a known alignment')
+parser.add_argument("--seed", type=int, default=0, help="Generation seed")
+parser.add_argument("--verbose", type=int, default=2, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--output_dir", type=str, default="data/synthetic", help="Output folder (embeddings, and dictionaries in dictionaries/)")
+parser.add_argument("--langs", type=str, default="en es", help="Languages to generate")
+parser.add_argument("--n_words", type=int, default=200000, help="Vocabulary size of each language")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--format", type=str, default="vec", help="Embedding file format (vec / bin: word2vec binary)")
+parser.add_argument("--noise", type=float, default=0.5, help="Norm of the noise added to each (unit norm) embedding")
+parser.add_argument("--rank_noise", type=float, default=0.1, help="Log-scale jitter of the word frequency ranks between languages")
+parser.add_argument("--n_clusters", type=int, default=100, help="Number of topics of the latent space")
+parser.add_argument("--shared", type=float, default=0.05, help="Fraction of words spelled identically in all languages (for identical_char dictionaries)")
+
+
+# parse parameters
+params = parser.parse_args()
+params.langs = params.langs.strip().split(' ')
+
+# check parameters
+assert len(params.langs) >= 1 and len(set(params.langs)) == len(params.langs)
+assert all(lang.islower() for lang in params.langs)
+assert params.n_words >= 2 and params.emb_dim >= 1
+assert params.format in ["vec", "bin"]
+assert params.noise >= 0 and params.rank_noise >= 0 and 0 <= params.shared <= 1
+
+# create the output folders / logger
+dico_dir = os.path.join(params.output_dir, 'dictionaries')
+if not os.path.isdir(dico_dir):
+    os.makedirs(dico_dir)
+create_logger(os.path.join(params.output_dir, 'generate.log'), vb=params.verbose)
+logger = getLogger()
+logger.info('\n'.join('%s: %s' % (k, str(v)) for k, v in sorted(dict(vars(params)).items())))
+
+languages = generate_languages(params.langs, params.n_words, params.emb_dim, noise=params.noise,
+                               rank_noise=params.rank_noise, n_clusters=params.n_clusters,
+                               shared=params.shared, seed=params.seed)
+
+# embeddings
+write_embeddings = write_txt_embeddings if params.format == 'vec' else write_bin_embeddings
+for lang in params.langs:
+    words, embeddings, _ = languages[lang]
+    path = os.path.join(params.output_dir, '%s.%s' % (lang, params.format))
+    write_embeddings(path, words, embeddings)
+    logger.info('Wrote %i %s embeddings to %s' % (len(words), lang, path))
+
+# ground-truth dictionaries between all the pairs of languages
+splits = get_dictionary_splits(params.n_words)
+for lang1 in params.langs:
+    for lang2 in params.langs:
+        if lang1 == lang2:
+            continue
+        pairs = get_translation_pairs(languages[lang1], languages[lang2])
+        for name, start, end in splits:
+            path = os.path.join(dico_dir, '%s-%s.%s.txt' % (lang1, lang2, name))
+            write_dictionary(path, pairs[start:end], languages[lang1][0], languages[lang2][0])
+logger.info('Wrote the dictionaries of %i language pairs to %s (source words %s)'
+            % (len(params.langs) * (len(params.langs) - 1), dico_dir,
+               ', '.join('%i-%i' % (start, end) for _, start, end in splits)))
+logger.info('Use them with: --dico_path %s (or MUSE_DIC_EVAL_PATH=%s)' % (dico_dir, dico_dir))
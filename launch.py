@@ -0,0 +1,67 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python launch.py --n_procs 4 unsupervised.py --src_lang en --tgt_lang es --src_emb data/wiki.en.vec --tgt_emb data/wiki.es.vec
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+
+# main
+parser = argparse.ArgumentParser(description='Launch data-parallel training on the local host')
+parser.add_argument("--n_procs", type=int, default=2, help="Number of worker processes")
+parser.add_argument("--master_port", type=int, default=0, help="Port of the master worker (0 to pick a free one)")
+parser.add_argument("script", type=str, help="Training script (unsupervised.py)")
+parser.add_argument("script_args", nargs=argparse.REMAINDER, help="Arguments of the training script")
+
+
+# parse parameters
+params = parser.parse_args()
+
+# check parameters
+assert params.n_procs >= 1
+assert os.path.isfile(params.script)
+
+# pick a free port
+if params.master_port == 0:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        params.master_port = s.getsockname()[1]
+
+# split the cores between the workers
+n_threads = max(1, (os.cpu_count() or 1) // params.n_procs)
+
+procs = []
+for rank in range(params.n_procs):
+    env = dict(os.environ)
+    env.update({
+        'RANK': str(rank),
+        'WORLD_SIZE': str(params.n_procs),
+        'MASTER_ADDR': '127.0.0.1',
+        'MASTER_PORT': str(params.master_port),
+    })
+    env.setdefault('OMP_NUM_THREADS', str(n_threads))
+    procs.append(subprocess.Popen([sys.executable, params.script] + params.script_args, env=env))
+
+# wait for the workers, stop all of them if one fails
+exit_code = 0
+while procs:
+    for proc in list(procs):
+        code = proc.poll()
+        if code is None:
+            continue
+        procs.remove(proc)
+        if code != 0 and exit_code == 0:
+            exit_code = code
+            for other in procs:
+                other.terminate()
+    time.sleep(0.5)
+sys.exit(exit_code)
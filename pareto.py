@@ -0,0 +1,86 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python pareto.py --src_lang en --tgt_lang es --src_emb data/wiki.en.vec --tgt_emb data/wiki.es.vec --mapping_path dumped/debug/xxx --grid '{"dico_method": ["nn", "csls_knn_10"], "max_vocab": [50000, 200000], "dico_max_rank": [0, 15000]}'
+
+import os
+import argparse
+import torch
+
+from src.utils import bool_flag, initialize_exp
+from src.sweep import get_configs, write_results
+from src.pareto import PARETO_PARAMS, get_max_vocab, load_space, run_config, get_pareto_frontier, log_frontier
+
+
+# main
+parser = argparse.ArgumentParser(description='Accuracy / speed / memory trade-offs of the retrieval settings')
+parser.add_argument("--verbose", type=int, default=2, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--exp_path", type=str, default="", help="Where to store experiment logs and results")
+parser.add_argument("--exp_name", type=str, default="pareto", help="Experiment name")
+parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
+parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
+
+# sweep
+parser.add_argument("--grid", type=str, default="", help="Configurations (JSON, or JSON file): a list of configurations, or a dictionary of parameter values to combine (%s)" % ', '.join(PARETO_PARAMS))
+parser.add_argument("--metric", type=str, default="precision_at_1", help="Quality metric of the frontier (precision_at_1 / precision_at_5 / precision_at_10)")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of each configuration")
+parser.add_argument("--warmup", type=int, default=1, help="Number of untimed runs of each configuration")
+
+# data
+parser.add_argument("--src_lang", type=str, default="", help="Source language")
+parser.add_argument("--tgt_lang", type=str, default="", help="Target language")
+parser.add_argument("--src_emb", type=str, default="", help="Reload source embeddings")
+parser.add_argument("--tgt_emb", type=str, default="", help="Reload target embeddings")
+parser.add_argument("--mapping_path", type=str, default="", help="Experiment folder with the best mappings (best_mapping.<lang>.pth, default: the embeddings are already aligned)")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--dico_eval", type=str, default="default", help="Path to evaluation dictionary")
+parser.add_argument("--dico_path", type=str, default="", help="Folder of the default train / evaluation dictionaries (default: $MUSE_DIC_EVAL_PATH, or data/crosslingual/dictionaries)")
+# retrieval settings (defaults of the configurations)
+parser.add_argument("--dico_method", type=str, default="csls_knn_10", help="Scoring method (nn/invsm_beta_30/csls_knn_10)")
+parser.add_argument("--max_vocab", type=int, default=200000, help="Maximum vocabulary size (-1 to disable)")
+parser.add_argument("--dico_max_rank", type=int, default=0, help="Translations are searched among the dico_max_rank most frequent target words (0 to disable)")
+parser.add_argument("--block_size", type=int, default=0, help="Block size of the CSLS / inverted softmax passes (0: default of the method)")
+
+
+# parse parameters
+params = parser.parse_args()
+
+# check parameters
+assert not params.cuda or torch.cuda.is_available()
+assert params.grid, "no configuration to sweep"
+assert params.metric in ["precision_at_1", "precision_at_5", "precision_at_10"]
+assert params.repeat >= 1 and params.warmup >= 0
+assert params.src_lang and params.tgt_lang
+assert os.path.isfile(params.src_emb)
+assert os.path.isfile(params.tgt_emb)
+assert not params.mapping_path or os.path.isdir(params.mapping_path)
+assert params.dico_eval == 'default' or os.path.isfile(params.dico_eval)
+assert not params.dico_path or os.path.isdir(params.dico_path)
+configs = get_configs(params.grid, PARETO_PARAMS)
+for config in configs:
+    method = config.get('dico_method', params.dico_method)
+    assert method == 'nn' or method.startswith('csls_knn_') or method.startswith('invsm_beta_'), method
+    assert config.get('dico_max_rank', params.dico_max_rank) >= 0 and config.get('block_size', params.block_size) >= 0
+
+# build logger, and load the spaces once (with the largest vocabulary)
+logger = initialize_exp(params)
+params.max_vocab = get_max_vocab(configs, params)
+spaces = [load_space(params.src_lang, params.src_emb, params), load_space(params.tgt_lang, params.tgt_emb, params)]
+
+# evaluate each configuration
+logger.info('Running %i configurations ...' % len(configs))
+rows = [run_config('%03i' % i, config, spaces, params) for i, config in enumerate(configs)]
+
+# Pareto frontier (best metric / time / memory trade-offs)
+frontier = get_pareto_frontier(rows, params.metric)
+frontier_ids = set(row['id'] for row in frontier)
+for row in rows:
+    row['pareto'] = int(row['id'] in frontier_ids)
+write_results(rows, os.path.join(params.exp_path, 'results.tsv'), PARETO_PARAMS)
+write_results(frontier, os.path.join(params.exp_path, 'pareto.tsv'), PARETO_PARAMS)
+log_frontier(frontier, params.metric)
@@ -0,0 +1,83 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python serve.py --src_lang en --tgt_lang es --src_emb data/wiki.en.vec --tgt_emb data/wiki.es.vec --mapping_path dumped/debug/xxx --port 8080
+# curl "localhost:8080/translate?word=house&k=5"
+# curl -X POST localhost:8080/reload -d '{"mapping_path": "dumped/debug/yyy"}'
+
+import os
+import asyncio
+import argparse
+
+from src.utils import bool_flag, initialize_exp, load_embeddings, normalize_embeddings
+from src.server import TranslationService, LookupServer
+
+
+# main
+parser = argparse.ArgumentParser(description='Translation lookup server')
+parser.add_argument("--verbose", type=int, default=2, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--exp_path", type=str, default="", help="Where to store experiment logs and models")
+parser.add_argument("--exp_name", type=str, default="debug", help="Experiment name")
+parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
+parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
+# data
+parser.add_argument("--src_lang", type=str, default="", help="Source language")
+parser.add_argument("--tgt_lang", type=str, default="", help="Target languages (space separated)")
+parser.add_argument("--src_emb", type=str, default="", help="Reload source embeddings")
+parser.add_argument("--tgt_emb", type=str, default="", help="Reload target embeddings (space separated)")
+parser.add_argument("--max_vocab", type=int, default=200000, help="Maximum vocabulary size (-1 to disable)")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--mapping_path", type=str, default="", help="Experiment folder with the best mappings (best_mapping.<lang>.pth)")
+# server
+parser.add_argument("--method", type=str, default="csls_knn_10", help="Scoring method (nn/invsm_beta_30/csls_knn_10)")
+parser.add_argument("--topk", type=int, default=10, help="Default number of translations per word")
+parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+parser.add_argument("--port", type=int, default=8080, help="Port to bind")
+parser.add_argument("--max_batch", type=int, default=4096, help="Maximum number of words translated in a batch")
+parser.add_argument("--batch_wait", type=float, default=2, help="Time (in ms) concurrent lookups are gathered for before being translated together")
+
+
+# parse parameters
+params = parser.parse_args()
+params.tgt_lang = params.tgt_lang.split()
+params.tgt_emb = params.tgt_emb.split()
+
+# check parameters
+assert params.src_lang and len(params.tgt_lang) > 0
+assert len(params.tgt_lang) == len(params.tgt_emb)
+assert os.path.isfile(params.src_emb)
+assert all(os.path.isfile(emb) for emb in params.tgt_emb)
+assert os.path.isdir(params.mapping_path)
+assert params.method == 'nn' or params.method.startswith('csls_knn_') or params.method.startswith('invsm_beta_')
+assert params.topk >= 1 and params.max_batch >= 1 and params.batch_wait >= 0
+
+# build logger / embeddings
+logger = initialize_exp(params)
+
+
+def load_normalized_embeddings(lang, emb_path):
+    """
+    Reload embeddings and normalize them.
+    """
+    dico, emb = load_embeddings(lang, emb_path, params)
+    normalize_embeddings(emb, params.normalize_embeddings)
+    return dico, emb.cuda() if params.cuda else emb
+
+
+src_dico, src_emb = load_normalized_embeddings(params.src_lang, params.src_emb)
+tgt_dico, tgt_emb = {}, {}
+for lang, emb_path in zip(params.tgt_lang, params.tgt_emb):
+    tgt_dico[lang], tgt_emb[lang] = load_normalized_embeddings(lang, emb_path)
+
+# serve
+service = TranslationService(src_dico, src_emb, tgt_dico, tgt_emb, params)
+server = LookupServer(service, params)
+try:
+    asyncio.run(server.serve(params.host, params.port))
+except KeyboardInterrupt:
+    logger.info('Stopping the server.')
@@ -0,0 +1,242 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import gc
+import ctypes
+import ctypes.util
+import time
+import argparse
+from logging import getLogger
+from collections import OrderedDict
+import numpy as np
+import torch
+from torch import nn
+
+from .utils import get_nn_avg_dist, read_txt_embeddings
+from .dictionary import Dictionary
+from .dico_builder import get_candidates, cross_match_dictionary
+from .trainer import Trainer
+from .evaluation.word_translation import get_word_translation_accuracy
+from .instrument import get_memory, get_peak_memory
+from .synthetic import generate_languages, get_translation_pairs, write_txt_embeddings, write_dictionary
+
+
+logger = getLogger()
+
+# number of (training) dictionary pairs, and of evaluated pairs
+N_DICO = 10000
+N_EVAL = 1500
+
+
+def release_memory():
+    """
+    Collect garbage, and return the free memory of the allocator to the system
+    (glibc keeps freed memory, that later allocations reuse without growing the
+    resident memory), so that peak memory measures the memory a run allocates.
+    """
+    gc.collect()
+    try:
+        ctypes.CDLL(ctypes.util.find_library('c')).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+class BenchmarkData(object):
+
+    def __init__(self, params):
+        """
+        Synthetic inputs of the benchmarks: `params.n_langs` languages (a source
+        and target languages) of `params.n_words` words in dimension `params.emb_dim`,
+        their dictionaries, ground-truth translations, and files in `params.data_path`.
+        """
+        self.params = params
+        langs = ['l%i' % i for i in range(params.n_langs)]
+        self.src_lang, self.tgt_langs = langs[0], langs[1:]
+        languages = generate_languages(langs, params.n_words, params.emb_dim, seed=params.seed)
+        self.words = {lang: languages[lang][0] for lang in langs}
+        self.emb = {}
+        for lang in langs:
+            emb = torch.from_numpy(languages[lang][1])
+            emb = emb / emb.norm(2, 1, keepdim=True)
+            self.emb[lang] = emb.cuda() if params.cuda else emb
+        self.dico = {lang: Dictionary.from_words(self.words[lang], lang) for lang in langs}
+        self.pairs = {lang: get_translation_pairs(languages[self.src_lang], languages[lang]) for lang in self.tgt_langs}
+        if len(self.tgt_langs) > 1:
+            self.pairs_inbn = get_translation_pairs(languages[self.tgt_langs[0]], languages[self.tgt_langs[1]])
+
+        # embedding file, and evaluation dictionary
+        tgt_lang = self.tgt_langs[0]
+        self.emb_path = os.path.join(params.data_path, '%s.vec' % self.src_lang)
+        write_txt_embeddings(self.emb_path, self.words[self.src_lang], languages[self.src_lang][1])
+        start = min(5000, params.n_words // 2)
+        self.dico_eval = os.path.join(params.data_path, '%s-%s.eval.txt' % (self.src_lang, tgt_lang))
+        write_dictionary(self.dico_eval, self.pairs[tgt_lang][start:start + N_EVAL], self.words[self.src_lang], self.words[tgt_lang])
+
+
+def get_dico_params(data, method, prefilter=''):
+    return argparse.Namespace(dico_method=method, dico_max_rank=min(N_DICO, data.params.n_words),
+                              dico_max_size=0, dico_min_size=0, dico_threshold=0, dico_prefilter=prefilter,
+                              cuda=data.params.cuda)
+
+
+def bench_get_candidates(method, prefilter=''):
+    def setup(data):
+        params = get_dico_params(data, method, prefilter)
+        src_emb, tgt_emb = data.emb[data.src_lang], data.emb[data.tgt_langs[0]]
+        return lambda: get_candidates(src_emb, tgt_emb, params)
+    return setup
+
+
+def bench_get_nn_avg_dist(data):
+    src_emb, tgt_emb = data.emb[data.src_lang], data.emb[data.tgt_langs[0]]
+    return lambda: get_nn_avg_dist(tgt_emb, src_emb, 10)
+
+
+def bench_cross_match_dictionary(data):
+    if len(data.tgt_langs) < 2:
+        return None
+    params = argparse.Namespace(tgt_lang=data.tgt_langs, cuda=data.params.cuda)
+    n = min(N_DICO, data.params.n_words)
+    dico = {lang: data.pairs[lang][:n] for lang in data.tgt_langs}
+    dico_inbn = {data.tgt_langs[1]: data.pairs_inbn[:n]}
+    return lambda: cross_match_dictionary(data.tgt_langs, dico, dico_inbn, params)
+
+
+def bench_generalized_procrustes(data):
+    if len(data.tgt_langs) < 2:
+        return None
+    dim = data.params.emb_dim
+    params = argparse.Namespace(src_lang=data.src_lang, tgt_lang=data.tgt_langs, cuda=data.params.cuda,
+                                src_dico=data.dico[data.src_lang],
+                                tgt_dico={lang: data.dico[lang] for lang in data.tgt_langs})
+
+    def embeddings(lang):
+        emb = nn.Embedding(data.params.n_words, dim, sparse=True)
+        emb.weight.data.copy_(data.emb[lang])
+        return emb
+
+    mapping = OrderedDict()
+    for lang in [data.src_lang] + data.tgt_langs:
+        mapping[lang] = nn.Linear(dim, dim, bias=False)
+        mapping[lang].weight.data.copy_(torch.eye(dim))
+    src_emb = embeddings(data.src_lang)
+    tgt_emb = {lang: embeddings(lang) for lang in data.tgt_langs}
+    if data.params.cuda:
+        for module in [src_emb] + list(tgt_emb.values()) + list(mapping.values()):
+            module.cuda()
+    trainer = Trainer(src_emb, tgt_emb, mapping, None, params)
+    n = min(N_DICO, data.params.n_words)
+    dico = [data.pairs[data.tgt_langs[0]][:n, :1]] + [data.pairs[lang][:n, 1:] for lang in data.tgt_langs]
+    trainer.dico = torch.from_numpy(np.concatenate(dico, 1))
+    trainer.dico = trainer.dico.cuda() if data.params.cuda else trainer.dico
+    return lambda: trainer.generalized_procrustes(True, True)
+
+
+def bench_read_txt_embeddings(data):
+    params = argparse.Namespace(src_lang=data.src_lang, emb_dim=data.params.emb_dim, max_vocab=-1, cuda=False)
+    return lambda: read_txt_embeddings(params, data.emb_path, data.src_lang, False)
+
+
+def bench_word_translation(method):
+    def setup(data):
+        src_lang, tgt_lang = data.src_lang, data.tgt_langs[0]
+        src_dico, tgt_dico = data.dico[src_lang], data.dico[tgt_lang]
+        return lambda: get_word_translation_accuracy(
+            src_lang, src_dico.word2id, data.emb[src_lang], tgt_lang, tgt_dico.word2id, data.emb[tgt_lang],
+            method, src_dico.id2word, tgt_dico.id2word, data.dico_eval
+        )
+    return setup
+
+
+BENCHMARKS = OrderedDict([
+    ('get_candidates-nn', bench_get_candidates('nn')),
+    ('get_candidates-csls_knn_10', bench_get_candidates('csls_knn_10')),
+    ('get_candidates-csls_knn_10-prefilter', bench_get_candidates('csls_knn_10', 'full')),
+    ('get_nn_avg_dist', bench_get_nn_avg_dist),
+    ('cross_match_dictionary', bench_cross_match_dictionary),
+    ('generalized_procrustes', bench_generalized_procrustes),
+    ('read_txt_embeddings', bench_read_txt_embeddings),
+    ('word_translation-nn', bench_word_translation('nn')),
+    ('word_translation-csls_knn_10', bench_word_translation('csls_knn_10')),
+])
+
+
+def measure(fn, repeat, warmup=1, cuda=False):
+    """
+    Time a function (`repeat` runs, after `warmup` runs), and measure the peak
+    memory it allocates on top of its inputs (GPU memory with `cuda`).
+    Returns the times and the peak memory of the runs, and the result of the last run.
+    """
+    for _ in range(warmup):
+        fn()
+    times, peak_mem = [], []
+    for _ in range(repeat):
+        release_memory()
+        if cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start_mem = get_memory()
+        get_peak_memory()
+        start = time.perf_counter()
+        result = fn()
+        if cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+        peak = get_peak_memory()
+        if cuda:
+            peak_mem.append(torch.cuda.max_memory_allocated() / 1024. ** 2)
+        elif peak is not None:
+            peak_mem.append(peak - start_mem)
+    return times, peak_mem, result
+
+
+def run_benchmark(name, data, repeat, warmup=1):
+    """
+    Time a benchmark (`repeat` runs, after `warmup` runs), and measure the peak
+    memory it allocates on top of the inputs. Returns None if the benchmark
+    does not apply to the inputs (e.g. a single target language).
+    """
+    fn = BENCHMARKS[name](data)
+    if fn is None:
+        logger.warning('Skipping %s (requires at least 2 target languages)' % name)
+        return None
+    times, peak_mem, _ = measure(fn, repeat, warmup, data.params.cuda)
+    result = OrderedDict([
+        ('time', float(np.median(times))),
+        ('min_time', float(np.min(times))),
+        ('times', times),
+        ('peak_mem', max(peak_mem) if len(peak_mem) > 0 else None),
+    ])
+    logger.info('%s: %.4fs (min %.4fs), peak memory %s' % (
+        name, result['time'], result['min_time'],
+        'n/a' if result['peak_mem'] is None else '%.1fMB' % result['peak_mem']))
+    return result
+
+
+def compare_results(results, baseline, threshold, min_mem=1.):
+    """
+    Compare the results to a baseline. Returns the regressions: the benchmarks
+    that are slower, or allocate more memory (at least `min_mem` MB more),
+    by more than a `threshold` ratio.
+    """
+    if baseline['config'] != results['config']:
+        logger.warning('The baseline was run with a different configuration: %s' % baseline['config'])
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if result is None or base is None:
+            continue
+        ratio = result['time'] / base['time']
+        logger.info('%-30s %9.4fs -> %9.4fs (x%.2f)' % (name, base['time'], result['time'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append('%s: time %.4fs -> %.4fs (x%.2f)' % (name, base['time'], result['time'], ratio))
+        if result['peak_mem'] is not None and base['peak_mem'] is not None:
+            diff = result['peak_mem'] - base['peak_mem']
+            if diff > min_mem and result['peak_mem'] > (1 + threshold) * base['peak_mem']:
+                regressions.append('%s: peak memory %.1fMB -> %.1fMB' % (name, base['peak_mem'], result['peak_mem']))
+    return regressions
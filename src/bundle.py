@@ -0,0 +1,152 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import json
+import struct
+from logging import getLogger
+import numpy as np
+
+from .dictionary import Dictionary
+
+
+BUNDLE_MAGIC = b'MUSEBNDL'
+BUNDLE_VERSION = 2
+BUNDLE_DTYPES = {'float32': np.float32, 'float16': np.float16}
+ALIGN = 64
+
+logger = getLogger()
+
+# Layout of a bundle (little-endian):
+#   magic (8 bytes) | version (uint32) | header size (uint32) | JSON header | data
+# The data sections start at offsets aligned on 64 bytes (relative to the data start).
+# For each language, the header gives the offset / size of:
+#   - `vectors`: the embeddings, a contiguous (n_words, dim) float32 / float16 matrix
+#   - `offsets`: the (n_words + 1) int64 offsets of the words in `words`
+#   - `words`: the UTF-8 encoded words, concatenated in index order
+#   - `hashes` / `hash_ids`: the sorted uint64 hashes of the words, and the int64
+#     corresponding word indices (the index of `Dictionary`)
+#   - `mapping`: the (dim, dim) float32 mapping of the language (optional)
+
+
+class Bundle(object):
+
+    def __init__(self, path):
+        """
+        Open a bundle. The file is memory-mapped (copy-on-write), nothing
+        is read before it is used.
+        """
+        with open(path, 'rb') as f:
+            magic, version, header_size = struct.unpack('<8sII', f.read(16))
+            if magic != BUNDLE_MAGIC:
+                raise Exception('%s is not an embedding bundle' % path)
+            if version != BUNDLE_VERSION:
+                raise Exception('Unsupported bundle version %i in %s' % (version, path))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        self.path = path
+        self.data_start = _align(16 + header_size)
+        self.data = np.memmap(path, dtype=np.uint8, mode='c')
+        self.dtype = header['dtype']
+        self.dim = header['dim']
+        self.langs = header['langs']
+        self.sections = header['sections']
+        self.metadata = header['metadata']
+
+    def get_section(self, lang, name, dtype, shape):
+        offset, size = self.sections[lang][name]
+        start = self.data_start + offset
+        return self.data[start:start + size].view(dtype).reshape(shape)
+
+    def get_embeddings(self, lang, n_words=None):
+        """
+        Embeddings of a language (a memory-mapped array).
+        """
+        n = self.sections[lang]['n_words']
+        vectors = self.get_section(lang, 'vectors', BUNDLE_DTYPES[self.dtype], (n, self.dim))
+        return vectors if n_words is None else vectors[:n_words]
+
+    def get_dictionary(self, lang, n_words=None):
+        """
+        Vocabulary of a language, optionally restricted to its `n_words` first words.
+        """
+        n = self.sections[lang]['n_words']
+        offsets = self.get_section(lang, 'offsets', np.int64, (n + 1,))
+        words = self.get_section(lang, 'words', np.uint8, (-1,))
+        hashes = self.get_section(lang, 'hashes', np.uint64, (n,))
+        hash_ids = self.get_section(lang, 'hash_ids', np.int64, (n,))
+        return Dictionary.from_buffers(words, offsets, lang, n_words, (hashes, hash_ids))
+
+    def get_mapping(self, lang):
+        """
+        Mapping of a language, None if it was not stored.
+        """
+        if 'mapping' not in self.sections[lang]:
+            return None
+        return self.get_section(lang, 'mapping', np.float32, (self.dim, self.dim))
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_bundle(path, embeddings, dicos, mappings=None, metadata=None, dtype='float32'):
+    """
+    Write the aligned embeddings of several languages to a single bundle.
+    `embeddings` / `dicos` / `mappings` are dictionaries indexed by language,
+    `metadata` is any JSON-serializable description of the run.
+    """
+    assert dtype in BUNDLE_DTYPES
+    mappings = {} if mappings is None else mappings
+    langs = list(embeddings.keys())
+    dim = next(iter(embeddings.values())).shape[1]
+
+    # build the sections
+    sections, arrays, offset = {}, [], 0
+    for lang in langs:
+        dico = dicos[lang]
+        n = len(dico)
+        assert embeddings[lang].shape == (n, dim)
+        # the index of a pruned dictionary also refers to the pruned words
+        selected = dico.sorted_ids < n
+        lang_arrays = [
+            ('vectors', np.ascontiguousarray(embeddings[lang], dtype=BUNDLE_DTYPES[dtype])),
+            ('offsets', np.ascontiguousarray(dico.offsets[:n + 1], dtype=np.int64)),
+            ('words', np.ascontiguousarray(dico.buffer[:dico.offsets[n]], dtype=np.uint8)),
+            ('hashes', np.ascontiguousarray(dico.sorted_hashes[selected], dtype=np.uint64)),
+            ('hash_ids', np.ascontiguousarray(dico.sorted_ids[selected], dtype=np.int64)),
+        ]
+        if lang in mappings:
+            assert mappings[lang].shape == (dim, dim)
+            lang_arrays.append(('mapping', np.ascontiguousarray(mappings[lang], dtype=np.float32)))
+        sections[lang] = {'n_words': n}
+        for name, array in lang_arrays:
+            offset = _align(offset)
+            sections[lang][name] = [offset, array.nbytes]
+            arrays.append((offset, array))
+            offset += array.nbytes
+
+    header = json.dumps({
+        'dtype': dtype,
+        'dim': dim,
+        'langs': langs,
+        'sections': sections,
+        'metadata': {} if metadata is None else metadata,
+    }).encode('utf-8')
+    data_start = _align(16 + len(header))
+
+    # write next to the destination, and rename
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<8sII', BUNDLE_MAGIC, BUNDLE_VERSION, len(header)))
+        f.write(header)
+        for offset, array in arrays:
+            f.write(b'\0' * (data_start + offset - f.tell()))
+            array.tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.info('Wrote a bundle of %i languages (%s) to %s' % (len(langs), ', '.join(langs), path))
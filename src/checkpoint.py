@@ -0,0 +1,74 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import atexit
+import threading
+from logging import getLogger
+from queue import Queue
+import torch
+
+
+CHECKPOINT_NAME = 'checkpoint.pth'
+
+logger = getLogger()
+
+
+def atomic_save(obj, path):
+    """
+    Save an object with `torch.save`. The file is written next to its
+    destination and renamed, so that `path` is never left half-written.
+    """
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AsyncWriter(object):
+
+    def __init__(self):
+        """
+        Save objects to disk in a background thread, in submission order.
+        Objects must not be modified after they are submitted.
+        """
+        self.queue = Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        # do not lose pending writes when the script ends
+        atexit.register(self.wait)
+
+    def _run(self):
+        while True:
+            obj, path = self.queue.get()
+            try:
+                atomic_save(obj, path)
+            except Exception as e:
+                logger.error("Could not write %s: %s" % (path, e))
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def save(self, obj, path):
+        """
+        Schedule the writing of an object.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((obj, path))
+
+    def wait(self):
+        """
+        Wait for all scheduled writes to be on disk.
+        """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
@@ -6,14 +6,123 @@
 #
 
 from logging import getLogger
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import numpy as np
 from .utils import get_nn_avg_dist
+from .instrument import stage, timed, current_stage, inherit_stage
 
 
 logger = getLogger()
 
+# immutable dictionary generation parameters (used instead of modified copies of `params`)
+DicoParams = namedtuple('DicoParams', ['dico_method', 'dico_build', 'dico_threshold', 'dico_max_rank',
+                                       'dico_min_size', 'dico_max_size', 'dico_prefilter', 'cuda'])
 
+
+def get_score_stats(emb1, emb2, method, bs=1024):
+    """
+    Precompute the terms of a scoring method that only depend on the target words:
+    - `csls_knn_K`: the average similarity of each target word to its K nearest source words
+    - `invsm_beta_B`: the softmax normalization of each target word over all source words
+    """
+    if method == 'nn':
+        return None
+    elif method.startswith('csls_knn_'):
+        knn = method[len('csls_knn_'):]
+        assert knn.isdigit()
+        return torch.from_numpy(get_nn_avg_dist(emb1, emb2, int(knn))).type_as(emb2)
+    elif method.startswith('invsm_beta_'):
+        beta = float(method[len('invsm_beta_'):])
+        norms = emb2.new_zeros(emb2.size(0))
+        for i in range(0, emb1.size(0), bs):
+            norms.add_(emb2.mm(emb1[i:i + bs].transpose(0, 1)).mul_(beta).exp_().sum(1))
+        return norms
+    else:
+        raise Exception('Unknown scoring method: "%s"' % method)
+
+
+def get_scores(query, emb2, method, stats=None, query_stats=None):
+    """
+    Score a block of (mapped) source words against all the target words.
+    `stats` are the target terms returned by `get_score_stats`. For CSLS,
+    `query_stats` are the average similarities of the queries to their K
+    nearest target words, they are computed on the fly if not provided.
+    """
+    scores = emb2.mm(query.transpose(0, 1)).transpose(0, 1)
+    if method == 'nn':
+        return scores
+    elif method.startswith('csls_knn_'):
+        if query_stats is None:
+            knn = int(method[len('csls_knn_'):])
+            query_stats = torch.from_numpy(get_nn_avg_dist(emb2, query, knn)).type_as(query)
+        scores.mul_(2)
+        scores.sub_(query_stats[:, None] + stats[None, :])
+        return scores
+    elif method.startswith('invsm_beta_'):
+        beta = float(method[len('invsm_beta_'):])
+        scores.mul_(beta).exp_()
+        scores.div_(stats[None, :])
+        return scores
+    else:
+        raise Exception('Unknown scoring method: "%s"' % method)
+
+
+def translate_blocks(blocks, emb1, emb2, method, topk, n_workers=1):
+    """
+    Translate blocks of source word indices, in a pool of threads sharing the
+    (mapped, normalized) embeddings. Yield the `(scores, targets)` of the `topk`
+    best translations of each block, in order. Only a bounded number of blocks
+    are in flight, so that `blocks` can be an arbitrarily long stream.
+    """
+    stats = get_score_stats(emb1, emb2, method)
+
+    def translate(ids):
+        query = emb1[torch.LongTensor(ids).to(emb1.device)]
+        scores = get_scores(query, emb2, method, stats)
+        best_scores, best_targets = scores.topk(topk, dim=1, largest=True, sorted=True)
+        return best_scores.cpu().numpy(), best_targets.cpu().numpy()
+
+    if n_workers <= 1:
+        for ids in blocks:
+            yield translate(ids)
+        return
+
+    n_threads = torch.get_num_threads()
+    worker_threads = max(1, n_threads // n_workers)
+
+    def translate_worker(ids):
+        torch.set_num_threads(worker_threads)
+        return translate(ids)
+
+    torch.set_num_threads(worker_threads)
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            pending = deque()
+            for ids in blocks:
+                pending.append(executor.submit(translate_worker, ids))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+    finally:
+        torch.set_num_threads(n_threads)
+
+
+def get_prefilter(params):
+    """
+    Rank prefilter of the dictionary generation: the source and target words are
+    restricted to the `dico_max_rank` most frequent ones before they are scored.
+    The CSLS / inverted softmax terms are computed over the full vocabularies
+    ("full"), or over the restricted ones ("window"). '' when disabled.
+    """
+    prefilter = getattr(params, 'dico_prefilter', '')
+    assert prefilter in ['', 'full', 'window']
+    return prefilter if params.dico_max_rank > 0 else ''
+
+
+@timed('candidates')
 def get_candidates(emb1, emb2, params):
     """
     Get best translation pairs candidates.
@@ -23,10 +132,19 @@ def get_candidates(emb1, emb2, params):
     all_scores = []
     all_targets = []
 
-    # number of source words to consider
+    # number of source words to consider (the maximum rank may exceed small vocabularies)
     n_src = emb1.size(0)
     if params.dico_max_rank > 0 and not params.dico_method.startswith('invsm_beta_'):
-        n_src = params.dico_max_rank
+        n_src = min(params.dico_max_rank, n_src)
+
+    # embeddings of the words the CSLS / inverted softmax terms are computed over
+    stats_emb1, stats_emb2 = emb1, emb2
+    prefilter = get_prefilter(params)
+    if prefilter:
+        n_src = min(params.dico_max_rank, n_src)
+        emb2 = emb2[:params.dico_max_rank]
+        if prefilter == 'window':
+            stats_emb1, stats_emb2 = emb1[:n_src], emb2
 
     # nearest neighbors
     if params.dico_method == 'nn':
@@ -35,7 +153,7 @@ def get_candidates(emb1, emb2, params):
         for i in range(0, n_src, bs):
 
             # compute target words scores
-            scores = emb2.mm(emb1[i:min(n_src, i + bs)].transpose(0, 1)).transpose(0, 1)
+            scores = get_scores(emb1[i:min(n_src, i + bs)], emb2, 'nn')
             best_scores, best_targets = scores.topk(2, dim=1, largest=True, sorted=True)
 
             # update scores / potential targets
@@ -54,11 +172,11 @@ def get_candidates(emb1, emb2, params):
         for i in range(0, emb2.size(0), bs):
 
             # compute source words scores
-            scores = emb1.mm(emb2[i:i + bs].transpose(0, 1))
+            scores = stats_emb1.mm(emb2[i:i + bs].transpose(0, 1))
             scores.mul_(beta).exp_()
             scores.div_(scores.sum(0, keepdim=True).expand_as(scores))
 
-            best_scores, best_targets = scores.topk(2, dim=1, largest=True, sorted=True)
+            best_scores, best_targets = scores[:n_src].topk(2, dim=1, largest=True, sorted=True)
 
             # update scores / potential targets
             all_scores.append(best_scores.cpu())
@@ -78,18 +196,17 @@ def get_candidates(emb1, emb2, params):
         knn = int(knn)
 
         # average distances to k nearest neighbors
-        average_dist1 = torch.from_numpy(get_nn_avg_dist(emb2, emb1, knn))
-        average_dist2 = torch.from_numpy(get_nn_avg_dist(emb1, emb2, knn))
-        average_dist1 = average_dist1.type_as(emb1)
-        average_dist2 = average_dist2.type_as(emb2)
+        with stage('r_terms'):
+            average_dist1 = torch.from_numpy(get_nn_avg_dist(stats_emb2, emb1[:n_src] if prefilter else emb1, knn))
+            average_dist2 = get_score_stats(stats_emb1, emb2, params.dico_method)
+            average_dist1 = average_dist1.type_as(emb1)
 
         # for every source word
         for i in range(0, n_src, bs):
 
             # compute target words scores
-            scores = emb2.mm(emb1[i:min(n_src, i + bs)].transpose(0, 1)).transpose(0, 1)
-            scores.mul_(2)
-            scores.sub_(average_dist1[i:min(n_src, i + bs)][:, None] + average_dist2[None, :])
+            scores = get_scores(emb1[i:min(n_src, i + bs)], emb2, params.dico_method,
+                                average_dist2, average_dist1[i:min(n_src, i + bs)])
             best_scores, best_targets = scores.topk(2, dim=1, largest=True, sorted=True)
 
             # update scores / potential targets
@@ -99,14 +216,85 @@ def get_candidates(emb1, emb2, params):
         all_scores = torch.cat(all_scores, 0)
         all_targets = torch.cat(all_targets, 0)
 
+    # sanity check
+    assert all_scores.size() == all_targets.size() == (n_src, 2)
+
+    return select_candidates(all_scores, all_targets, params)
+
+
+@timed('candidates')
+def get_shared_candidates(emb1, emb2, methods, params):
+    """
+    Get best translation pairs candidates of several methods (nn / csls_knn_K),
+    as `get_candidates` with each `dico_method`. The similarities of the source
+    words to the target words are computed once, and scored with every method.
+    """
+    bs = 128
+    n_src = emb1.size(0)
+    if params.dico_max_rank > 0:
+        n_src = min(params.dico_max_rank, n_src)
+
+    assert all(method == 'nn' or method.startswith('csls_knn_') for method in methods)
+    knns = sorted(set(int(method[len('csls_knn_'):]) for method in methods if method != 'nn'))
+
+    prefilter = get_prefilter(params)
+    full_emb2 = emb2
+    if prefilter:
+        emb2 = emb2[:params.dico_max_rank]
+
+    # average distances of the target words to their k nearest source words, and
+    # of the source words to all the targets with the "full" prefilter (they are
+    # computed from the similarities to the scored target words otherwise)
+    with stage('r_terms'):
+        stats_emb1 = emb1[:n_src] if prefilter == 'window' else emb1
+        stats = {knn: get_score_stats(stats_emb1, emb2, 'csls_knn_%i' % knn) for knn in knns}
+        query_stats = {}
+        if prefilter == 'full':
+            query_stats = {knn: torch.from_numpy(get_nn_avg_dist(full_emb2, emb1[:n_src], knn)).type_as(emb1)
+                           for knn in knns}
+
+    all_scores = {method: [] for method in methods}
+    all_targets = {method: [] for method in methods}
+
+    # for every source word
+    for i in range(0, n_src, bs):
+
+        # similarities to the target words, and average distance to the k nearest ones
+        similarities = get_scores(emb1[i:min(n_src, i + bs)], emb2, 'nn')
+        if len(knns) > 0 and len(query_stats) == 0:
+            best_similarities = similarities.topk(knns[-1], dim=1, largest=True, sorted=True)[0]
+
+        for method in methods:
+            if method == 'nn':
+                scores = similarities
+            else:
+                knn = int(method[len('csls_knn_'):])
+                if len(query_stats) > 0:
+                    average_dist = query_stats[knn][i:min(n_src, i + bs)]
+                else:
+                    average_dist = best_similarities[:, :knn].mean(1)
+                scores = similarities.mul(2)
+                scores.sub_(average_dist[:, None] + stats[knn][None, :])
+            best_scores, best_targets = scores.topk(2, dim=1, largest=True, sorted=True)
+
+            # update scores / potential targets
+            all_scores[method].append(best_scores.cpu())
+            all_targets[method].append(best_targets.cpu())
+
+    return {method: select_candidates(torch.cat(all_scores[method], 0), torch.cat(all_targets[method], 0), params)
+            for method in methods}
+
+
+def select_candidates(all_scores, all_targets, params):
+    """
+    Select the translation pairs of the best and second best `all_targets` of
+    each source word, and of their `all_scores`, by score confidence.
+    """
     all_pairs = torch.cat([
         torch.arange(0, all_targets.size(0)).long().unsqueeze(1),
         all_targets[:, 0].unsqueeze(1)
     ], 1)
 
-    # sanity check
-    assert all_scores.size() == all_pairs.size() == (n_src, 2)
-
     # sort pairs by score confidence
     diff = all_scores[:, 0] - all_scores[:, 1]
     reordered = diff.sort(0, descending=True)[1]
@@ -181,6 +369,7 @@ def build_pairwise_dictionary(src_emb, tgt_emb, params, s2t_candidates=None, t2s
     #pdb.set_trace()
     else: return np.array(dico)
 
+@timed('cross_match')
 def cross_match_dictionary(lang_list, dico, dico_inbn, params):
     final_dico = []
 
@@ -212,15 +401,51 @@ def cross_match_dictionary(lang_list, dico, dico_inbn, params):
 
     return dico.cuda() if params.cuda else dico
 
+def build_pairwise_dictionaries(emb_pairs, params, s2t_candidates=None, t2s_candidates=None):
+    """
+    Build several pairwise dictionaries concurrently, in a pool of threads
+    sharing the (read-only) embeddings. The intra-op threads are split between
+    the workers so that they do not oversubscribe the cores.
+    """
+    n_workers = getattr(params, 'dico_workers', 1)
+    n_workers = len(emb_pairs) if n_workers <= 0 else min(n_workers, len(emb_pairs))
+    if n_workers <= 1:
+        return [build_pairwise_dictionary(emb1, emb2, params, s2t_candidates, t2s_candidates)
+                for emb1, emb2 in emb_pairs]
+
+    n_threads = torch.get_num_threads()
+    worker_threads = max(1, n_threads // n_workers)
+    path = current_stage()
+
+    def build(emb1, emb2):
+        torch.set_num_threads(worker_threads)
+        with inherit_stage(path):
+            return build_pairwise_dictionary(emb1, emb2, params, s2t_candidates, t2s_candidates)
+
+    torch.set_num_threads(worker_threads)
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(build, emb1, emb2) for emb1, emb2 in emb_pairs]
+            return [future.result() for future in futures]
+    finally:
+        torch.set_num_threads(n_threads)
+
+
 def build_dictionary(src_emb, tgt_emb, params, support, s2t_candidates=None, t2s_candidates=None):
     dico, dico_inbn = {}, {} #dico --> source to target languages dico; dico_inbn --> between target languages dico (only works with two for now)
     lang_list = [params.tgt_lang[-1]] if not support else params.tgt_lang #only consider the last tagret language if no support
 
-    for lang in lang_list:
-        dico[lang] = build_pairwise_dictionary(src_emb,tgt_emb[lang],params, s2t_candidates, t2s_candidates)
+    # source to target dictionaries, and the dictionary between target languages, are independent
+    emb_pairs = [(src_emb, tgt_emb[lang]) for lang in lang_list]
+    if support and len(lang_list)>1:
+        emb_pairs.append((tgt_emb[params.tgt_lang[0]], tgt_emb[params.tgt_lang[1]]))
+    dicos = build_pairwise_dictionaries(emb_pairs, params, s2t_candidates, t2s_candidates)
+
+    for lang, lang_dico in zip(lang_list, dicos):
+        dico[lang] = lang_dico
 
     if support and len(lang_list)>1:
-        dico_inbn[params.tgt_lang[1]] = build_pairwise_dictionary(tgt_emb[params.tgt_lang[0]],tgt_emb[params.tgt_lang[1]],params, s2t_candidates, t2s_candidates)
+        dico_inbn[params.tgt_lang[1]] = dicos[-1]
     else: dico_inbn = None
 
     return cross_match_dictionary(lang_list, dico, dico_inbn, params)##TODO: why remove supervied pairs??
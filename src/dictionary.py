@@ -5,38 +5,224 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+from collections.abc import Mapping
 from logging import getLogger
+import numpy as np
 
 
 logger = getLogger()
 
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+FNV_MASK = 0xffffffffffffffff
+
+
+def encode_words(words):
+    """
+    Pack words into a UTF-8 buffer, with the offsets of each word.
+    """
+    encoded = [w.encode('utf-8') for w in words]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(w) for w in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def hash_word(encoded):
+    """
+    64-bit FNV-1a hash of an encoded word.
+    """
+    h = FNV_OFFSET
+    for c in encoded:
+        h = ((h ^ c) * FNV_PRIME) & FNV_MASK
+    return h
+
+
+def hash_words(buffer, offsets):
+    """
+    64-bit FNV-1a hashes of packed words, computed for all the words at once,
+    one byte position at a time (words are sorted by decreasing length, so
+    that the words still being hashed are a prefix).
+    """
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+    order = np.argsort(-lengths, kind='stable')
+    starts = starts[order]
+    neg_lengths = -lengths[order]
+    hashes = np.full(len(order), FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+    for k in range(-neg_lengths[0] if len(order) > 0 else 0):
+        n = np.searchsorted(neg_lengths, -k, side='left')
+        hashes[:n] ^= buffer[starts[:n] + k]
+        hashes[:n] *= prime
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result
+
+
+def equal_words(buffer1, offsets1, ids1, buffer2, offsets2, ids2):
+    """
+    Whether the words `ids1` of a packed buffer are equal to the words `ids2`
+    of another one (element-wise).
+    """
+    starts1, starts2 = offsets1[ids1], offsets2[ids2]
+    lengths = offsets1[ids1 + 1] - starts1
+    equal = lengths == offsets2[ids2 + 1] - starts2
+    for k in range(lengths.max() if len(lengths) > 0 else 0):
+        mask = equal & (lengths > k)
+        equal[mask] = buffer1[starts1[mask] + k] == buffer2[starts2[mask] + k]
+    return equal
+
+
+class WordList(Mapping):
+
+    def __init__(self, dico):
+        """
+        Read-only `id2word` view of a dictionary.
+        """
+        self.dico = dico
+
+    def __getitem__(self, i):
+        return self.dico[i]
+
+    def __len__(self):
+        return len(self.dico)
+
+    def __iter__(self):
+        return iter(range(len(self.dico)))
+
+    def __contains__(self, i):
+        return isinstance(i, (int, np.integer)) and 0 <= i < len(self.dico)
+
+
+class WordIndex(Mapping):
+
+    def __init__(self, dico):
+        """
+        Read-only `word2id` view of a dictionary.
+        """
+        self.dico = dico
+
+    def __getitem__(self, word):
+        return self.dico.index(word)
+
+    def __len__(self):
+        return len(self.dico)
+
+    def __iter__(self):
+        return self.dico.iter_words()
+
+    def __contains__(self, word):
+        return self.dico.find(word) >= 0
+
+    def get(self, word, default=None):
+        i = self.dico.find(word)
+        return default if i < 0 else i
+
+    def index_batch(self, words):
+        return self.dico.index_batch(words)
+
 
 class Dictionary(object):
 
     def __init__(self, id2word, word2id, lang):
+        """
+        Vocabulary of a language. Words are stored in a packed UTF-8 buffer with
+        their offsets, and looked up through their sorted 64-bit FNV-1a hashes.
+        `id2word` / `word2id` are read-only views with the interface of dicts.
+        """
         assert len(id2word) == len(word2id)
-        self.id2word = id2word
-        self.word2id = word2id
         self.lang = lang
+        self.build([id2word[i] for i in range(len(id2word))])
+
+    @classmethod
+    def from_words(cls, words, lang):
+        """
+        Build a dictionary from a list of unique words, in index order.
+        """
+        dico = cls.__new__(cls)
+        dico.lang = lang
+        dico.build(words)
+        return dico
+
+    @classmethod
+    def from_buffers(cls, buffer, offsets, lang, n_words=None, index=None):
+        """
+        Build a dictionary from packed words (e.g. memory-mapped), restricted to
+        its `n_words` first words. `index` is the `(sorted hashes, word indices)`
+        pair of a previously built dictionary, it is computed otherwise.
+        """
+        dico = cls.__new__(cls)
+        dico.lang = lang
+        dico.buffer = buffer
+        dico.offsets = offsets
+        dico.n_words = len(offsets) - 1
+        if index is None:
+            dico.build_index()
+        else:
+            dico.sorted_hashes, dico.sorted_ids = index
+        if n_words is not None:
+            dico.prune(n_words)
+        dico.check_valid()
+        return dico
+
+    def build(self, words):
+        """
+        Pack the words and build the index.
+        """
+        self.buffer, self.offsets = encode_words(words)
+        self.n_words = len(words)
+        self.build_index()
+        # words with identical hashes must be different
+        same = np.nonzero(self.sorted_hashes[1:] == self.sorted_hashes[:-1])[0]
+        if len(same) > 0:
+            ids1, ids2 = self.sorted_ids[same], self.sorted_ids[same + 1]
+            duplicates = equal_words(self.buffer, self.offsets, ids1, self.buffer, self.offsets, ids2)
+            assert not duplicates.any(), "duplicated word: %s" % self[ids1[duplicates][0]]
         self.check_valid()
 
+    def build_index(self):
+        hashes = hash_words(self.buffer, self.offsets)
+        self.sorted_ids = np.argsort(hashes, kind='stable')
+        self.sorted_hashes = hashes[self.sorted_ids]
+
+    def __getstate__(self):
+        return {k: np.asarray(v) if isinstance(v, np.ndarray) else v for k, v in self.__dict__.items()}
+
+    def __setstate__(self, state):
+        # dictionaries pickled with the previous, dict-based, implementation
+        if 'buffer' not in state:
+            self.lang = state['lang']
+            self.build([state['id2word'][i] for i in range(len(state['id2word']))])
+        else:
+            self.__dict__.update(state)
+
+    @property
+    def id2word(self):
+        return WordList(self)
+
+    @property
+    def word2id(self):
+        return WordIndex(self)
+
     def __len__(self):
         """
         Returns the number of words in the dictionary.
         """
-        return len(self.id2word)
+        return self.n_words
 
     def __getitem__(self, i):
         """
         Returns the word of the specified index.
         """
-        return self.id2word[i]
+        if not 0 <= i < self.n_words:
+            raise KeyError(i)
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
 
     def __contains__(self, w):
         """
         Returns whether a word is in the dictionary.
         """
-        return w in self.word2id
+        return self.find(w) >= 0
 
     def __eq__(self, y):
         """
@@ -44,29 +230,84 @@ class Dictionary(object):
         """
         self.check_valid()
         y.check_valid()
-        if len(self.id2word) != len(y):
+        if len(self) != len(y) or self.lang != y.lang:
             return False
-        return self.lang == y.lang and all(self.id2word[i] == y[i] for i in range(len(y)))
+        n_bytes = self.offsets[len(self)]
+        return (np.array_equal(self.offsets[:len(self) + 1], y.offsets[:len(y) + 1]) and
+                np.array_equal(self.buffer[:n_bytes], y.buffer[:n_bytes]))
 
     def check_valid(self):
         """
-        Check that the dictionary is valid.
+        Check that the dictionary is valid (words are checked to be unique
+        when the dictionary is built).
+        """
+        assert len(self.offsets) >= self.n_words + 1
+        assert len(self.sorted_hashes) == len(self.sorted_ids) == len(self.offsets) - 1
+        assert self.offsets[0] == 0 and self.offsets[self.n_words] <= len(self.buffer)
+
+    def iter_words(self, bs=4096):
+        """
+        Iterate over the words in index order, decoded by blocks of `bs` words.
+        """
+        for start in range(0, self.n_words, bs):
+            offsets = self.offsets[start:min(start + bs, self.n_words) + 1].tolist()
+            data = self.buffer[offsets[0]:offsets[-1]].tobytes()
+            base = offsets[0]
+            for j in range(len(offsets) - 1):
+                yield data[offsets[j] - base:offsets[j + 1] - base].decode('utf-8')
+
+    def find(self, word):
+        """
+        Returns the index of the specified word, -1 if it is not in the dictionary.
         """
-        assert len(self.id2word) == len(self.word2id)
-        for i in range(len(self.id2word)):
-            assert self.word2id[self.id2word[i]] == i
+        encoded = word.encode('utf-8')
+        h = hash_word(encoded)
+        sorted_hashes = self.sorted_hashes
+        k = int(sorted_hashes.searchsorted(np.uint64(h)))
+        while k < len(sorted_hashes) and sorted_hashes[k] == h:
+            i = int(self.sorted_ids[k])
+            if i < self.n_words:
+                start, end = self.offsets[i], self.offsets[i + 1]
+                if end - start == len(encoded) and self.buffer[start:end].tobytes() == encoded:
+                    return i
+            k += 1
+        return -1
 
     def index(self, word):
         """
         Returns the index of the specified word.
         """
-        return self.word2id[word]
+        i = self.find(word)
+        if i < 0:
+            raise KeyError(word)
+        return i
+
+    def index_batch(self, words):
+        """
+        Returns the indices of a list of words (-1 for unknown words).
+        """
+        if len(words) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(self.sorted_hashes) == 0:
+            return np.full(len(words), -1, dtype=np.int64)
+        buffer, offsets = encode_words(words)
+        hashes = hash_words(buffer, offsets)
+        k = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        ids = self.sorted_ids[k]
+        found = (self.sorted_hashes[k] == hashes) & (ids < self.n_words)
+        found[found] = equal_words(buffer, offsets, np.nonzero(found)[0], self.buffer, self.offsets, ids[found])
+        ids = np.where(found, ids, -1)
+        # words whose hash is shared by several words of the dictionary
+        collisions = ~found & (k + 1 < len(self.sorted_hashes))
+        collisions[collisions] = self.sorted_hashes[k[collisions] + 1] == hashes[collisions]
+        for j in np.nonzero(collisions)[0]:
+            ids[j] = self.find(words[j])
+        return ids
 
     def prune(self, max_vocab):
         """
         Limit the vocabulary size.
         """
         assert max_vocab >= 1
-        self.id2word = {k: v for k, v in self.id2word.items() if k < max_vocab}
-        self.word2id = {v: k for k, v in self.id2word.items()}
+        self.n_words = min(self.n_words, max_vocab)
         self.check_valid()
@@ -0,0 +1,68 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+from logging import getLogger
+import torch
+import torch.distributed as dist
+
+
+logger = getLogger()
+
+
+def init_distributed(params):
+    """
+    Initialize data-parallel training on the local host (gloo backend).
+    The rank / world size are read from the environment set by `launch.py`
+    (RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT). Without them, a single
+    process is used.
+    """
+    params.rank = int(os.environ.get('RANK', 0))
+    params.world_size = int(os.environ.get('WORLD_SIZE', 1))
+    params.distributed = params.world_size > 1
+    if params.distributed:
+        dist.init_process_group(backend='gloo', rank=params.rank, world_size=params.world_size)
+
+
+def is_master(params):
+    """
+    Whether this process is in charge of evaluation, logging and saving.
+    """
+    return getattr(params, 'rank', 0) == 0
+
+
+def broadcast_object(obj):
+    """
+    Send a picklable object from the master to all workers.
+    """
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def broadcast_parameters(module):
+    """
+    Copy the parameters of the master module to all workers.
+    """
+    for param in module.parameters():
+        dist.broadcast(param.data, src=0)
+
+
+def all_reduce_gradients(modules, world_size):
+    """
+    Average the gradients of a list of modules over all workers, with a single all-reduce.
+    """
+    grads = [param.grad.data for module in modules for param in module.parameters() if param.grad is not None]
+    if len(grads) == 0:
+        return
+    flat = torch.cat([grad.contiguous().view(-1) for grad in grads])
+    dist.all_reduce(flat)
+    flat.div_(world_size)
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
@@ -1,4 +1,5 @@
 from .wordsim import get_wordsim_scores, get_crosslingual_wordsim_scores, get_wordanalogy_scores
-from .word_translation import get_word_translation_accuracy
+from .word_translation import get_word_translation_accuracy, get_word_translation_accuracies
 from .sent_translation import get_sent_translation_accuracy, load_europarl_data
 from .evaluator import Evaluator
+from .pipeline import PipelinedEvaluator
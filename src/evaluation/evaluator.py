@@ -6,48 +6,48 @@
 #
 import os
 from logging import getLogger
-from copy import deepcopy
 import numpy as np
-from torch.autograd import Variable
 
 from . import get_wordsim_scores, get_crosslingual_wordsim_scores
-from .word_translation import get_word_translation_accuracy
+from .word_translation import get_word_translation_accuracies, get_dico_path
 from . import load_europarl_data, get_sent_translation_accuracy
-from ..dico_builder import get_candidates, build_dictionary, build_pairwise_dictionary
-from src.utils import get_idf
-import pdb
+from ..dico_builder import DicoParams, get_shared_candidates
+from src.utils import get_idf, map_embeddings
+from ..instrument import timed
 logger = getLogger()
 import torch
 
 
 class Evaluator(object):
 
-    def __init__(self, trainer):
+    def __init__(self, trainer, mapping=None):
         """
         Initialize evaluator.
+        `mapping` overrides the trainer mapping (e.g. with a snapshot of it).
         """
         self.src_emb = trainer.src_emb
         self.tgt_emb = trainer.tgt_emb
         self.src_dico = trainer.src_dico
         self.tgt_dico = trainer.tgt_dico
-        self.mapping = trainer.mapping
+        self.mapping = trainer.mapping if mapping is None else mapping
         self.discriminator = trainer.discriminator
         self.params = trainer.params
 
+    @timed('eval.monolingual_wordsim')
     def monolingual_wordsim(self, to_log):
         """
         Evaluation on monolingual word similarity.
         """
         src_ws_scores = get_wordsim_scores(
             self.src_dico.lang, self.src_dico.word2id,
-            self.mapping[self.params.src_lang](self.src_emb.weight).data.cpu().numpy()
+            map_embeddings(self.mapping[self.params.src_lang], self.src_emb).cpu().numpy()
         )
         if self.params.tgt_lang:
             tgt_ws_scores = {}
             for lang in self.params.tgt_lang:
                 tgt_ws_scores[lang] = get_wordsim_scores(
                     self.tgt_dico[lang].lang, self.tgt_dico[lang].word2id,
-                    self.mapping[lang](self.tgt_emb[lang].weight).data.cpu().numpy()
+                    map_embeddings(self.mapping[lang], self.tgt_emb[lang]).cpu().numpy()
                 )
         else: tgt_ws_scores = None
         if src_ws_scores is not None:
@@ -70,14 +70,15 @@ class Evaluator(object):
                     logger.info("Monolingual word similarity score average %s : %.5f" % (lang, ws_monolingual_scores))
                     to_log['ws_monolingual_scores_{}'.format(lang)] = ws_monolingual_scores
 
+    @timed('eval.crosslingual_wordsim')
     def crosslingual_wordsim(self, to_log):
         """
         Evaluation on cross-lingual word similarity.
         """
-        src_emb = self.mapping[self.params.src_lang](self.src_emb.weight).data.cpu().numpy()
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb).cpu().numpy()
 
         for lang in self.params.tgt_lang:
-            tgt_emb = self.mapping[lang](self.tgt_emb[lang].weight).data.cpu().numpy()
+            tgt_emb = map_embeddings(self.mapping[lang], self.tgt_emb[lang]).cpu().numpy()
             # cross-lingual wordsim evaluation
             src_tgt_ws_scores = get_crosslingual_wordsim_scores(
                 self.src_dico.lang, self.src_dico.word2id, src_emb,
@@ -90,26 +91,27 @@ class Evaluator(object):
             to_log['ws_crosslingual_scores_{}'.format(lang)] = ws_crosslingual_scores
             to_log.update({'src_tgt_{}'.format(lang) + k: v for k, v in src_tgt_ws_scores.items()})
 
+    @timed('eval.word_translation')
     def word_translation(self, to_log):
         """
         Evaluation on word translation.
         """
         # mapped word embeddings
-        src_emb = self.mapping[self.params.src_lang](self.src_emb.weight).data
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
         for i,lang in enumerate(self.params.tgt_lang):
             torch.cuda.empty_cache()
             #if not os.path.isfile('data/crosslingual/dictionaries/%s-%s.5000-6500.txt' % (self.params.src_lang,lang)): continue
-            tgt_emb = self.mapping[lang](self.tgt_emb[lang].weight).data
+            tgt_emb = map_embeddings(self.mapping[lang], self.tgt_emb[lang])
 
-            for method in ['nn', 'csls_knn_10']:
-                results = get_word_translation_accuracy(
-                    self.src_dico.lang, self.src_dico.word2id, src_emb,
-                    self.tgt_dico[lang].lang, self.tgt_dico[lang].word2id, tgt_emb,
-                    method=method,
-                    id2word_src=self.src_dico.id2word,
-                    id2word_tgt=self.tgt_dico[lang].id2word,
-                    dico_eval=self.params.dico_eval
-                )
+            # a single similarity pass for all the methods
+            all_results = get_word_translation_accuracies(
+                self.src_dico.lang, self.src_dico.word2id, src_emb,
+                self.tgt_dico[lang].lang, self.tgt_dico[lang].word2id, tgt_emb,
+                methods=['nn', 'csls_knn_10'],
+                dico_eval=self.params.dico_eval,
+                dico_path=get_dico_path(self.params)
+            )
+            for method, results in all_results.items():
                 to_log.update([('%s-%s_%s' % (k, method,lang), v) for k, v in results])
                 #results = get_word_translation_accuracy(
                 #    self.tgt_dico[lang].lang, self.tgt_dico[lang].word2id, tgt_emb,
@@ -122,6 +124,7 @@ class Evaluator(object):
                 #to_log.update([('%s-%s_%s' % (k, method,lang), v) for k, v in results])
 #
 
+    @timed('eval.sent_translation')
     def sent_translation(self, to_log):
         """
         Evaluation on sentence translation.
@@ -146,8 +149,8 @@ class Evaluator(object):
             return
 
         # mapped word embeddings
-        src_emb = self.mapping[self.params.src_lang](self.src_emb.weight).data
-        tgt_emb = self.mapping['tgt'](self.tgt_emb['tgt'].weight).data
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
+        tgt_emb = map_embeddings(self.mapping['tgt'], self.tgt_emb['tgt'])
 
         # get idf weights
         idf = get_idf(self.europarl_data, lg1, lg2, n_idf=n_idf)
@@ -174,42 +177,36 @@ class Evaluator(object):
             )
             to_log.update([('src_to_tgt_%s-%s' % (k, method), v) for k, v in results])
 
+    @timed('eval.dist_mean_cosine')
     def dist_mean_cosine(self, to_log):
         """
         Mean-cosine model selection criterion.
+        The S2T dictionaries of all the methods are built in a single pass.
         """
-        overall_mean_cosine = {x:[] for x in ['nn', 'csls_knn_10']}
+        methods = ['nn', 'csls_knn_10']
+        dico_max_size = 10000
+        params = DicoParams(dico_method=None, dico_build='S2T', dico_threshold=0, dico_max_rank=10000,
+                            dico_min_size=0, dico_max_size=dico_max_size,
+                            dico_prefilter=getattr(self.params, 'dico_prefilter', ''), cuda=self.params.cuda)
         # get normalized embeddings
-        src_emb =self.mapping[self.params.src_lang](self.src_emb.weight).data
+        src_emb =map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
         src_emb = src_emb / src_emb.norm(2, 1, keepdim=True).expand_as(src_emb)
         for lang in self.params.tgt_lang:
-            tgt_emb =  self.mapping[lang](self.tgt_emb[lang].weight).data
+            tgt_emb =  map_embeddings(self.mapping[lang], self.tgt_emb[lang])
             tgt_emb = tgt_emb / tgt_emb.norm(2, 1, keepdim=True).expand_as(tgt_emb)
 
-            # build dictionary
-            for dico_method in ['nn', 'csls_knn_10']:
-                dico_build = 'S2T'
-                dico_max_size = 10000
-                # temp params / dictionary generation
-                _params = deepcopy(self.params)
-                _params.dico_method = dico_method
-                _params.dico_build = dico_build
-                _params.dico_threshold = 0
-                _params.dico_max_rank = 10000
-                _params.dico_min_size = 0
-                _params.dico_max_size = dico_max_size
-                s2t_candidates = get_candidates(src_emb, tgt_emb, _params)
-                t2s_candidates = get_candidates(tgt_emb, src_emb, _params)
-                dico = build_pairwise_dictionary(src_emb, tgt_emb, _params, s2t_candidates, t2s_candidates, True)
+            # build the S2T dictionaries (the source to target candidates)
+            candidates = get_shared_candidates(src_emb, tgt_emb, methods, params)
+            for dico_method in methods:
+                dico = candidates[dico_method][:dico_max_size].to(src_emb.device)
                 # mean cosine
-                if dico is None:
-                    mean_cosine = -1e9
+                if len(dico) == 0:
+                    mean = -1e9
                 else:
-                    mean_cosine = (src_emb[dico[:dico_max_size, 0]] * tgt_emb[dico[:dico_max_size, 1]]).sum(1).mean()
-                mean=mean_cosine.item()
+                    mean = (src_emb[dico[:, 0]] * tgt_emb[dico[:, 1]]).sum(1).mean().item()
                 logger.info("Mean cosine (%s method, %s build, %i max size): %.5f"
-                            % (dico_method, _params.dico_build, dico_max_size, mean))
-                to_log['mean_cosine-%s-%s-%i_%s' % (dico_method, _params.dico_build, dico_max_size,lang)] = mean
+                            % (dico_method, params.dico_build, dico_max_size, mean))
+                to_log['mean_cosine-%s-%s-%i_%s' % (dico_method, params.dico_build, dico_max_size,lang)] = mean
 
     def all_eval(self, to_log, biling_dict):
         """
@@ -221,39 +218,43 @@ class Evaluator(object):
         #self.sent_translation(to_log)
         self.dist_mean_cosine(to_log)
 
+    def get_dis_preds(self, discriminator, emb):
+        """
+        Get the discriminator predictions for all the (mapped) embeddings of a matrix.
+        """
+        bs = getattr(self.params, 'dis_eval_bs', 8192)
+        preds = np.empty(emb.size(0), dtype=np.float32)
+        with torch.no_grad():
+            for i in range(0, emb.size(0), bs):
+                preds[i:i + bs] = discriminator(emb[i:i + bs]).cpu().numpy()
+        return preds
+
+    @timed('eval.eval_dis')
     def eval_dis(self, to_log):
         """
         Evaluate discriminator predictions and accuracy.
+        Each target language is evaluated with its own discriminator.
         """
-        bs = 128
-        src_preds = []
-        tgt_preds = []
+        # mapped source embeddings are shared by all target languages
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
 
         for lang in self.params.tgt_lang:
-            self.discriminator.eval()
-            for i in range(0, self.src_emb.num_embeddings, bs):
-                emb = Variable(self.src_emb.weight[i:i + bs].data, volatile=True)
-                preds = self.discriminator(self.mapping[self.params.src_lang](emb))
-                src_preds.extend(preds.data.cpu().tolist())
-
-
-            for i in range(0, self.tgt_emb[lang].num_embeddings, bs):
-                emb = Variable(self.tgt_emb[lang].weight[i:i + bs].data, volatile=True)
-                preds = self.discriminator(self.mapping[lang](emb))
-                tgt_preds.extend(preds.data.cpu().tolist())
-
-            src_pred = np.mean(src_preds)
-            tgt_pred = np.mean(tgt_preds)
+            discriminator = self.discriminator[lang]
+            discriminator.eval()
+            src_preds = self.get_dis_preds(discriminator, src_emb)
+            tgt_preds = self.get_dis_preds(discriminator, map_embeddings(self.mapping[lang], self.tgt_emb[lang]))
+            src_pred = src_preds.mean()
+            tgt_pred = tgt_preds.mean()
             logger.info("Discriminator source / target %s predictions: %.5f / %.5f"
                         % (lang, src_pred, tgt_pred))
 
-            src_accu = np.mean([x >= 0.5 for x in src_preds])
-            tgt_accu = np.mean([x < 0.5 for x in tgt_preds])
-            dis_accu = ((src_accu * self.src_emb.num_embeddings + tgt_accu * self.tgt_emb[lang].num_embeddings) /
-                        (self.src_emb.num_embeddings + self.tgt_emb[lang].num_embeddings))
+            src_accu = (src_preds >= 0.5).mean()
+            tgt_accu = (tgt_preds < 0.5).mean()
+            dis_accu = ((src_accu * len(src_preds) + tgt_accu * len(tgt_preds)) /
+                        (len(src_preds) + len(tgt_preds)))
             logger.info("Discriminator source / target %s / global accuracy: %.5f / %.5f / %.5f"
                         % (lang, src_accu, tgt_accu, dis_accu))
 
-            to_log['dis_accu_{}'.format(lang)] = dis_accu
-            to_log['dis_src_pred_{}'.format(lang)] = src_pred
-            to_log['dis_tgt_pred_{}'.format(lang)] = tgt_pred
+            to_log['dis_accu_{}'.format(lang)] = float(dis_accu)
+            to_log['dis_src_pred_{}'.format(lang)] = float(src_pred)
+            to_log['dis_tgt_pred_{}'.format(lang)] = float(tgt_pred)
@@ -0,0 +1,74 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+from logging import getLogger
+from concurrent.futures import ThreadPoolExecutor
+
+from .evaluator import Evaluator
+from ..instrument import log_stages
+from ..profiler import profile_iteration
+
+
+logger = getLogger()
+
+
+class PipelinedEvaluator(object):
+
+    def __init__(self, trainer, metric, biling_dict=True):
+        """
+        Evaluate each iteration in a background worker, on a snapshot of the
+        mapping, while the trainer moves on to the next iteration.
+        Iterations are logged, given to `trainer.save_best` and checkpointed in order.
+        """
+        self.trainer = trainer
+        self.metric = metric
+        self.biling_dict = biling_dict
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def submit(self, to_log):
+        """
+        Snapshot the current mapping and start its evaluation.
+        The previous iteration is committed once its evaluation is over.
+        """
+        mapping = self.trainer.snapshot_mapping()
+        dico = getattr(self.trainer, 'dico', None)
+        evaluator = Evaluator(self.trainer, mapping)
+        future = self.executor.submit(self.evaluate, evaluator, to_log)
+        self.flush()
+        self.pending = (future, to_log, mapping, dico)
+
+    def evaluate(self, evaluator, to_log):
+        """
+        Evaluate an iteration (profiled as that iteration).
+        """
+        with profile_iteration(to_log['n_iter']):
+            evaluator.all_eval(to_log, self.biling_dict)
+
+    def flush(self):
+        """
+        Wait for the pending evaluation, log it, update the best model
+        and save a checkpoint of that iteration.
+        """
+        if self.pending is None:
+            return
+        future, to_log, mapping, dico = self.pending
+        self.pending = None
+        future.result()
+        log_stages(to_log)
+        logger.info("__log__:%s" % json.dumps(to_log))
+        self.trainer.save_best(to_log, self.metric, mapping)
+        self.trainer.save_checkpoint(to_log['n_iter'], mapping, dico)
+        logger.info('End of iteration %i.\n\n' % to_log['n_iter'])
+
+    def close(self):
+        """
+        Commit the last iteration and stop the background worker.
+        """
+        self.flush()
+        self.executor.shutdown()
@@ -7,63 +7,75 @@
 
 import os
 from logging import getLogger
+from collections import OrderedDict
 import numpy as np
 import torch
 import pickle
 from ..utils import get_nn_avg_dist
 import re
 
-DIC_EVAL_PATH = '/cortex/users/taitelh/generalized-procrustes-MUSE/data/dictionaries/'#'data/crosslingual/dictionaries/'
+# folder of the default dictionaries (%s-%s.0-5000.txt / %s-%s.5000-6500.txt),
+# overridden by the MUSE_DIC_EVAL_PATH environment variable, or by `--dico_path`
+DIC_EVAL_PATH = os.environ.get('MUSE_DIC_EVAL_PATH', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    'data', 'crosslingual', 'dictionaries'
+))
 
 
 logger = getLogger()
 
 
-def load_identical_char_dico(word2id1, word2id2, return_numpy=False):
+def get_dico_path(params):
     """
-    Build a dictionary of identical character strings.
+    Folder of the default dictionaries.
     """
-    pairs = [(w1, w1) for w1 in word2id1.keys() if w1 in word2id2]
-    if len(pairs) == 0:
-        raise Exception("No identical character strings were found. "
-                        "Please specify a dictionary.")
+    return getattr(params, 'dico_path', '') or DIC_EVAL_PATH
 
-    logger.info("Found %i pairs of identical character strings." % len(pairs))
 
-    # sort the dictionary by source word frequencies
-    pairs = sorted(pairs, key=lambda x: word2id1[x[0]])
-    if return_numpy: dico = np.empty([len(pairs),2],dtype=np.int64)
-    else: dico = torch.LongTensor(len(pairs), 2)
-    for i, (word1, word2) in enumerate(pairs):
-        dico[i, 0] = word2id1[word1]
-        dico[i, 1] = word2id2[word2]
+def get_word_ids(words, word2id):
+    """
+    Indices of a list of words (-1 for unknown words). Lookups in the
+    `word2id` of a `Dictionary` are vectorized.
+    """
+    if hasattr(word2id, 'index_batch'):
+        return word2id.index_batch(words)
+    return np.array([word2id.get(w, -1) for w in words], dtype=np.int64)
 
-    return dico
 
-def load_identical_num_dico(word2id1, word2id2, return_numpy=False):
+def identical_words_dico(words, word2id1, word2id2, return_numpy=False):
     """
-    Build a dictionary of identical character strings.
+    Build a dictionary of source words found with identical strings in the
+    target vocabulary, sorted by source word frequencies.
     """
-    numeral_regex = re.compile('^[0-9]+$')
-    src_numerals = {word for word in word2id1.keys() if numeral_regex.match(word) is not None}
-    trg_numerals = {word for word in word2id2.keys() if numeral_regex.match(word) is not None}
-    numerals = src_numerals.intersection(trg_numerals)
-    pairs = [(w1, w1) for w1 in numerals]
-    if len(pairs) == 0:
+    ids1 = get_word_ids(words, word2id1)
+    ids2 = get_word_ids(words, word2id2)
+    found = (ids1 >= 0) & (ids2 >= 0)
+    if not found.any():
         raise Exception("No identical character strings were found. "
                         "Please specify a dictionary.")
 
-    logger.info("Found %i pairs of identical character strings." % len(pairs))
+    logger.info("Found %i pairs of identical character strings." % found.sum())
 
     # sort the dictionary by source word frequencies
-    pairs = sorted(pairs, key=lambda x: word2id1[x[0]])
-    if return_numpy: dico = np.empty([len(pairs),2],dtype=np.int64)
-    else: dico = torch.LongTensor(len(pairs), 2)
-    for i, (word1, word2) in enumerate(pairs):
-        dico[i, 0] = word2id1[word1]
-        dico[i, 1] = word2id2[word2]
+    ids1, ids2 = ids1[found], ids2[found]
+    order = np.argsort(ids1, kind='stable')
+    dico = np.stack([ids1[order], ids2[order]], 1).astype(np.int64)
+    return dico if return_numpy else torch.from_numpy(dico)
 
-    return dico
+
+def load_identical_char_dico(word2id1, word2id2, return_numpy=False):
+    """
+    Build a dictionary of identical character strings.
+    """
+    return identical_words_dico(list(word2id1.keys()), word2id1, word2id2, return_numpy)
+
+def load_identical_num_dico(word2id1, word2id2, return_numpy=False):
+    """
+    Build a dictionary of identical character strings.
+    """
+    numeral_regex = re.compile('^[0-9]+$')
+    src_numerals = [word for word in word2id1.keys() if numeral_regex.match(word) is not None]
+    return identical_words_dico(src_numerals, word2id1, word2id2, return_numpy)
 
 def load_dictionary(path, word2id1, word2id2,return_numpy=False):
     """
@@ -107,18 +119,59 @@ def load_dictionary(path, word2id1, word2id2,return_numpy=False):
     return dico
 
 
-def get_word_translation_accuracy(lang1, word2id1, emb1, lang2, word2id2, emb2, method, id2word_src, id2word_tgt,dico_eval):
+def get_target_stats(emb1, emb2, methods, bs):
+    """
+    Terms of the scoring methods that only depend on the target words, computed
+    in a single pass over the target / source similarities (by blocks of `bs`
+    target words): for `csls_knn_K`, the average similarity of each target word
+    to its K nearest source words, for `invsm_beta_B`, the softmax normalization
+    of each target word over all the source words.
+    """
+    knns = sorted(set(int(m[len('csls_knn_'):]) for m in methods if m.startswith('csls_knn_')))
+    betas = sorted(set(float(m[len('invsm_beta_'):]) for m in methods if m.startswith('invsm_beta_')))
+    stats = {}
+    if len(knns) == 0 and len(betas) == 0:
+        return stats
+    # a single CSLS method can use Faiss
+    if len(betas) == 0 and len(knns) == 1:
+        stats[knns[0]] = torch.from_numpy(get_nn_avg_dist(emb1, emb2, knns[0], bs)).type_as(emb2)
+        return stats
+    blocks = {x: [] for x in knns + betas}
+    for i in range(0, emb2.size(0), bs):
+        scores = emb2[i:i + bs].mm(emb1.transpose(0, 1))
+        if len(knns) > 0:
+            best_scores = scores.topk(knns[-1], dim=1, largest=True, sorted=True)[0]
+            for knn in knns:
+                blocks[knn].append(best_scores[:, :knn].mean(1))
+        for beta in betas:
+            blocks[beta].append(scores.mul(beta).exp_().sum(1))
+    return {x: torch.cat(v) for x, v in blocks.items()}
+
+
+def get_word_translation_accuracies(lang1, word2id1, emb1, lang2, word2id2, emb2, methods, dico_eval, dico_path=DIC_EVAL_PATH, max_rank=0, bs=None):
     """
     Given source and target word embeddings, and a dictionary,
-    evaluate the translation accuracy using the precision@k.
+    evaluate the translation accuracy of several retrieval methods
+    (nn / csls_knn_K / invsm_beta_B) using the precision@k.
+    The similarities of the source words of the dictionary are computed once,
+    by blocks of `bs` words, and scored with every method.
+    The 'default' dictionary is read from the `dico_path` folder.
+    With `max_rank`, translations are searched among the `max_rank` most
+    frequent target words only. `bs` is also the block size of the CSLS /
+    inverted softmax passes over the vocabularies (default: 1024, 128 with
+    inverted softmax). Returns the results of each method.
     """
+    for method in methods:
+        if not (method == 'nn' or method.startswith('csls_knn_') and method[len('csls_knn_'):].isdigit()
+                or method.startswith('invsm_beta_')):
+            raise Exception('Unknown method: "%s"' % method)
+    if bs is None:
+        bs = 128 if any(method.startswith('invsm_beta_') for method in methods) else 1024
+
     if dico_eval == 'default':
-        path = os.path.join(DIC_EVAL_PATH, '%s-%s.5000-6500.txt' % (lang1, lang2))
+        path = os.path.join(dico_path, '%s-%s.5000-6500.txt' % (lang1, lang2))
     else:
         path = dico_eval
-    #path = os.path.join(DIC_EVAL_PATH, '%s-%s.5000-6500.txt' % (lang1, lang2))
-    #path = '/home/bkl121/MUSEfromScratch/data/crosslingual/dictionaries/{}-{}.5000-6500.txt'.format(lang1,lang2)
-    #path = '/home/yova/FBmorph/MUSE/data/crosslingual/processed/%s-%s.partial0' % (lang1, lang2)
     logger.info('Language pair %s-%s' % (lang1, lang2))
     dico = load_dictionary(path, word2id1, word2id2)
     dico = dico.cuda() if emb1.is_cuda else dico
@@ -129,61 +182,63 @@ def get_word_translation_accuracy(lang1, word2id1, emb1, lang2, word2id2, emb2,
     # normalize word embeddings
     emb1 = emb1 / emb1.norm(2, 1, keepdim=True).expand_as(emb1)
     emb2 = emb2 / emb2.norm(2, 1, keepdim=True).expand_as(emb2)
-
-    # nearest neighbors
-    if method == 'nn':
-        query = emb1[dico[:, 0]]
-        scores = query.mm(emb2.transpose(0, 1))
-
-    # inverted softmax
-    elif method.startswith('invsm_beta_'):
-        beta = float(method[len('invsm_beta_'):])
-        bs = 128
-        word_scores = []
-        for i in range(0, emb2.size(0), bs):
-            scores = emb1.mm(emb2[i:i + bs].transpose(0, 1))
-            scores.mul_(beta).exp_()
-            scores.div_(scores.sum(0, keepdim=True).expand_as(scores))
-            word_scores.append(scores.index_select(0, dico[:, 0]))
-        scores = torch.cat(word_scores, 1)
-
-    # contextual dissimilarity measure
-    elif method.startswith('csls_knn_'):
-        # average distances to k nearest neighbors
-        knn = method[len('csls_knn_'):]
-        assert knn.isdigit()
-        knn = int(knn)
-        average_dist1 = get_nn_avg_dist(emb2, emb1, knn)
-        average_dist2 = get_nn_avg_dist(emb1, emb2, knn)
-        average_dist1 = torch.from_numpy(average_dist1).type_as(emb1)
-        average_dist2 = torch.from_numpy(average_dist2).type_as(emb2)
-        # queries / scores
-        query = emb1[dico[:, 0]]
-        scores = query.mm(emb2.transpose(0, 1))
-        scores.mul_(2)
-        scores.sub_(average_dist1[dico[:, 0]][:, None] + average_dist2[None, :])
-
-    else:
-        raise Exception('Unknown method: "%s"' % method)
-
-    results = []
-    top_matches = scores.topk(100, 1, True)[1]
-
-    for k in [1, 5, 10]:
-        top_k_matches = top_matches[:, :k]
-
-        _matching = (top_k_matches == dico[:, 1][:, None].expand_as(top_k_matches)).sum(1).cpu().numpy()
-        # allow for multiple possible translations
-        matching = {}
-
-        for i, src_id in enumerate(dico[:, 0].cpu().numpy()):
-            matching[src_id] = min(matching.get(src_id, 0) + _matching[i], 1)
-
-        # evaluate precision@k
-        precision_at_k = 100 * np.mean(list(matching.values()))
-
-        logger.info("%i source words - %s - Precision at k = %i: %f" %
-                    (len(matching), method, k, precision_at_k))
-        results.append(('precision_at_%i' % k, precision_at_k))
-        #evaluate_morph(matching, included, path, id2word_tgt)
-    return results
+    if max_rank > 0:
+        emb2 = emb2[:max_rank]
+    stats = get_target_stats(emb1, emb2, methods, bs)
+
+    # best translations of each source word, with each method
+    src_ids, inverse = torch.unique(dico[:, 0], sorted=True, return_inverse=True)
+    knns = [int(m[len('csls_knn_'):]) for m in methods if m.startswith('csls_knn_')]
+    topk = min(10, emb2.size(0))
+    top_matches = {method: [] for method in methods}
+    for i in range(0, len(src_ids), bs):
+        query = emb1[src_ids[i:i + bs]]
+        similarities = query.mm(emb2.transpose(0, 1))
+        if len(knns) > 0:
+            # average distances of the queries to their k nearest neighbors
+            best_similarities = similarities.topk(max(knns), dim=1, largest=True, sorted=True)[0]
+        for method in methods:
+            # nearest neighbors
+            if method == 'nn':
+                scores = similarities
+            # contextual dissimilarity measure
+            elif method.startswith('csls_knn_'):
+                knn = int(method[len('csls_knn_'):])
+                scores = similarities.mul(2)
+                scores.sub_(best_similarities[:, :knn].mean(1)[:, None] + stats[knn][None, :])
+            # inverted softmax
+            else:
+                beta = float(method[len('invsm_beta_'):])
+                scores = similarities.mul(beta).exp_()
+                scores.div_(stats[beta][None, :])
+            top_matches[method].append(scores.topk(topk, 1, True)[1])
+
+    all_results = OrderedDict()
+    targets = dico[:, 1][:, None]
+    for method in methods:
+        matches = torch.cat(top_matches[method], 0)[inverse]
+        results = []
+        for k in [1, 5, 10]:
+            # allow for multiple possible translations
+            _matching = (matches[:, :k] == targets.expand(-1, matches[:, :k].size(1))).any(1)
+            matching = torch.zeros(len(src_ids), dtype=torch.bool, device=dico.device)
+            matching.index_fill_(0, inverse[_matching], True)
+
+            # evaluate precision@k
+            precision_at_k = 100 * np.mean(matching.cpu().numpy())
+
+            logger.info("%i source words - %s - Precision at k = %i: %f" %
+                        (len(matching), method, k, precision_at_k))
+            results.append(('precision_at_%i' % k, precision_at_k))
+        all_results[method] = results
+    return all_results
+
+
+def get_word_translation_accuracy(lang1, word2id1, emb1, lang2, word2id2, emb2, method, id2word_src, id2word_tgt,dico_eval, dico_path=DIC_EVAL_PATH, max_rank=0, bs=None):
+    """
+    Given source and target word embeddings, and a dictionary,
+    evaluate the translation accuracy using the precision@k.
+    See `get_word_translation_accuracies`.
+    """
+    return get_word_translation_accuracies(lang1, word2id1, emb1, lang2, word2id2, emb2, [method],
+                                           dico_eval, dico_path, max_rank, bs)[method]
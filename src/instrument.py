@@ -0,0 +1,205 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+import re
+import time
+import threading
+import functools
+from logging import getLogger
+from collections import OrderedDict
+from contextlib import contextmanager
+import torch
+
+from .profiler import profile
+
+
+logger = getLogger()
+
+# statistics of the stages since the last `log_stages`, and since the beginning of the run
+_iteration = OrderedDict()
+_total = OrderedDict()
+_lock = threading.Lock()
+# stack of the running stages of each thread
+_local = threading.local()
+
+
+def read_status(field):
+    """
+    Memory field of /proc/self/status (in MB), None where it is not available.
+    """
+    try:
+        with io.open('/proc/self/status', 'r') as f:
+            status = f.read()
+    except (IOError, OSError):
+        return None
+    match = re.search(r'%s:\s+(\d+)' % field, status)
+    return None if match is None else int(match.group(1)) / 1024.
+
+
+def get_memory():
+    """
+    Current resident memory of the process (in MB).
+    """
+    return read_status('VmRSS')
+
+
+def get_peak_memory():
+    """
+    Peak resident memory of the process (in MB), and reset it. Returns None
+    where the peak cannot be reset (it requires Linux /proc/self/clear_refs).
+    """
+    peak = read_status('VmHWM')
+    try:
+        with io.open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return None
+    return peak
+
+
+def get_peak_cuda_memory():
+    """
+    Peak memory allocated by tensors on the GPU (in MB), and reset it.
+    """
+    if not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    peak = torch.cuda.max_memory_allocated() / 1024. ** 2
+    torch.cuda.reset_peak_memory_stats()
+    return peak
+
+
+class Frame(object):
+
+    def __init__(self, path, measured=True):
+        self.path = path
+        self.measured = measured
+        self.peak_rss = None
+        self.peak_cuda = None
+
+    def update(self, peak_rss, peak_cuda):
+        if peak_rss is not None:
+            self.peak_rss = peak_rss if self.peak_rss is None else max(self.peak_rss, peak_rss)
+        if peak_cuda is not None:
+            self.peak_cuda = peak_cuda if self.peak_cuda is None else max(self.peak_cuda, peak_cuda)
+
+
+def get_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_stage():
+    """
+    Path of the running stage of this thread ('' outside of any stage).
+    """
+    stack = get_stack()
+    return stack[-1].path if len(stack) > 0 else ''
+
+
+@contextmanager
+def inherit_stage(path):
+    """
+    Run the stages of a worker thread as sub-stages of `path`
+    (the `current_stage` of the thread that started the worker).
+    """
+    stack = get_stack()
+    stack.append(Frame(path, measured=False))
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a stage: wall time, CPU time (of the process), peak resident memory,
+    and peak GPU tensor memory. Stages can be nested, a stage is identified by
+    its path (e.g. "build_dictionary/candidates/r_terms"), which can be profiled.
+    Peak memory and CPU time are measured for the process: they include concurrent
+    stages, and sub-stages running in concurrent threads can add up to more wall
+    time than their parent stage.
+    """
+    stack = get_stack()
+    parent = stack[-1] if len(stack) > 0 else None
+    frame = Frame(name if parent is None or not parent.path else '%s/%s' % (parent.path, name))
+    # the peak so far belongs to the parent stage, the peak is then reset
+    peak_rss, peak_cuda = get_peak_memory(), get_peak_cuda_memory()
+    if parent is not None:
+        parent.update(peak_rss, peak_cuda)
+    stack.append(frame)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with profile(frame.path):
+            yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        stack.pop()
+        # peaks are not reset, so that they also count for the parent stage
+        frame.update(read_status('VmHWM'), get_peak_cuda_memory())
+        if parent is not None:
+            parent.update(frame.peak_rss, frame.peak_cuda)
+        record(frame, wall, cpu)
+
+
+def timed(name):
+    """
+    Decorator measuring each call of a function as a stage.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(frame, wall, cpu):
+    with _lock:
+        for stats in [_iteration, _total]:
+            s = stats.setdefault(frame.path, {'calls': 0, 'wall_time': 0., 'cpu_time': 0., 'peak_rss': None, 'peak_cuda': None})
+            s['calls'] += 1
+            s['wall_time'] += wall
+            s['cpu_time'] += cpu
+            for k in ['peak_rss', 'peak_cuda']:
+                v = getattr(frame, k)
+                if v is not None:
+                    s[k] = v if s[k] is None else max(s[k], v)
+
+
+def log_stages(to_log):
+    """
+    Add the statistics of the stages since the last call to `to_log`.
+    """
+    with _lock:
+        for path, s in _iteration.items():
+            to_log['wall_time-%s' % path] = round(s['wall_time'], 4)
+            to_log['cpu_time-%s' % path] = round(s['cpu_time'], 4)
+            for k in ['peak_rss', 'peak_cuda']:
+                if s[k] is not None:
+                    to_log['%s-%s' % (k, path)] = round(s[k], 1)
+        _iteration.clear()
+
+
+def log_stage_summary():
+    """
+    Log a summary table of all the stages of the run.
+    """
+    with _lock:
+        if len(_total) == 0:
+            return
+        width = max(len(path) for path in _total)
+        lines = ['%-*s %7s %11s %11s %11s %11s' % (width, 'stage', 'calls', 'wall (s)', 'cpu (s)', 'rss (MB)', 'cuda (MB)')]
+        for path, s in sorted(_total.items()):
+            lines.append('%-*s %7i %11.2f %11.2f %11s %11s' % (
+                width, path, s['calls'], s['wall_time'], s['cpu_time'],
+                '-' if s['peak_rss'] is None else '%.1f' % s['peak_rss'],
+                '-' if s['peak_cuda'] is None else '%.1f' % s['peak_cuda']))
+    logger.info('============ Stages ============\n%s' % '\n'.join(lines))
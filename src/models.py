@@ -9,6 +9,12 @@ import torch
 from torch import nn
 
 from .utils import load_embeddings, normalize_embeddings
+from .shared_store import attach_shared_embeddings
+from .instrument import timed
+
+
+EMB_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16}
+
 
 class Discriminator(nn.Module):
 
@@ -37,27 +43,65 @@ class Discriminator(nn.Module):
         return self.layers(x).view(-1)
 
 
+class FrozenEmbedding(nn.Module):
+
+    def __init__(self, embeddings, dtype):
+        super(FrozenEmbedding, self).__init__()
+        self.num_embeddings, self.embedding_dim = embeddings.size()
+        self.register_buffer('weight', embeddings.to(dtype))
+
+    def forward(self, ids):
+        return self.weight[ids].float()
+
+
+def build_embeddings(embeddings, params):
+    """
+    Wrap pretrained embeddings. By default, they are stored in a float32
+    `nn.Embedding`. With `params.emb_dtype` set to float16 / bfloat16, they are
+    kept as a frozen buffer (no autograd), and upcast to float32 when used.
+    """
+    emb_dtype = getattr(params, 'emb_dtype', 'float32')
+    if emb_dtype == 'float32':
+        emb = nn.Embedding(embeddings.size(0), params.emb_dim, sparse=True)
+        emb.weight.data.copy_(embeddings)
+        return emb
+    return FrozenEmbedding(embeddings, EMB_DTYPES[emb_dtype])
+
+
+@timed('load_embeddings')
+def load_model_embeddings(lang, emb_path, params):
+    """
+    Load, normalize and wrap the embeddings of a language (normalized before they
+    are wrapped, as reduced-precision storage is read-only). With
+    `params.shared_embeddings`, they are attached from the shared store of the
+    host (stored in the precision `params.emb_dtype`), and wrapped without copy.
+    """
+    if getattr(params, 'shared_embeddings', False):
+        dico, embeddings = attach_shared_embeddings(lang, emb_path, params)
+        assert embeddings.dtype == EMB_DTYPES[getattr(params, 'emb_dtype', 'float32')]
+        return dico, FrozenEmbedding(embeddings, embeddings.dtype)
+    dico, embeddings = load_embeddings(lang, emb_path, params)
+    normalize_embeddings(embeddings, params.normalize_embeddings)
+    return dico, build_embeddings(embeddings, params)
+
+
 def build_model(params, with_dis):
     """
     Build all components of the model.
     """
     # source embeddings
-    src_dico, _src_emb = load_embeddings(params.src_lang, params.src_emb, params)
+    src_dico, src_emb = load_model_embeddings(params.src_lang, params.src_emb, params)
     params.src_dico = src_dico
-    src_emb = nn.Embedding(len(src_dico), params.emb_dim, sparse=True)
-    src_emb.weight.data.copy_(_src_emb)
     params.tgt_dico = {}
     tgt_emb = {}
+    tgt_lang_list = params.tgt_lang if params.tgt_lang else []
     # target embeddings
     if params.tgt_lang:
-        tgt_lang_list = params.tgt_lang
         tgt_emb_list = params.tgt_emb
         assert len(tgt_emb_list) == len(tgt_lang_list)
         for lang, emb in zip(tgt_lang_list,tgt_emb_list):
-            tgt_dico, _tgt_emb = load_embeddings(lang, emb, params)
+            tgt_dico, tgt_emb[lang] = load_model_embeddings(lang, emb, params)
             params.tgt_dico[lang] = tgt_dico
-            tgt_emb[lang] = nn.Embedding(len(tgt_dico), params.emb_dim, sparse=True)
-            tgt_emb[lang].weight.data.copy_(_tgt_emb)
     else:
         tgt_emb = None
 
@@ -67,8 +111,8 @@ def build_model(params, with_dis):
         for lang in [params.src_lang]+tgt_lang_list:
             mapping[lang].weight.data.copy_(torch.diag(torch.ones(params.emb_dim)))
 
-    # discriminator
-    discriminator = Discriminator(params) if with_dis else None
+    # discriminator for each target language
+    discriminator = {lang: Discriminator(params) for lang in tgt_lang_list} if with_dis else None
 
     # cuda
     if params.cuda:
@@ -81,10 +125,4 @@ def build_model(params, with_dis):
             if with_dis and lang in tgt_lang_list:
                 discriminator[lang].cuda()
 
-    # normalize embeddings
-    normalize_embeddings(src_emb.weight.data, params.normalize_embeddings)
-    if params.tgt_lang:
-        for lang in tgt_lang_list:
-            normalize_embeddings(tgt_emb[lang].weight.data, params.normalize_embeddings)
-
     return src_emb, tgt_emb, mapping, discriminator
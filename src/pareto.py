@@ -0,0 +1,114 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import copy
+from logging import getLogger
+from collections import OrderedDict
+import numpy as np
+
+from .utils import load_embeddings, normalize_embeddings, load_best_mapping
+from .benchmark import measure
+from .evaluation.word_translation import get_word_translation_accuracy, get_dico_path
+
+
+logger = getLogger()
+
+# retrieval settings that can be swept
+# (`block_size` 0 is the default block size of the method)
+PARETO_PARAMS = ['dico_method', 'max_vocab', 'dico_max_rank', 'block_size']
+
+
+def get_max_vocab(configs, params):
+    """
+    Vocabulary size to load: the largest one of the configurations (-1 for all the words).
+    """
+    values = [config.get('max_vocab', params.max_vocab) for config in configs]
+    return -1 if any(v <= 0 for v in values) else max(values)
+
+
+def load_space(lang, emb_path, params):
+    """
+    Reload embeddings, apply the best mapping of the experiment (if any) and normalize them.
+    """
+    dico, emb = load_embeddings(lang, emb_path, params)
+    normalize_embeddings(emb, params.normalize_embeddings)
+    emb = emb.cuda() if params.cuda else emb
+    if params.mapping_path:
+        W = load_best_mapping(params.mapping_path, lang).type_as(emb)
+        assert W.size() == (params.emb_dim, params.emb_dim)
+        emb = emb.mm(W.transpose(0, 1))
+    emb.div_(emb.norm(2, 1, keepdim=True).expand_as(emb))
+    return dico, emb
+
+
+def truncate_space(dico, emb, max_vocab):
+    """
+    Restrict a space to its `max_vocab` most frequent words.
+    """
+    if max_vocab <= 0 or max_vocab >= len(dico):
+        return dico, emb
+    dico = copy.copy(dico)
+    dico.prune(max_vocab)
+    return dico, emb[:max_vocab]
+
+
+def run_config(config_id, config, spaces, params):
+    """
+    Evaluate the word translation of a configuration, and measure its
+    time and peak memory. Returns its row in the results table.
+    """
+    values = OrderedDict((name, config.get(name, getattr(params, name))) for name in PARETO_PARAMS)
+    logger.info('============ Configuration %s: %s ============' % (
+        config_id, ', '.join('%s=%s' % (k, v) for k, v in values.items())))
+    src_dico, src_emb = truncate_space(spaces[0][0], spaces[0][1], values['max_vocab'])
+    tgt_dico, tgt_emb = truncate_space(spaces[1][0], spaces[1][1], values['max_vocab'])
+
+    def fn():
+        return get_word_translation_accuracy(
+            src_dico.lang, src_dico.word2id, src_emb, tgt_dico.lang, tgt_dico.word2id, tgt_emb,
+            values['dico_method'], src_dico.id2word, tgt_dico.id2word, params.dico_eval,
+            get_dico_path(params), max_rank=values['dico_max_rank'], bs=values['block_size'] or None
+        )
+
+    row = OrderedDict([('id', config_id)] + list(values.items()))
+    times, peak_mem, results = measure(fn, params.repeat, params.warmup, params.cuda)
+    row.update(results)
+    row['time'] = float(np.median(times))
+    row['peak_mem'] = max(peak_mem) if len(peak_mem) > 0 else None
+    logger.info('Configuration %s: %s, %.4fs, peak memory %s' % (
+        config_id, ', '.join('%s %.2f' % (k, v) for k, v in results), row['time'],
+        'n/a' if row['peak_mem'] is None else '%.1fMB' % row['peak_mem']))
+    return row
+
+
+def dominates(row1, row2, metric):
+    """
+    Whether `row1` is at least as good as `row2` on the metric, time and
+    peak memory (where measured), and strictly better on one of them.
+    """
+    pairs = [(-row1[metric], -row2[metric]), (row1['time'], row2['time'])]
+    if row1['peak_mem'] is not None and row2['peak_mem'] is not None:
+        pairs.append((row1['peak_mem'], row2['peak_mem']))
+    return all(x <= y for x, y in pairs) and any(x < y for x, y in pairs)
+
+
+def get_pareto_frontier(rows, metric):
+    """
+    Configurations that are not dominated by another one
+    (higher `metric`, lower time, lower peak memory), by increasing time.
+    """
+    frontier = [row for row in rows if not any(dominates(other, row, metric) for other in rows)]
+    return sorted(frontier, key=lambda row: row['time'])
+
+
+def log_frontier(frontier, metric):
+    lines = ['%-5s %s %10s %10s %12s' % ('id', ' '.join('%15s' % k for k in PARETO_PARAMS), metric, 'time (s)', 'memory (MB)')]
+    for row in frontier:
+        lines.append('%-5s %s %10.2f %10.4f %12s' % (
+            row['id'], ' '.join('%15s' % row[k] for k in PARETO_PARAMS), row[metric], row['time'],
+            '-' if row['peak_mem'] is None else '%.1f' % row['peak_mem']))
+    logger.info('============ Pareto frontier (%i configurations) ============\n%s' % (len(frontier), '\n'.join(lines)))
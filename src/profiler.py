@@ -0,0 +1,140 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import io
+import pstats
+import cProfile
+import threading
+from logging import getLogger
+from contextlib import contextmanager
+import torch
+
+
+logger = getLogger()
+
+PROFILERS = ['cprofile', 'torch']
+
+# profiled stages / iterations, set by `init_profiler`
+_config = None
+# a single profile runs at a time (nested or concurrent stages are not profiled)
+_active = threading.Lock()
+_counts = {}
+# current iteration of the run, possibly overridden in a thread
+_iteration = ''
+_local = threading.local()
+
+
+def init_profiler(params):
+    """
+    Profile the stages `params.profile` (comma-separated, "iteration" for whole
+    iterations) of the iterations `params.profile_iters` (default: all), with
+    the profilers `params.profiler`. Profiles are written to the experiment folder.
+    """
+    global _config
+    stages = [x for x in getattr(params, 'profile', '').split(',') if len(x) > 0]
+    if len(stages) == 0:
+        return
+    iters = [x for x in getattr(params, 'profile_iters', '').split(',') if len(x) > 0]
+    profilers = [x for x in getattr(params, 'profiler', 'cprofile').split(',') if len(x) > 0]
+    assert all(x in PROFILERS for x in profilers), profilers
+    _config = {
+        'stages': set(stages),
+        'iters': None if len(iters) == 0 else set(int(x) for x in iters),
+        'profilers': profilers,
+        'top': getattr(params, 'profile_top', 20),
+        'cuda': getattr(params, 'cuda', False),
+        'path': os.path.join(params.exp_path, 'profiles'),
+    }
+    if not os.path.isdir(_config['path']):
+        os.makedirs(_config['path'])
+    logger.info('Profiling %s (%s) in %s' % (', '.join(stages), ', '.join(profilers), _config['path']))
+
+
+def set_iteration(n_iter, phase='iter'):
+    """
+    Set the current iteration (epoch) of the run.
+    """
+    global _iteration
+    _iteration = (phase, n_iter)
+
+
+@contextmanager
+def profile_iteration(n_iter, phase='iter'):
+    """
+    Set the iteration of the stages run in this thread (e.g. for the
+    evaluation of an iteration that runs behind the training).
+    """
+    _local.iteration = (phase, n_iter)
+    try:
+        yield
+    finally:
+        del _local.iteration
+
+
+def get_iteration():
+    return getattr(_local, 'iteration', _iteration)
+
+
+def is_profiled(name):
+    if _config is None or name not in _config['stages']:
+        return False
+    iteration = get_iteration()
+    return _config['iters'] is None or iteration == '' or iteration[1] in _config['iters']
+
+
+def get_profile_prefix(name):
+    """
+    Profiles of a stage: <stage>[.<phase><iteration>].<call>, one per call.
+    """
+    iteration = get_iteration()
+    prefix = name.replace('/', '-') + ('' if iteration == '' else '.%s%i' % iteration)
+    call = _counts.get(prefix, 0)
+    _counts[prefix] = call + 1
+    return os.path.join(_config['path'], '%s.%i' % (prefix, call))
+
+
+@contextmanager
+def profile(name):
+    """
+    Profile a stage if it was selected. cProfile only profiles the current
+    thread, the torch profiler records the operators of all the threads.
+    """
+    if not is_profiled(name) or not _active.acquire(False):
+        yield
+        return
+    try:
+        prefix = get_profile_prefix(name)
+        profilers = _config['profilers']
+        if 'torch' in profilers:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if _config['cuda']:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profiler = torch.profiler.profile(activities=activities)
+            torch_profiler.__enter__()
+        if 'cprofile' in profilers:
+            python_profiler = cProfile.Profile()
+            python_profiler.enable()
+        try:
+            yield
+        finally:
+            if 'cprofile' in profilers:
+                python_profiler.disable()
+            if 'torch' in profilers:
+                torch_profiler.__exit__(None, None, None)
+            summaries = []
+            if 'cprofile' in profilers:
+                python_profiler.dump_stats(prefix + '.prof')
+                s = io.StringIO()
+                pstats.Stats(python_profiler, stream=s).sort_stats('tottime').print_stats(_config['top'])
+                summaries.append(s.getvalue().strip())
+            if 'torch' in profilers:
+                torch_profiler.export_chrome_trace(prefix + '.trace.json')
+                summaries.append(torch_profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=_config['top']))
+            logger.info('Profile of %s written to %s.*\n%s' % (name, prefix, '\n\n'.join(summaries)))
+    finally:
+        _active.release()
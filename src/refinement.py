@@ -0,0 +1,71 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+from logging import getLogger
+from collections import OrderedDict
+
+from .instrument import log_stages
+from .profiler import profile, set_iteration
+
+
+logger = getLogger()
+
+
+def procrustes_refinement(trainer, evaluator, metric, start_iter=0, pipeline=None):
+    """
+    Learning loop for Procrustes iterative learning (supervised training),
+    from iteration `start_iter` (the training dictionary must be loaded).
+    With a `pipeline`, iterations are evaluated in the background.
+    Returns the logs of the iterations.
+    """
+    params = trainer.params
+    # start generalized training with support
+    support = True if params.generalized else False
+    logs = []
+
+    for n_iter in range(start_iter, params.n_refinement + 1):
+
+        if n_iter > params.n_refinement - params.fine_tuning:
+            support = False
+
+        logger.info('Starting iteration %i...' % n_iter)
+        set_iteration(n_iter)
+        to_log = OrderedDict({'n_iter': n_iter})
+        logs.append(to_log)
+        biling_dict = True
+
+        with profile('iteration'):
+            # build a dictionary from aligned embeddings (unless
+            # it is the first iteration and we use the init one)
+            if n_iter > 0 or not hasattr(trainer, 'dico'):
+                trainer.build_dictionary(support)
+
+            # apply the Procrustes solution
+            if params.generalized:
+                trainer.generalized_procrustes(support, n_iter == 0)
+            else:
+                trainer.simple_procrustes()
+
+            # embeddings evaluation (the next dictionary is built
+            # while this iteration is evaluated by the pipeline)
+            if pipeline is None:
+                evaluator.all_eval(to_log, biling_dict)
+        if pipeline is not None:
+            pipeline.submit(to_log)
+            continue
+        log_stages(to_log)
+
+        # JSON log / save best model / end of epoch
+        logger.info("__log__:%s" % json.dumps(to_log))
+        trainer.save_best(to_log, metric)
+        trainer.save_checkpoint(n_iter)
+        logger.info('End of iteration %i.\n\n' % n_iter)
+
+    if pipeline is not None:
+        pipeline.close()
+    return logs
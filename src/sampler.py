@@ -0,0 +1,98 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import threading
+from queue import Queue
+import torch
+
+
+class DisBatchSampler(object):
+
+    def __init__(self, src_emb, tgt_embs, n_src, n_tgts, batch_size, n_batches, prefetch=False, seed=0):
+        """
+        Sample batches of (unmapped) source / target embeddings for the discriminators.
+        Each batch has a source batch, shared by all target languages, and one batch
+        per target language (`tgt_embs` / `n_tgts` are lists over target languages).
+        Word IDs are drawn among the `n_src` / `n_tgts` most frequent words, for
+        `n_batches` batches at once (typically an epoch). Embeddings are gathered
+        into preallocated buffers, optionally by a background thread.
+        A batch returned by `next` is only valid until the following call.
+        """
+        assert len(tgt_embs) == len(n_tgts)
+        self.src_weight = src_emb.weight.data
+        self.tgt_weights = [tgt_emb.weight.data for tgt_emb in tgt_embs]
+        self.n_src = n_src
+        self.n_tgts = n_tgts
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        self.device = self.src_weight.device
+        # dedicated generator, as the prefetching thread runs concurrently with training
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+        self.src_ids = None
+        self.tgt_ids = None
+        self.position = n_batches
+
+        # one buffer in use, one ready, one being filled
+        n_slots = 3 if prefetch else 1
+        self.slots = [(self.new_buffer(), [self.new_buffer() for _ in n_tgts]) for _ in range(n_slots)]
+        self.current = None
+        self.prefetch = prefetch
+        if prefetch:
+            self.free = Queue()
+            self.ready = Queue()
+            for slot in self.slots:
+                self.free.put(slot)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def new_buffer(self):
+        return torch.empty(self.batch_size, self.src_weight.size(1), dtype=torch.float32, device=self.device)
+
+    def draw_ids(self):
+        """
+        Draw the word IDs of the next `n_batches` batches.
+        """
+        shape = (self.n_batches, self.batch_size)
+        self.src_ids = torch.randint(self.n_src, shape, generator=self.generator).to(self.device)
+        self.tgt_ids = [torch.randint(n_tgt, shape, generator=self.generator).to(self.device) for n_tgt in self.n_tgts]
+        self.position = 0
+
+    def fill(self, slot):
+        """
+        Gather the embeddings of the next batch into a buffer.
+        """
+        if self.position == self.n_batches:
+            self.draw_ids()
+        src_buffer, tgt_buffers = slot
+        for weight, ids, buffer in zip([self.src_weight] + self.tgt_weights,
+                                       [self.src_ids] + self.tgt_ids,
+                                       [src_buffer] + tgt_buffers):
+            ids = ids[self.position]
+            if weight.dtype == buffer.dtype:
+                torch.index_select(weight, 0, ids, out=buffer)
+            else:
+                buffer.copy_(weight[ids])
+        self.position += 1
+        return slot
+
+    def run(self):
+        while True:
+            self.ready.put(self.fill(self.free.get()))
+
+    def next(self):
+        """
+        Return the source embeddings of the next batch, and the list
+        of target embeddings (one per target language).
+        """
+        if not self.prefetch:
+            return self.fill(self.slots[0])
+        if self.current is not None:
+            self.free.put(self.current)
+        self.current = self.ready.get()
+        return self.current
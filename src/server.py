@@ -0,0 +1,293 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import json
+import asyncio
+from logging import getLogger
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+from .utils import get_nn_avg_dist, load_best_mapping
+from .dico_builder import get_score_stats, get_scores
+
+
+logger = getLogger()
+
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class TranslationService(object):
+
+    def __init__(self, src_dico, src_emb, tgt_dico, tgt_emb, params):
+        """
+        Translate source words to one or several target languages, in the
+        aligned space given by the best mappings of an experiment.
+        `src_emb` / `tgt_emb` are the embeddings before the mapping, they are
+        kept to apply new mappings on reload.
+        """
+        self.src_dico = src_dico
+        self.src_emb = src_emb
+        self.tgt_dico = tgt_dico
+        self.tgt_emb = tgt_emb
+        self.method = params.method
+        self.src_lang = params.src_lang
+        self.tgt_lang = params.tgt_lang
+        self.mapping_path = None
+        self.state = None
+        self.reload(params.mapping_path)
+
+    def map_embeddings(self, emb, W):
+        """
+        Map and normalize embeddings.
+        """
+        emb = emb.mm(W.type_as(emb).to(emb.device).transpose(0, 1))
+        return emb.div_(emb.norm(2, 1, keepdim=True).expand_as(emb))
+
+    def reload(self, mapping_path):
+        """
+        Reload the best mappings of an experiment, and precompute the mapped
+        embeddings and the scoring terms (CSLS average similarities of both
+        the source and the target words). The new state replaces the previous
+        one at once, translations in progress finish with the previous one.
+        """
+        src_emb = self.map_embeddings(self.src_emb, load_best_mapping(mapping_path, self.src_lang))
+        state = {}
+        for lang in self.tgt_lang:
+            tgt_emb = self.map_embeddings(self.tgt_emb[lang], load_best_mapping(mapping_path, lang))
+            stats = get_score_stats(src_emb, tgt_emb, self.method)
+            if self.method.startswith('csls_knn_'):
+                knn = int(self.method[len('csls_knn_'):])
+                src_stats = torch.from_numpy(get_nn_avg_dist(tgt_emb, src_emb, knn)).type_as(src_emb)
+            else:
+                src_stats = None
+            state[lang] = (src_emb, tgt_emb, stats, src_stats)
+        self.state = state
+        self.mapping_path = mapping_path
+        logger.info('Loaded the mappings of %s' % mapping_path)
+
+    def lookup(self, words):
+        """
+        Index of each source word (None for unknown words).
+        Words that are not found are looked up lowercased.
+        """
+        ids = []
+        for word in words:
+            if word in self.src_dico:
+                ids.append(self.src_dico.index(word))
+            elif word.lower() in self.src_dico:
+                ids.append(self.src_dico.index(word.lower()))
+            else:
+                ids.append(None)
+        return ids
+
+    def translate(self, lang, ids, topk):
+        """
+        Return the `topk` best translation scores / target words of source words.
+        """
+        src_emb, tgt_emb, stats, src_stats = self.state[lang]
+        ids = torch.LongTensor(ids).to(src_emb.device)
+        query_stats = None if src_stats is None else src_stats[ids]
+        scores = get_scores(src_emb[ids], tgt_emb, self.method, stats, query_stats)
+        topk = min(topk, tgt_emb.size(0))
+        best_scores, best_targets = scores.topk(topk, dim=1, largest=True, sorted=True)
+        best_scores = best_scores.cpu().numpy()
+        best_targets = best_targets.cpu().numpy()
+        return [[(self.tgt_dico[lang][j], float(s)) for s, j in zip(row_scores, row_targets)]
+                for row_scores, row_targets in zip(best_scores, best_targets)]
+
+
+class LookupServer(object):
+
+    def __init__(self, service, params):
+        """
+        Asynchronous HTTP server for translation lookups. Concurrent requests are
+        gathered for up to `params.batch_wait` milliseconds (or `params.max_batch`
+        words) and scored together, in a single matrix product per language.
+        Endpoints:
+            GET  /translate?word=...&word=...&k=10&tgt=es
+            POST /translate   {"words": [...], "k": 10, "tgt": "es"}
+            POST /reload      {"mapping_path": "..."} (optional, default: current one)
+            GET  /health
+        """
+        self.service = service
+        self.topk = params.topk
+        self.max_batch = params.max_batch
+        self.batch_wait = params.batch_wait / 1000.
+        self.queue = None
+        self.reload_lock = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.n_requests = 0
+        self.n_batches = 0
+
+    async def serve(self, host, port):
+        """
+        Serve forever.
+        """
+        self.queue = asyncio.Queue()
+        self.reload_lock = asyncio.Lock()
+        batcher = asyncio.ensure_future(self.batch_loop())
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info('Serving translations on http://%s:%i' % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def batch_loop(self):
+        """
+        Gather the pending lookups into batches, and translate them.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_words = len(batch[0][1])
+            deadline = loop.time() + self.batch_wait
+            while n_words < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n_words += len(item[1])
+            try:
+                results = await loop.run_in_executor(self.executor, self.translate_batch, batch)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.n_batches += 1
+
+    def translate_batch(self, batch):
+        """
+        Translate a batch of lookups `(lang, ids, topk, future)`, with one
+        product per target language.
+        """
+        results = [None] * len(batch)
+        for lang in set(item[0] for item in batch):
+            items = [i for i, item in enumerate(batch) if item[0] == lang]
+            ids = [j for i in items for j in batch[i][1]]
+            topk = max(batch[i][2] for i in items)
+            translations = self.service.translate(lang, ids, topk)
+            k = 0
+            for i in items:
+                n = len(batch[i][1])
+                results[i] = [x[:batch[i][2]] for x in translations[k:k + n]]
+                k += n
+        return results
+
+    async def translate(self, words, topk, lang):
+        """
+        Translate a list of words (through the batching queue).
+        """
+        ids = self.service.lookup(words)
+        known = [i for i in ids if i is not None]
+        translations = []
+        if len(known) > 0:
+            future = asyncio.get_event_loop().create_future()
+            await self.queue.put((lang, known, topk, future))
+            translations = await future
+        translations = iter(translations)
+        return [{"word": word, "translations": None if i is None else
+                 [{"word": w, "score": round(s, 5)} for w, s in next(translations)]}
+                for word, i in zip(words, ids)]
+
+    async def reload(self, mapping_path):
+        """
+        Reload the mappings in the background, while lookups go on.
+        """
+        async with self.reload_lock:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.service.reload, mapping_path)
+
+    async def route(self, method, target, body):
+        """
+        Handle a request, return the status code and the JSON response.
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        data = json.loads(body.decode('utf-8')) if body else {}
+        if not isinstance(data, dict):
+            return 400, {"error": "the request body must be a JSON object"}
+        if url.path == '/translate':
+            if method == 'GET':
+                words = query.get('word', [])
+                topk = int(query.get('k', [self.topk])[0])
+                lang = query.get('tgt', [self.service.tgt_lang[0]])[0]
+            elif method == 'POST':
+                words = data.get('words', [])
+                topk = int(data.get('k', self.topk))
+                lang = data.get('tgt', self.service.tgt_lang[0])
+            else:
+                return 405, {"error": "use GET or POST"}
+            if lang not in self.service.tgt_lang:
+                return 400, {"error": 'unknown target language "%s"' % lang}
+            if topk < 1 or not isinstance(words, list) or not all(isinstance(w, str) for w in words):
+                return 400, {"error": "invalid words or k"}
+            self.n_requests += 1
+            return 200, {"src_lang": self.service.src_lang, "tgt_lang": lang,
+                         "translations": await self.translate(words, topk, lang)}
+        if url.path == '/reload':
+            if method != 'POST':
+                return 405, {"error": "use POST"}
+            mapping_path = data.get('mapping_path', self.service.mapping_path)
+            await self.reload(mapping_path)
+            return 200, {"status": "ok", "mapping_path": self.service.mapping_path}
+        if url.path == '/health':
+            return 200, {"status": "ok", "src_lang": self.service.src_lang, "tgt_lang": self.service.tgt_lang,
+                         "method": self.service.method, "mapping_path": self.service.mapping_path,
+                         "n_requests": self.n_requests, "n_batches": self.n_batches}
+        return 404, {"error": "unknown path %s" % url.path}
+
+    async def handle(self, reader, writer):
+        """
+        Handle the (keep-alive) HTTP requests of a connection.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, value = line.decode('latin-1').split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    status, response = await self.route(method, target, body)
+                except (ValueError, KeyError, TypeError) as e:
+                    status, response = 400, {"error": str(e)}
+                except Exception as e:
+                    logger.exception('Error while handling %s %s' % (method, target))
+                    status, response = 500, {"error": str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                response = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                writer.write(('%s %i %s\r\nContent-Type: application/json; charset=utf-8\r\n'
+                              'Content-Length: %i\r\nConnection: %s\r\n\r\n'
+                              % (version, status, HTTP_STATUS[status], len(response),
+                                 'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,108 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import copy
+import fcntl
+import atexit
+import hashlib
+import tempfile
+from logging import getLogger
+import torch
+
+from .bundle import BUNDLE_DTYPES, Bundle, write_bundle
+from .utils import load_embeddings, normalize_embeddings
+
+
+logger = getLogger()
+
+# open data files (holding a shared lock) of the embeddings this process is attached to
+_attached = []
+
+
+def get_shared_dir(params):
+    """
+    Directory of the shared embeddings (in memory if /dev/shm is available).
+    """
+    shared_dir = getattr(params, 'shared_dir', '')
+    if not shared_dir:
+        shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return shared_dir
+
+
+def get_shared_name(lang, emb_path, params):
+    """
+    Name of shared embeddings. It identifies the embedding file (path, size and
+    modification time) and everything that changes the loaded embeddings,
+    including their storage precision.
+    """
+    stat = os.stat(emb_path)
+    key = [os.path.realpath(emb_path), stat.st_size, stat.st_mtime_ns, lang, params.emb_dim,
+           params.max_vocab, params.normalize_embeddings, getattr(params, 'emb_dtype', 'float32')]
+    return 'muse-%s-%s' % (lang, hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16])
+
+
+def attach_shared_embeddings(lang, emb_path, params):
+    """
+    Return the (normalized) embeddings of a language from the shared store.
+    The first process loads them and publishes them as a bundle, in the
+    precision `params.emb_dtype`; the other ones (and the first one) memory-map
+    the bundle, so that the embeddings and the dictionary are shared by all
+    the processes of the host.
+    Each attached process holds a shared lock on the bundle: the last one
+    to exit removes it. Publishing and removing are serialized by the
+    (persistent, empty) lock file of the embeddings.
+    """
+    emb_dtype = getattr(params, 'emb_dtype', 'float32')
+    if emb_dtype not in BUNDLE_DTYPES:
+        raise Exception('Shared embeddings cannot be stored in %s (supported: %s)'
+                        % (emb_dtype, ', '.join(BUNDLE_DTYPES)))
+    shared_dir = get_shared_dir(params)
+    name = get_shared_name(lang, emb_path, params)
+    lock_path = os.path.join(shared_dir, '%s.lock' % name)
+    data_path = os.path.join(shared_dir, '%s.bundle' % name)
+
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(data_path):
+            logger.info('Attaching to the shared embeddings %s ...' % data_path)
+        else:
+            _params = copy.copy(params)
+            _params.cuda = False
+            dico, emb = load_embeddings(lang, emb_path, _params)
+            normalize_embeddings(emb, params.normalize_embeddings)
+            logger.info('Publishing the embeddings to %s ...' % data_path)
+            write_bundle(data_path, {lang: emb.numpy()}, {lang: dico}, dtype=emb_dtype,
+                         metadata={'emb_path': os.path.realpath(emb_path), 'normalize_embeddings': params.normalize_embeddings})
+            del dico, emb
+        data = open(data_path, 'rb')
+        fcntl.flock(data, fcntl.LOCK_SH)
+        bundle = Bundle(data_path)
+    _attached.append((data, lock_path, data_path))
+
+    dico = bundle.get_dictionary(lang)
+    emb = torch.from_numpy(bundle.get_embeddings(lang))
+    assert emb.size() == (len(dico), params.emb_dim) and bundle.dtype == emb_dtype
+    return dico, emb
+
+
+@atexit.register
+def release_shared_embeddings():
+    """
+    Detach from the shared embeddings, and remove those no other process uses.
+    """
+    while len(_attached) > 0:
+        data, lock_path, data_path = _attached.pop()
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fcntl.flock(data, fcntl.LOCK_UN)
+            try:
+                fcntl.flock(data, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(data_path)
+            except BlockingIOError:
+                pass
+            data.close()
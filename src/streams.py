@@ -0,0 +1,114 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+import gzip
+import lzma
+import threading
+from logging import getLogger
+from queue import Queue, Full
+
+
+logger = getLogger()
+
+
+def open_zstd(path):
+    """
+    Open a zstandard-compressed file (requires the `zstandard` package).
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("Unable to import zstandard. Please install it to read .zst files: "
+                        "pip install zstandard")
+    return zstandard.ZstdDecompressor().stream_reader(io.open(path, 'rb'), closefd=True)
+
+
+COMPRESSED_OPENERS = {
+    '.gz': lambda path: gzip.open(path, 'rb'),
+    '.xz': lambda path: lzma.open(path, 'rb'),
+    '.zst': open_zstd,
+}
+
+
+class ThreadedReader(io.RawIOBase):
+
+    def __init__(self, f, chunk_size=1 << 20, n_chunks=8):
+        """
+        Read a binary stream (e.g. a decompressor) in a background thread,
+        at most `n_chunks` chunks ahead of the consumer. Closing the reader
+        stops the thread, so that the rest of the stream is never read.
+        """
+        super(ThreadedReader, self).__init__()
+        self.f = f
+        self.chunk_size = chunk_size
+        self.queue = Queue(n_chunks)
+        self.stop = threading.Event()
+        self.buffer = memoryview(b'')
+        self.eof = False
+        self.n_bytes = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                chunk = self.f.read(self.chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self.put(e)
+
+    def put(self, x):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(x, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if len(self.buffer) == 0:
+            if self.eof:
+                return 0
+            chunk = self.queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.buffer = memoryview(chunk)
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        self.n_bytes += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.f.close()
+            if not self.eof:
+                logger.info("Stopped reading after %i decompressed bytes." % self.n_bytes)
+        super(ThreadedReader, self).close()
+
+
+def open_text(path):
+    """
+    Open a text file for reading. Compressed files (.gz / .xz / .zst) are
+    decompressed in a background thread while they are read.
+    """
+    for ext, opener in COMPRESSED_OPENERS.items():
+        if path.endswith(ext):
+            raw = ThreadedReader(opener(path))
+            return io.TextIOWrapper(io.BufferedReader(raw), encoding='utf-8', errors='ignore', newline='\n')
+    return io.open(path, 'r', encoding='utf-8', newline='\n', errors='ignore')
@@ -0,0 +1,196 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import io
+import copy
+import json
+import itertools
+import multiprocessing
+from logging import getLogger
+from collections import OrderedDict
+import numpy as np
+import torch
+
+from .logger import create_logger
+from .trainer import Trainer, read_training_dico
+from .evaluation import Evaluator
+from .refinement import procrustes_refinement
+
+
+logger = getLogger()
+
+# parameters that can be swept (those that do not change the loaded embeddings)
+SWEEP_PARAMS = ['dico_train', 'dico_method', 'dico_build', 'dico_threshold', 'dico_max_rank', 'dico_prefilter',
+                'dico_min_size', 'dico_max_size', 'n_refinement', 'fine_tuning', 'generalized']
+
+# data shared by the configurations (inherited by the forked workers)
+_shared = {}
+
+
+def get_configs(grid, names=SWEEP_PARAMS):
+    """
+    Read the configurations of a sweep. `grid` is a JSON string, or the path of
+    a JSON file, with either a list of configurations (dictionaries of parameters),
+    or a dictionary of parameter values, whose cartesian product is swept.
+    Parameters must be in `names`.
+    """
+    if os.path.isfile(grid):
+        with io.open(grid, 'r', encoding='utf-8') as f:
+            grid = f.read()
+    grid = json.loads(grid)
+    if isinstance(grid, dict):
+        names = sorted(grid.keys())
+        values = [grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names]
+        configs = [OrderedDict(zip(names, v)) for v in itertools.product(*values)]
+    else:
+        configs = [OrderedDict(sorted(config.items())) for config in grid]
+    assert len(configs) > 0
+    for config in configs:
+        for name in config:
+            if name not in names:
+                raise Exception('Parameter "%s" cannot be swept (sweepable parameters: %s)'
+                                % (name, ', '.join(names)))
+    return configs
+
+
+def get_config_params(params, config):
+    """
+    Parameters of a configuration, checked as in the supervised training.
+    """
+    params = copy.copy(params)
+    for name, value in config.items():
+        setattr(params, name, value)
+    assert params.dico_train in ["identical_char", "default", "identical_num"] or os.path.isfile(params.dico_train)
+    assert params.dico_build in ["S2T", "T2S", "S2T|T2S", "S2T&T2S"]
+    assert params.dico_prefilter in ["", "full", "window"]
+    assert params.dico_max_size == 0 or params.dico_max_size < params.dico_max_rank
+    assert params.dico_max_size == 0 or params.dico_max_size > params.dico_min_size
+    assert len(params.tgt_lang) == 1 or params.generalized
+    assert params.fine_tuning <= params.n_refinement
+    return params
+
+
+def share_data(src_emb, tgt_emb, mapping, configs, params):
+    """
+    Share the embeddings, the initial mapping, and the training dictionaries
+    of all the configurations (each training dictionary is loaded once).
+    No `Trainer` is built here, so that no thread (e.g. its checkpoint writer)
+    runs when the workers are forked.
+    """
+    _shared['src_emb'] = src_emb
+    _shared['tgt_emb'] = tgt_emb
+    _shared['mapping'] = mapping
+    _shared['params'] = params
+    _shared['dico'] = {}
+    for config in configs:
+        _params = get_config_params(params, config)
+        key = (_params.dico_train, bool(_params.generalized))
+        if key not in _shared['dico']:
+            logger.info('Loading the training dictionary "%s" ...' % _params.dico_train)
+            _shared['dico'][key] = read_training_dico(key[0], key[1], _params)
+
+
+def get_best_log(trainer, logs, metric):
+    """
+    Log of the best iteration for the validation metric.
+    """
+    return max(logs, key=lambda to_log: trainer.get_valid_metric(to_log, metric))
+
+
+def run_config(job):
+    """
+    Train and evaluate a configuration, from a fresh copy of the initial mapping.
+    The configuration is stored in its own experiment folder.
+    Returns its row in the results table.
+    """
+    config_id, config, metric, n_threads, vb = job
+    params = get_config_params(_shared['params'], config)
+    params.exp_path = os.path.join(_shared['params'].exp_path, config_id)
+    os.mkdir(params.exp_path)
+    with io.open(os.path.join(params.exp_path, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+    # log the configuration to its own folder
+    handlers = logger.handlers
+    create_logger(os.path.join(params.exp_path, 'train.log'), vb=vb)
+    logger.info('============ Configuration %s: %s ============' % (config_id, json.dumps(config)))
+    row = OrderedDict([('id', config_id)] + list(config.items()))
+    try:
+        if n_threads > 0:
+            torch.set_num_threads(n_threads)
+        if getattr(params, 'seed', -1) >= 0:
+            np.random.seed(params.seed)
+            torch.manual_seed(params.seed)
+        mapping = copy.deepcopy(_shared['mapping'])
+        trainer = Trainer(_shared['src_emb'], _shared['tgt_emb'], mapping, None, params)
+        trainer.dico = _shared['dico'][(params.dico_train, bool(params.generalized))].clone()
+        evaluator = Evaluator(trainer)
+        logs = procrustes_refinement(trainer, evaluator, metric)
+        trainer.writer.wait()
+        best = get_best_log(trainer, logs, metric)
+        row['best_iter'] = best['n_iter']
+        row['valid_metric'] = trainer.get_valid_metric(best, metric)
+        row.update((k, v) for k, v in best.items() if k != 'n_iter')
+    except Exception as e:
+        logger.exception('Configuration %s failed' % config_id)
+        row['error'] = repr(e)
+    finally:
+        for handler in logger.handlers:
+            handler.close()
+        logger.handlers = handlers
+    return row
+
+
+def run_sweep(configs, metric, n_jobs):
+    """
+    Run the configurations of a sweep, in `n_jobs` worker processes. Workers are
+    forked, so that they share the loaded data (copy-on-write). With a single
+    job, configurations run in the current process.
+    Returns the rows of the results table, in the order of the configurations.
+    """
+    # workers split the cores, and only log warnings to the console
+    n_threads = 0 if n_jobs == 1 else max(1, (os.cpu_count() or 1) // n_jobs)
+    vb = _shared['params'].verbose if n_jobs == 1 else 0
+    jobs = [('%03i' % i, config, metric, n_threads, vb) for i, config in enumerate(configs)]
+    rows = []
+    if n_jobs == 1:
+        for job in jobs:
+            rows.append(run_config(job))
+            log_row(rows[-1])
+        return rows
+    # a new worker per configuration, forked from the loaded data
+    with multiprocessing.get_context('fork').Pool(n_jobs, maxtasksperchild=1) as pool:
+        for row in pool.imap_unordered(run_config, jobs):
+            rows.append(row)
+            log_row(row)
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def log_row(row):
+    if 'error' in row:
+        logger.warning('Configuration %s failed: %s' % (row['id'], row['error']))
+    else:
+        logger.info('Configuration %s: best iteration %i, validation metric %.5f'
+                    % (row['id'], row['best_iter'], row['valid_metric']))
+
+
+def write_results(rows, path, names=SWEEP_PARAMS):
+    """
+    Write the results of a sweep to a TSV table (one row per configuration).
+    """
+    columns = []
+    for row in rows:
+        columns += [k for k in row if k not in columns]
+    # swept parameters first
+    columns = ['id'] + [k for k in names if k in columns] + [k for k in columns if k != 'id' and k not in names]
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in rows:
+            values = [row.get(k, '') for k in columns]
+            f.write('\t'.join('%.5f' % v if isinstance(v, float) else str(v) for v in values) + '\n')
+    logger.info('Wrote the results of %i configurations to %s' % (len(rows), path))
@@ -0,0 +1,107 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+from logging import getLogger
+import numpy as np
+
+
+logger = getLogger()
+
+
+def random_rotation(dim, rng):
+    """
+    Random orthogonal matrix (uniformly distributed).
+    """
+    Q, R = np.linalg.qr(rng.randn(dim, dim))
+    return Q * np.sign(np.diag(R))[None, :]
+
+
+def generate_languages(langs, n_words, dim, noise=0.5, rank_noise=0.1, n_clusters=100, shared=0., seed=0):
+    """
+    Generate synthetic languages sharing a latent space: each language is a random
+    rotation of the latent vectors of `n_words` concepts, with Gaussian noise.
+    Latent vectors are drawn around `n_clusters` topics, with a decaying spectrum,
+    so that the latent distribution is not rotation-invariant (and the rotations
+    can be recovered without supervision).
+    Concepts are ranked by frequency, with a language-specific jitter of the ranks.
+    A `shared` fraction of the concepts are spelled identically in all languages.
+    Returns, for each language, its words and embeddings (in frequency order),
+    and the concept of each word: words of the same concept are translations.
+    """
+    rng = np.random.RandomState(seed)
+    scales = (1. + np.arange(dim)) ** -0.5
+    centers = rng.randn(max(n_clusters, 1), dim) * scales
+    latent = centers[rng.randint(len(centers), size=n_words)] + 0.5 * rng.randn(n_words, dim) * scales
+    latent = (latent / np.linalg.norm(latent, axis=1, keepdims=True)).astype(np.float32)
+    is_shared = rng.rand(n_words) < shared
+    languages = {}
+    for lang in langs:
+        rotation = random_rotation(dim, rng).astype(np.float32)
+        # frequency order of the concepts in this language
+        ranks = np.arange(n_words) * np.exp(rank_noise * rng.randn(n_words))
+        concepts = np.argsort(ranks, kind='stable')
+        embeddings = latent[concepts].dot(rotation)
+        embeddings += (noise / np.sqrt(dim)) * rng.randn(n_words, dim).astype(np.float32)
+        words = [('w%i' if is_shared[c] else lang + '%i') % c for c in concepts]
+        languages[lang] = (words, embeddings, concepts)
+    logger.info('Generated %i synthetic languages (%s) of %i words in dimension %i'
+                % (len(langs), ', '.join(langs), n_words, dim))
+    return languages
+
+
+def get_translation_pairs(src, tgt):
+    """
+    Ground-truth translations between two synthetic languages: the (src, tgt)
+    word indices of each concept, sorted by source frequency.
+    """
+    _, _, src_concepts = src
+    _, _, tgt_concepts = tgt
+    tgt_ids = np.empty_like(tgt_concepts)
+    tgt_ids[tgt_concepts] = np.arange(len(tgt_concepts))
+    return np.stack([np.arange(len(src_concepts)), tgt_ids[src_concepts]], 1)
+
+
+def write_txt_embeddings(path, words, embeddings):
+    """
+    Write embeddings to a text file, in the fastText .vec format.
+    """
+    fmt = u"%s " + u" ".join([u"%.5f"] * embeddings.shape[1]) + u"\n"
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u"%i %i\n" % embeddings.shape)
+        for word, vector in zip(words, embeddings):
+            f.write(fmt % ((word,) + tuple(vector.tolist())))
+
+
+def write_bin_embeddings(path, words, embeddings):
+    """
+    Write embeddings to a word2vec binary file.
+    """
+    with io.open(path, 'wb') as f:
+        f.write(("%i %i\n" % embeddings.shape).encode('utf-8'))
+        for word, vector in zip(words, embeddings):
+            f.write(word.encode('utf-8') + b' ' + vector.astype('<f4').tobytes() + b'\n')
+
+
+def write_dictionary(path, pairs, src_words, tgt_words):
+    """
+    Write translation pairs (word indices) to a dictionary file, one pair per line.
+    """
+    with io.open(path, 'w', encoding='utf-8') as f:
+        for i, j in pairs:
+            f.write(u"%s %s\n" % (src_words[i], tgt_words[j]))
+
+
+def get_dictionary_splits(n_words):
+    """
+    Source frequency ranges of the train / test dictionaries, following the
+    layout of the MUSE dictionaries (%s-%s.0-5000.txt / %s-%s.5000-6500.txt),
+    shrunk for vocabularies smaller than 6500 words.
+    """
+    train_end = min(5000, n_words * 10 // 13)
+    test_end = min(train_end + 1500, n_words)
+    return [('0-5000', 0, train_end), ('5000-6500', train_end, test_end)]
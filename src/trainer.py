@@ -6,7 +6,9 @@
 #
 
 import os
+from copy import deepcopy
 from logging import getLogger
+import numpy as np
 import scipy
 import scipy.linalg
 import torch
@@ -14,14 +16,53 @@ from torch.autograd import Variable
 from torch.nn import functional as F
 
 from .utils import get_optimizer, load_embeddings, normalize_embeddings, export_embeddings
-from .utils import clip_parameters
-from .dico_builder import build_dictionary, cross_match_dictionary
-from .evaluation.word_translation import DIC_EVAL_PATH, load_identical_char_dico, load_identical_num_dico, load_dictionary
+from .utils import clip_parameters, map_embeddings, get_rng_state, set_rng_state, load_best_mapping
+from .checkpoint import CHECKPOINT_NAME, AsyncWriter
+from .dico_builder import build_dictionary, build_pairwise_dictionary, cross_match_dictionary
+from .sampler import DisBatchSampler
+from .instrument import timed
+from .distributed import is_master, broadcast_parameters, all_reduce_gradients
+from .evaluation.word_translation import get_dico_path, load_identical_char_dico, load_identical_num_dico, load_dictionary
 
 
 logger = getLogger()
 
 
+def read_training_dico(dico_train, support, params):
+    """
+    Load a training dictionary, between the source dictionary `params.src_dico`
+    and the target dictionaries `params.tgt_dico`.
+    """
+    dico = {}
+    dico_inbn = {}
+
+    word2id1 = params.src_dico.word2id
+
+    for lang in params.tgt_lang:
+        word2id2 = params.tgt_dico[lang].word2id
+
+        # identical character strings
+        if dico_train == "identical_char":
+            dico[lang] = load_identical_char_dico(word2id1, word2id2, True)
+        #identical numbers
+        elif dico_train == 'identical_num':
+            dico[lang] = load_identical_num_dico(word2id1, word2id2, True)
+        # use one of the provided dictionary
+        elif dico_train == "default":
+            filename = '%s-%s.0-5000.txt' % (params.src_lang, lang)
+            dico[lang] = load_dictionary(
+                os.path.join(get_dico_path(params), filename),
+                word2id1, word2id2, True
+            )
+        # dictionary provided by the user
+        else:
+            dico[lang] = load_dictionary(dico_train, word2id1, word2id2, True)
+    if support and len(params.tgt_lang)>1:
+        dico_inbn[params.tgt_lang[1]] = load_identical_char_dico(params.tgt_dico[params.tgt_lang[0]].word2id,params.tgt_dico[params.tgt_lang[1]].word2id, True)
+
+    return cross_match_dictionary(params.tgt_lang, dico, dico_inbn, params)
+
+
 class Trainer(object):
 
     def __init__(self, src_emb, tgt_emb, mapping, discriminator, params):
@@ -36,152 +77,214 @@ class Trainer(object):
         self.discriminator = discriminator
         self.params = params
 
+        # languages trained adversarially, each with its own discriminator. With a single
+        # target language, the source is mapped to the target space (`adv_mapped`).
+        # With several target languages, they are all mapped to the source space.
+        self.adv_langs = [self.params.tgt_lang[-1]] if len(self.params.tgt_lang) == 1 else self.params.tgt_lang
+        self.adv_mapped = [self.params.src_lang] if len(self.params.tgt_lang) == 1 else self.params.tgt_lang
+
         # optimizers
         if hasattr(params, 'map_optimizer'):
             optim_fn, optim_params = get_optimizer(params.map_optimizer)
-            self.map_optimizer = optim_fn(mapping[self.params.src_lang].parameters(), **optim_params)
+            self.map_optimizer = optim_fn([p for lang in self.adv_mapped for p in mapping[lang].parameters()], **optim_params)
         if hasattr(params, 'dis_optimizer'):
             optim_fn, optim_params = get_optimizer(params.dis_optimizer)
-            self.dis_optimizer = optim_fn(discriminator.parameters(), **optim_params)
+            self.dis_optimizer = {lang: optim_fn(discriminator[lang].parameters(), **optim_params) for lang in self.adv_langs}
         else:
             assert discriminator is None
 
-        # best validation score
+        # best validation score (and best per target language, see `save_best`)
         self.best_valid_metric = -1e12
+        self.best_valid_metrics = {}
 
         self.decrease_lr = False
 
-    def get_dis_xy(self, volatile):
+        # mappings and checkpoints are written in the background
+        self.writer = AsyncWriter()
+
+        # discriminator batches
+        self.dis_sampler = None
+
+        # data-parallel workers start from the parameters of the master
+        if getattr(params, 'distributed', False):
+            self.sync_parameters()
+
+    def build_dis_sampler(self):
         """
-        Get discriminator input batch / output target.
+        Build the discriminator batch sampler and the preallocated inputs / target.
         """
-        # select random word IDs
         bs = self.params.batch_size
-        if not self.params.dis_most_frequent <= min(len(self.src_dico), len(self.tgt_dico[self.params.tgt_lang[-1]])):
-            self.params.dis_most_frequent = min(len(self.src_dico), len(self.tgt_dico[self.params.tgt_lang[-1]]))
+        n_words = [len(self.src_dico)] + [len(self.tgt_dico[lang]) for lang in self.adv_langs]
+        if not self.params.dis_most_frequent <= min(n_words):
+            self.params.dis_most_frequent = min(n_words)
         mf = self.params.dis_most_frequent
-        src_ids = torch.LongTensor(bs).random_(len(self.src_dico) if mf == 0 else mf)
-        tgt_ids = torch.LongTensor(bs).random_(len(self.tgt_dico[self.params.tgt_lang[-1]]) if mf == 0 else mf)
+
+        # word IDs are drawn for a whole epoch (discriminator + mapping steps),
+        # data-parallel workers draw different batches
+        n_batches = -(-self.params.epoch_size // bs) * (self.params.dis_steps + 1)
+        self.dis_sampler = DisBatchSampler(
+            self.src_emb, [self.tgt_emb[lang] for lang in self.adv_langs],
+            len(self.src_dico) if mf == 0 else mf,
+            [len(self.tgt_dico[lang]) if mf == 0 else mf for lang in self.adv_langs],
+            bs, n_batches, prefetch=getattr(self.params, 'dis_prefetch', False),
+            seed=(torch.randint(2 ** 31 - 1, (1,)).item() + 1000003 * getattr(self.params, 'rank', 0)) % (2 ** 31 - 1)
+        )
+
+        # inputs / target
+        self.dis_x = {lang: torch.empty(2 * bs, self.params.emb_dim) for lang in self.adv_langs}
+        self.dis_y = torch.FloatTensor(2 * bs).zero_()
+        self.dis_y[:bs] = 1 - self.params.dis_smooth
+        self.dis_y[bs:] = self.params.dis_smooth
         if self.params.cuda:
-            src_ids = src_ids.cuda()
-            tgt_ids = tgt_ids.cuda()
+            self.dis_x = {lang: x.cuda() for lang, x in self.dis_x.items()}
+            self.dis_y = self.dis_y.cuda()
+
+    def get_dis_xy(self, volatile):
+        """
+        Get discriminator input batches / output target, for each target language.
+        The source batch is shared by all target languages.
+        The returned tensors are reused by the next call.
+        """
+        if self.dis_sampler is None:
+            self.build_dis_sampler()
+        bs = self.params.batch_size
 
         # get word embeddings
-        src_emb = self.src_emb(Variable(src_ids, volatile=True))
-        tgt_emb = self.tgt_emb[self.params.tgt_lang[-1]](Variable(tgt_ids, volatile=True))
-        src_emb = self.mapping[self.params.src_lang](Variable(src_emb.data, volatile=volatile))
-        tgt_emb = Variable(tgt_emb.data, volatile=volatile)
+        src_emb, tgt_embs = self.dis_sampler.next()
 
         # input / target
-        x = torch.cat([src_emb, tgt_emb], 0)
-        y = torch.FloatTensor(2 * bs).zero_()
-        y[:bs] = 1 - self.params.dis_smooth
-        y[bs:] = self.params.dis_smooth
-        y = Variable(y.cuda() if self.params.cuda else y)
+        xy = {}
+        for lang, tgt_emb in zip(self.adv_langs, tgt_embs):
+            mapped_lang = self.params.src_lang if self.params.src_lang in self.adv_mapped else lang
+            mapping = self.mapping[mapped_lang]
+            if volatile:
+                # no gradient for the mapping: fill the preallocated input
+                x = self.dis_x[lang]
+                with torch.no_grad():
+                    if mapped_lang == self.params.src_lang:
+                        torch.mm(src_emb, mapping.weight.t(), out=x[:bs])
+                        x[bs:].copy_(tgt_emb)
+                    else:
+                        x[:bs].copy_(src_emb)
+                        torch.mm(tgt_emb, mapping.weight.t(), out=x[bs:])
+            elif mapped_lang == self.params.src_lang:
+                x = torch.cat([mapping(src_emb), tgt_emb], 0)
+            else:
+                x = torch.cat([src_emb, mapping(tgt_emb)], 0)
+            xy[lang] = (x, self.dis_y)
 
-        return x, y
+        return xy
 
     def dis_step(self, stats):
         """
-        Train the discriminator.
+        Train the discriminators (one step for each target language).
         """
-        self.discriminator.train()
-
-        # loss
-        x, y = self.get_dis_xy(volatile=True)
-        preds = self.discriminator(Variable(x.data))
-        loss = F.binary_cross_entropy(preds, y)
-        stats['DIS_COSTS'].append(loss.data[0])
-
-        # check NaN
-        if (loss != loss).data.any():
-            logger.error("NaN detected (discriminator)")
-            exit()
-
-        # optim
-        self.dis_optimizer.zero_grad()
-        loss.backward()
-        self.dis_optimizer.step()
-        clip_parameters(self.discriminator, self.params.dis_clip_weights)
+        for lang, (x, y) in self.get_dis_xy(volatile=True).items():
+            discriminator = self.discriminator[lang]
+            discriminator.train()
+
+            # loss
+            preds = discriminator(Variable(x.data))
+            loss = F.binary_cross_entropy(preds, y)
+            stats['DIS_COSTS'].append(loss.item())
+
+            # check NaN
+            if (loss != loss).data.any():
+                logger.error("NaN detected (discriminator)")
+                exit()
+
+            # optim
+            self.dis_optimizer[lang].zero_grad()
+            loss.backward()
+            if getattr(self.params, 'distributed', False):
+                all_reduce_gradients([discriminator], self.params.world_size)
+            self.dis_optimizer[lang].step()
+            clip_parameters(discriminator, self.params.dis_clip_weights)
 
     def mapping_step(self, stats):
         """
-        Fooling discriminator training step.
+        Fooling discriminator training step (all target languages).
         """
         if self.params.dis_lambda == 0:
             return 0
 
-        self.discriminator.eval()
+        self.map_optimizer.zero_grad()
+
+        for lang, (x, y) in self.get_dis_xy(volatile=False).items():
+            self.discriminator[lang].eval()
 
-        # loss
-        x, y = self.get_dis_xy(volatile=False)
-        preds = self.discriminator(x)
-        loss = F.binary_cross_entropy(preds, 1 - y)
-        loss = self.params.dis_lambda * loss
+            # loss
+            preds = self.discriminator[lang](x)
+            loss = F.binary_cross_entropy(preds, 1 - y)
+            loss = self.params.dis_lambda * loss
 
-        # check NaN
-        if (loss != loss).data.any():
-            logger.error("NaN detected (fool discriminator)")
-            exit()
+            # check NaN
+            if (loss != loss).data.any():
+                logger.error("NaN detected (fool discriminator)")
+                exit()
+
+            loss.backward()
 
         # optim
-        self.map_optimizer.zero_grad()
-        loss.backward()
+        if getattr(self.params, 'distributed', False):
+            all_reduce_gradients([self.mapping[lang] for lang in self.adv_mapped], self.params.world_size)
         self.map_optimizer.step()
         self.orthogonalize()
 
-        return 2 * self.params.batch_size
+        return 2 * self.params.batch_size * len(self.adv_langs)
 
+    def sync_parameters(self):
+        """
+        Copy the mapping / discriminators of the master to all data-parallel workers.
+        Updates are identical on all workers, this only guards against drift.
+        """
+        for lang in sorted(self.mapping):
+            broadcast_parameters(self.mapping[lang])
+        if self.discriminator is not None:
+            for lang in sorted(self.discriminator):
+                broadcast_parameters(self.discriminator[lang])
+
+    @timed('load_training_dico')
     def load_training_dico(self, dico_train, support):
         """
         Load training dictionary.
         """
-        dico = {}
-        dico_inbn = {}
-
-        word2id1 = self.src_dico.word2id
-
-        for lang in self.params.tgt_lang:
-            word2id2 = self.tgt_dico[lang].word2id
-
-            # identical character strings
-            if dico_train == "identical_char":
-                dico[lang] = load_identical_char_dico(word2id1, word2id2, True)
-            #identical numbers
-            elif dico_train == 'identical_num':
-                dico[lang] = load_identical_num_dico(word2id1, word2id2, True)
-            # use one of the provided dictionary
-            elif dico_train == "default":
-                filename = '%s-%s.0-5000.txt' % (self.params.src_lang, lang)
-                dico[lang] = load_dictionary(
-                    os.path.join(DIC_EVAL_PATH, filename),
-                    word2id1, word2id2, True
-                )
-            # dictionary provided by the user
-            else:
-                dico[lang] = load_dictionary(dico_train, word2id1, word2id2, True)
-        if support and len(self.params.tgt_lang)>1:
-            dico_inbn[self.params.tgt_lang[1]] = load_identical_char_dico(self.tgt_dico[self.params.tgt_lang[0]].word2id,self.tgt_dico[self.params.tgt_lang[1]].word2id, True)
+        self.dico = read_training_dico(dico_train, support, self.params)
 
-        self.dico = cross_match_dictionary(self.params.tgt_lang, dico, dico_inbn, self.params)
-
-    def build_dictionary(self,support):
+    @timed('build_dictionary')
+    def build_dictionary(self, support, lang=None):
         """
         Build a dictionary from aligned embeddings.
+        If `lang` is given, only build the source to `lang` dictionary.
         """
-        src_emb = self.mapping[self.params.src_lang](self.src_emb.weight).data
-        tgt_emb = {lang: self.mapping[lang](self.tgt_emb[lang].weight).data for lang in self.params.tgt_lang}
+        tgt_langs = self.params.tgt_lang if lang is None else [lang]
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
+        tgt_emb = {lang: map_embeddings(self.mapping[lang], self.tgt_emb[lang]) for lang in tgt_langs}
         src_emb = src_emb / src_emb.norm(2, 1, keepdim=True).expand_as(src_emb)
-        tgt_emb = {lang: tgt_emb[lang] / tgt_emb[lang].norm(2, 1, keepdim=True).expand_as(tgt_emb[lang]) for lang in self.params.tgt_lang}
-        self.dico = build_dictionary(src_emb, tgt_emb, self.params, support)
+        tgt_emb = {lang: tgt_emb[lang] / tgt_emb[lang].norm(2, 1, keepdim=True).expand_as(tgt_emb[lang]) for lang in tgt_langs}
+        if lang is None:
+            self.dico = build_dictionary(src_emb, tgt_emb, self.params, support)
+        else:
+            self.dico = build_pairwise_dictionary(src_emb, tgt_emb[lang], self.params, return_tensor=True)
 
-    def simple_procrustes(self):
+    @timed('procrustes')
+    def simple_procrustes(self, lang=None):
         """
         Find the best orthogonal matrix mapping using the Orthogonal Procrustes problem
         https://en.wikipedia.org/wiki/Orthogonal_Procrustes_problem
+        If `lang` is given, the `lang` embeddings are mapped to the (mapped) source
+        embeddings, using the source to `lang` dictionary.
         """
-        A = self.src_emb.weight.data[self.dico[:, 0]]###TODO: if same row repeats in dico, will have same rows in matrices
-        B = self.tgt_emb[self.params.tgt_lang[-1]].weight.data[self.dico[:, 1]]
+        if lang is not None:
+            A = self.tgt_emb[lang].weight.data[self.dico[:, 1]].float()
+            B = self.mapping[self.params.src_lang](self.src_emb.weight.data[self.dico[:, 0]].float()).data
+            W = self.mapping[lang].weight.data
+            M = B.transpose(0, 1).mm(A).cpu().numpy()
+            U, S, V_t = scipy.linalg.svd(M, full_matrices=True)
+            W.copy_(torch.from_numpy(U.dot(V_t)).type_as(W))
+            return
+        A = self.src_emb.weight.data[self.dico[:, 0]].float()###TODO: if same row repeats in dico, will have same rows in matrices
+        B = self.tgt_emb[self.params.tgt_lang[-1]].weight.data[self.dico[:, 1]].float()
         W = self.mapping[self.params.src_lang].weight.data
         M = B.transpose(0, 1).mm(A).cpu().numpy()
         U, S, V_t = scipy.linalg.svd(M, full_matrices=True)
@@ -194,14 +297,15 @@ class Trainer(object):
             group_average=torch.mean(torch.stack([X[lang].mm(T[lang]) for lang in X.keys()]),0)
         return group_average
 
+    @timed('generalized_procrustes')
     def generalized_procrustes(self, support, initial_run):
         """
         Find the best orthogonal matrix mapping using the Orthogonal Procrustes problem
         https://en.wikipedia.org/wiki/Orthogonal_Procrustes_problem
         """
         lang_list=[self.params.tgt_lang[-1]] if not support else self.params.tgt_lang
-        X = {lang: self.tgt_emb[lang].weight.data[self.dico[:, i]] for i,lang in enumerate(lang_list,1)}
-        X[self.params.src_lang] = self.src_emb.weight.data[self.dico[:,0]]
+        X = {lang: self.tgt_emb[lang].weight.data[self.dico[:, i]].float() for i,lang in enumerate(lang_list,1)}
+        X[self.params.src_lang] = self.src_emb.weight.data[self.dico[:,0]].float()
         T = {lang: self.mapping[lang].weight.data for lang in [self.params.src_lang]+lang_list}
         for _ in range(100):
             if initial_run:
@@ -218,12 +322,13 @@ class Trainer(object):
 
     def orthogonalize(self):
         """
-        Orthogonalize the mapping.
+        Orthogonalize the mapping (of every adversarially trained language).
         """
         if self.params.map_beta > 0:
-            W = self.mapping[self.params.src_lang].weight.data
-            beta = self.params.map_beta
-            W.copy_((1 + beta) * W - beta * W.mm(W.transpose(0, 1).mm(W)))
+            for lang in self.adv_mapped:
+                W = self.mapping[lang].weight.data
+                beta = self.params.map_beta
+                W.copy_((1 + beta) * W - beta * W.mm(W.transpose(0, 1).mm(W)))
 
     def update_lr(self, to_log, metric):
         """
@@ -237,10 +342,11 @@ class Trainer(object):
             logger.info("Decreasing learning rate: %.8f -> %.8f" % (old_lr, new_lr))
             self.map_optimizer.param_groups[0]['lr'] = new_lr
 
-        if self.params.lr_shrink < 1 and to_log[metric] >= -1e7:
-            if to_log[metric] < self.best_valid_metric:
+        value = self.get_valid_metric(to_log, metric)
+        if self.params.lr_shrink < 1 and value >= -1e7:
+            if value < self.best_valid_metric:
                 logger.info("Validation metric is smaller than the best: %.5f vs %.5f"
-                            % (to_log[metric], self.best_valid_metric))
+                            % (value, self.best_valid_metric))
                 # decrease the learning rate, only if this is the
                 # second time the validation metric decreases
                 if self.decrease_lr:
@@ -250,33 +356,127 @@ class Trainer(object):
                                 % (old_lr, self.map_optimizer.param_groups[0]['lr']))
                 self.decrease_lr = True
 
-    def save_best(self, to_log, metric):
+    def snapshot_mapping(self):
+        """
+        Copy the current mapping, so that it can be evaluated while training goes on.
+        """
+        return {lang: deepcopy(self.mapping[lang]) for lang in self.mapping}
+
+    def get_valid_metric(self, to_log, metric):
+        """
+        Get the value of a validation metric. A per-language metric
+        (with a "{}" placeholder for the language) is averaged over target languages.
+        """
+        if '{}' not in metric:
+            return to_log[metric]
+        return float(np.mean([to_log[metric.format(lang)] for lang in self.params.tgt_lang]))
+
+    def save_best(self, to_log, metric, mapping=None):
         """
         Save the best model for the given validation metric.
+        With a per-language metric (see `get_valid_metric`), the best mapping
+        of each target language is selected and saved independently.
+        `mapping` is the (snapshot of the) mapping `to_log` was computed with,
+        it defaults to the current mapping.
         """
-        # best mapping for the given validation criterion
-        if to_log[metric] > self.best_valid_metric:
+        mapping = self.mapping if mapping is None else mapping
+        if '{}' in metric:
+            langs = []
+            for lang in self.params.tgt_lang:
+                lang_metric = metric.format(lang)
+                if to_log[lang_metric] > self.best_valid_metrics.get(lang, -1e12):
+                    self.best_valid_metrics[lang] = to_log[lang_metric]
+                    logger.info('* Best value for "%s": %.5f' % (lang_metric, to_log[lang_metric]))
+                    langs.append(lang)
+            self.best_valid_metric = max(self.best_valid_metric, self.get_valid_metric(to_log, metric))
+        elif to_log[metric] > self.best_valid_metric:
             # new best mapping
             self.best_valid_metric = to_log[metric]
             logger.info('* Best value for "%s": %.5f' % (metric, to_log[metric]))
-            # save the mapping
-            W = {lang: self.mapping[lang].weight.data.cpu().numpy() for lang in [self.params.src_lang] + self.params.tgt_lang}
-            path = {lang: os.path.join(self.params.exp_path, 'best_mapping.{}.pth'.format(lang)) for lang in [self.params.src_lang] + self.params.tgt_lang}
-            for lang in [self.params.src_lang]+ self.params.tgt_lang:
-                logger.info('* Saving the mapping to %s ...' % path[lang])
-                torch.save(W[lang], path[lang])
+            langs = self.params.tgt_lang
+        else:
+            langs = []
+        # data-parallel workers only keep track of the best metric
+        if len(langs) == 0 or not is_master(self.params):
+            return
+        # save the mapping
+        langs = [self.params.src_lang] + langs
+        W = {lang: mapping[lang].weight.data.cpu().numpy().copy() for lang in langs}
+        path = {lang: os.path.join(self.params.exp_path, 'best_mapping.{}.pth'.format(lang)) for lang in langs}
+        for lang in langs:
+            logger.info('* Saving the mapping to %s ...' % path[lang])
+            self.writer.save(W[lang], path[lang])
+
+    def save_checkpoint(self, n_iter, mapping=None, dico=None, **state):
+        """
+        Save the full training state after iteration `n_iter`, to resume from it.
+        `mapping` / `dico` default to the current ones. Additional `state`
+        (e.g. the training phase) is stored as is.
+        The checkpoint is written in the background, by the master only.
+        """
+        if not is_master(self.params):
+            return
+        mapping = self.mapping if mapping is None else mapping
+        dico = getattr(self, 'dico', None) if dico is None else dico
+        checkpoint = {
+            'n_iter': n_iter,
+            'mapping': {lang: mapping[lang].weight.data.cpu().clone() for lang in mapping},
+            'dico': None if dico is None else dico.cpu().clone(),
+            'best_valid_metric': float(self.best_valid_metric),
+            'best_valid_metrics': {lang: float(v) for lang, v in self.best_valid_metrics.items()},
+            'decrease_lr': self.decrease_lr,
+            'rng': get_rng_state(),
+        }
+        if hasattr(self, 'map_optimizer'):
+            checkpoint['map_optimizer'] = deepcopy(self.map_optimizer.state_dict())
+        if self.discriminator is not None:
+            checkpoint['discriminator'] = {lang: deepcopy(self.discriminator[lang].state_dict()) for lang in self.adv_langs}
+            checkpoint['dis_optimizer'] = {lang: deepcopy(self.dis_optimizer[lang].state_dict()) for lang in self.adv_langs}
+        checkpoint.update(state)
+        path = os.path.join(self.params.exp_path, CHECKPOINT_NAME)
+        logger.info('* Saving checkpoint of iteration %i to %s ...' % (n_iter, path))
+        self.writer.save(checkpoint, path)
+
+    def load_checkpoint(self):
+        """
+        Restore the training state from the experiment checkpoint.
+        Returns the checkpoint, for the iteration counter and additional state.
+        """
+        path = os.path.join(self.params.exp_path, CHECKPOINT_NAME)
+        assert os.path.isfile(path), path
+        logger.info('* Resuming from checkpoint %s ...' % path)
+        checkpoint = torch.load(path)
+        for lang, to_reload in checkpoint['mapping'].items():
+            W = self.mapping[lang].weight.data
+            assert to_reload.size() == W.size()
+            W.copy_(to_reload.type_as(W))
+        if checkpoint['dico'] is not None:
+            self.dico = checkpoint['dico'].cuda() if self.params.cuda else checkpoint['dico']
+        self.best_valid_metric = checkpoint['best_valid_metric']
+        self.best_valid_metrics = checkpoint['best_valid_metrics']
+        self.decrease_lr = checkpoint['decrease_lr']
+        if 'map_optimizer' in checkpoint:
+            self.map_optimizer.load_state_dict(checkpoint['map_optimizer'])
+        if 'discriminator' in checkpoint:
+            for lang in self.adv_langs:
+                self.discriminator[lang].load_state_dict(checkpoint['discriminator'][lang])
+                self.dis_optimizer[lang].load_state_dict(checkpoint['dis_optimizer'][lang])
+        set_rng_state(checkpoint['rng'])
+        logger.info('* Resumed after iteration %i (best validation metric: %.5f)'
+                    % (checkpoint['n_iter'], self.best_valid_metric))
+        return checkpoint
 
 
     def reload_best(self):
         """
         Reload the best mapping.
         """
-        path = {lang: os.path.join(self.params.exp_path, 'best_mapping.{}.pth'.format(lang)) for lang in self.params.tgt_lang+[self.params.src_lang]}
+        # wait for the mappings being written
+        self.writer.wait()
         # reload the model
         for lang in self.params.tgt_lang+[self.params.src_lang]:
-            to_reload = torch.from_numpy(torch.load(path[lang]))
+            to_reload = load_best_mapping(self.params.exp_path, lang)
             W = self.mapping[lang].weight.data
-            logger.info('* Reloading the best model from %s ...' % path[lang])
             assert to_reload.size() == W.size()
             W.copy_(to_reload.type_as(W))
 
@@ -288,8 +488,9 @@ class Trainer(object):
         # load all embeddings
         logger.info("Reloading all embeddings for mapping ...")
 
-        src_emb = self.mapping[self.params.src_lang](self.src_emb.weight).data
-        tgt_emb = {lang: self.mapping[lang](self.tgt_emb[lang].weight).data for lang in self.params.tgt_lang}
+        src_emb = map_embeddings(self.mapping[self.params.src_lang], self.src_emb)
+        tgt_emb = {lang: map_embeddings(self.mapping[lang], self.tgt_emb[lang]) for lang in self.params.tgt_lang}
         src_emb = src_emb / src_emb.norm(2, 1, keepdim=True).expand_as(src_emb)
         tgt_emb = {lang: tgt_emb[lang] / tgt_emb[lang].norm(2, 1, keepdim=True).expand_as(tgt_emb[lang]) for lang in self.params.tgt_lang}
-        export_embeddings(src_emb.cpu().numpy(), {lang: tgt_emb[lang].cpu().numpy() for lang in self.params.tgt_lang}, self.params)
+        mapping = {lang: self.mapping[lang].weight.data.cpu().numpy() for lang in self.mapping}
+        export_embeddings(src_emb.cpu().numpy(), {lang: tgt_emb[lang].cpu().numpy() for lang in self.params.tgt_lang}, self.params, mapping)
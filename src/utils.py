@@ -8,6 +8,9 @@
 import os
 import io
 import re
+import mmap
+import struct
+import itertools
 import sys
 import pickle
 import random
@@ -21,12 +24,17 @@ from logging import getLogger
 
 from .logger import create_logger
 from .dictionary import Dictionary
+from .bundle import Bundle, write_bundle
+from .streams import open_text
+from .distributed import is_master, broadcast_object
 
 
 MAIN_DUMP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'dumped')
 
 logger = getLogger()
 
+FASTTEXT_MAGIC = 793712314
+
 
 # load Faiss if available (dramatically accelerates the nearest neighbor search)
 try:
@@ -55,19 +63,86 @@ def initialize_exp(params):
         if params.cuda:
             torch.cuda.manual_seed(params.seed)
 
-    # dump parameters
-    params.exp_path = get_exp_path(params)
-    with io.open(os.path.join(params.exp_path, 'params.pkl'), 'wb') as f:
-        pickle.dump(params, f)
-
-    # create logger
-    logger = create_logger(os.path.join(params.exp_path, 'train.log'), vb=params.verbose)
+    # dump parameters (a resumed experiment is stored in its original folder,
+    # data-parallel workers share the folder of the master)
+    if getattr(params, 'resume', ''):
+        assert os.path.isdir(params.resume), params.resume
+        params.exp_path = params.resume
+    elif is_master(params):
+        params.exp_path = get_exp_path(params)
+    if getattr(params, 'distributed', False):
+        params.exp_path = broadcast_object(params.exp_path)
+    if is_master(params):
+        with io.open(os.path.join(params.exp_path, 'params.pkl'), 'wb') as f:
+            pickle.dump(params, f)
+
+    # create logger (workers only log warnings to the console)
+    if is_master(params):
+        logger = create_logger(os.path.join(params.exp_path, 'train.log'), vb=params.verbose)
+    else:
+        logger = create_logger(os.path.join(params.exp_path, 'train.%i.log' % params.rank), vb=0)
     logger.info('============ Initialized logger ============')
     logger.info('\n'.join('%s: %s' % (k, str(v)) for k, v in sorted(dict(vars(params)).items())))
     logger.info('The experiment will be stored in %s' % params.exp_path)
     return logger
 
 
+def get_rng_state():
+    """
+    Get the state of all random number generators.
+    Only tensors and Python builtins are used, so that it can be saved with `torch.save`.
+    """
+    np_state = np.random.get_state()
+    state = {
+        'random': random.getstate(),
+        'numpy': (np_state[0], torch.from_numpy(np_state[1].astype(np.int64))) + tuple(np_state[2:]),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    Restore the state of all random number generators.
+    """
+    random.setstate(state['random'])
+    np_state = state['numpy']
+    np.random.set_state((np_state[0], np_state[1].numpy().astype(np.uint32)) + tuple(np_state[2:]))
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def is_fasttext_model(path):
+    """
+    Whether a binary file is a fastText model (or a word2vec binary file).
+    """
+    with io.open(path, 'rb') as f:
+        magic = f.read(4)
+    return len(magic) == 4 and struct.unpack('<i', magic)[0] == FASTTEXT_MAGIC
+
+
+def get_input_matrix(model):
+    """
+    Input matrix of a fastText model (words and character n-grams), without
+    copying it when the bindings expose its buffer.
+    """
+    if hasattr(model, 'f') and hasattr(model.f, 'getInputMatrix'):
+        return np.asarray(model.f.getInputMatrix())
+    return model.get_input_matrix()
+
+
+def has_subwords(model):
+    """
+    Whether the word vectors of a fastText model use character n-grams.
+    """
+    if hasattr(model, 'f') and hasattr(model.f, 'getArgs'):
+        return model.f.getArgs().maxn > 0
+    return True
+
+
 def load_fasttext_model(path):
     """
     Load a binarized fastText model.
@@ -131,10 +206,10 @@ def get_idf(europarl, src_lg, tgt_lg, n_idf):
     return idf
 
 
-def get_nn_avg_dist(emb, query, knn):
+def get_nn_avg_dist(emb, query, knn, bs=1024):
     """
     Compute the average distance of the `knn` nearest neighbors
-    for a given set of embeddings and queries.
+    for a given set of embeddings and queries (by blocks of `bs` queries).
     Use Faiss if available.
     """
     if FAISS_AVAILABLE:
@@ -153,7 +228,6 @@ def get_nn_avg_dist(emb, query, knn):
         distances, _ = index.search(query, knn)
         return distances.mean(1)
     else:
-        bs = 1024
         all_distances = []
         emb = emb.transpose(0, 1).contiguous()
         for i in range(0, query.shape[0], bs):
@@ -215,7 +289,8 @@ def get_optimizer(s):
         raise Exception('Unknown optimization method: "%s"' % method)
 
     # check that we give good parameters to the optimizer
-    expected_args = inspect.getargspec(optim_fn.__init__)[0]
+    spec = inspect.getfullargspec(optim_fn.__init__)
+    expected_args = spec.args + spec.kwonlyargs
     assert expected_args[:2] == ['self', 'params']
     if not all(k in expected_args[2:] for k in optim_params.keys()):
         raise Exception('Unexpected parameters: expected "%s", got "%s"' % (
@@ -263,58 +338,162 @@ def clip_parameters(model, clip):
 
 def read_txt_embeddings(params, emb_path, lang, full_vocab):
     """
-    Reload pretrained embeddings from a text file.
+    Reload pretrained embeddings from a text file, with a header line
+    (fastText / word2vec .vec files) or without (GloVe files).
+    The file can be compressed (.gz / .xz / .zst), it is then decompressed
+    while it is parsed, and only until `params.max_vocab` words are read.
+    """
+    with open_text(emb_path) as f:
+        return parse_txt_embeddings(f, params, lang, full_vocab)
+
+
+def parse_txt_embeddings(f, params, lang, full_vocab, bs=4096):
+    """
+    Parse pretrained embeddings from an iterator over text lines.
+    Lines are parsed by blocks of `bs`, with a single `np.fromstring` call.
     """
     word2id = {}
     vectors = []
-
-    # load pretrained embeddings
     source = lang == params.src_lang
-    lang = lang
-    emb_path = emb_path
     _emb_dim_file = params.emb_dim
-    with io.open(emb_path, 'r', encoding='utf-8', newline='\n', errors='ignore') as f:
-        for i, line in enumerate(f):
-            if i == 0:
-                split = line.split()
-                assert len(split) == 2
-                assert _emb_dim_file == int(split[1])
+
+    # header (missing in GloVe files)
+    first_line = next(iter(f), '')
+    split = first_line.split()
+    if len(split) == 2:
+        assert _emb_dim_file == int(split[1])
+        lines, i = f, 1
+    else:
+        logger.info("No header found, reading a GloVe file.")
+        lines, i = itertools.chain([first_line], f), 0
+
+    done = False
+    for block in iter_blocks(lines, bs):
+        block = [line.rstrip().split(' ', 1) for line in block]
+        block_vectors = np.fromstring(' '.join(line[1] if len(line) == 2 else '' for line in block), sep=' ')
+        # the values are only split into lines if each line has the right number of values
+        valid = all(len(line) == 2 and line[1].count(' ') + 1 == _emb_dim_file for line in block)
+        if valid and block_vectors.size == len(block) * _emb_dim_file:
+            block_vectors = block_vectors.reshape(len(block), _emb_dim_file)
+        else:
+            # some lines have an invalid dimension, parse them one by one
+            block_vectors = [np.fromstring(line[1] if len(line) == 2 else '', sep=' ') for line in block]
+        selected = []
+        for j, line in enumerate(block):
+            word = line[0] if full_vocab else line[0].lower()
+            if word in word2id:
+                if full_vocab:
+                    logger.warning("Word '%s' found twice in %s embedding file"
+                                   % (word, 'source' if source else 'target'))
+            elif block_vectors[j].shape != (_emb_dim_file,):
+                logger.warning("Invalid dimension (%i) for %s word '%s' in line %i."
+                               % (block_vectors[j].shape[0], 'source' if source else 'target', word, i + j))
             else:
-                word, vect = line.rstrip().split(' ', 1)
-                if not full_vocab:
-                    word = word.lower()
-                vect = np.fromstring(vect, sep=' ')
-                if np.linalg.norm(vect) == 0:  # avoid to have null embeddings
-                    vect[0] = 0.01
-                if word in word2id:
-                    if full_vocab:
-                        logger.warning("Word '%s' found twice in %s embedding file"
-                                       % (word, 'source' if source else 'target'))
-                else:
-                    if not vect.shape == (_emb_dim_file,):
-                        logger.warning("Invalid dimension (%i) for %s word '%s' in line %i."
-                                       % (vect.shape[0], 'source' if source else 'target', word, i))
-                        continue
-                    assert vect.shape == (_emb_dim_file,), i
-                    word2id[word] = len(word2id)
-                    vectors.append(vect[None])
+                word2id[word] = len(word2id)
+                selected.append(j)
             if params.max_vocab > 0 and len(word2id) >= params.max_vocab and not full_vocab:
+                done = True
                 break
+        if len(selected) > 0:
+            vectors.append(np.stack([block_vectors[j] for j in selected]).astype(np.float32))
+        i += len(block)
+        if done:
+            break
 
-    assert len(word2id) == len(vectors)
-    logger.info("Loaded %i pre-trained word embeddings." % len(vectors))
+    assert len(word2id) == sum(len(v) for v in vectors)
+    logger.info("Loaded %i pre-trained word embeddings." % len(word2id))
 
     # compute new vocabulary / embeddings
-    id2word = {v: k for k, v in word2id.items()}
-    dico = Dictionary(id2word, word2id, lang)
+    dico = Dictionary.from_words(list(word2id.keys()), lang)
     embeddings = np.concatenate(vectors, 0)
-    embeddings = torch.from_numpy(embeddings).float()
+    fix_null_embeddings(embeddings)
+    embeddings = torch.from_numpy(embeddings)
+    embeddings = embeddings.cuda() if (params.cuda and not full_vocab) else embeddings
+
+    assert embeddings.size() == (len(dico), params.emb_dim)
+    return dico, embeddings
+
+
+def read_w2v_embeddings(params, emb_path, lang, full_vocab, bs=1024):
+    """
+    Reload pretrained embeddings from a word2vec binary file.
+    The file is memory-mapped, the words are scanned sequentially and the
+    vectors of the selected words are gathered by blocks of `bs`.
+    """
+    with io.open(emb_path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # header
+        header_end = buf.find(b'\n')
+        n_words, _emb_dim_file = [int(x) for x in buf[:header_end].split()]
+        assert _emb_dim_file == params.emb_dim
+        n_bytes = 4 * _emb_dim_file
+
+        # scan the words (vectors are preceded by a space, and may be followed by a newline)
+        word2id = {}
+        offsets = []
+        pos = header_end + 1
+        for i in range(n_words):
+            while buf[pos:pos + 1] in (b'\n', b' '):
+                pos += 1
+            end = buf.find(b' ', pos)
+            assert end >= 0 and end + 1 + n_bytes <= len(buf), "Truncated word2vec file: %s" % emb_path
+            word = buf[pos:end].decode('utf-8', errors='ignore')
+            if not full_vocab:
+                word = word.lower()
+            if word in word2id:
+                if full_vocab:
+                    logger.warning("Word '%s' found twice in %s embedding file"
+                                   % (word, 'source' if lang == params.src_lang else 'target'))
+            else:
+                word2id[word] = len(word2id)
+                offsets.append(end + 1)
+            pos = end + 1 + n_bytes
+            if params.max_vocab > 0 and len(word2id) >= params.max_vocab and not full_vocab:
+                break
+
+        # gather the vectors
+        data = np.frombuffer(buf, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        embeddings = np.empty((len(offsets), _emb_dim_file), dtype=np.float32)
+        for i in range(0, len(offsets), bs):
+            index = offsets[i:i + bs, None] + np.arange(n_bytes)
+            embeddings[i:i + bs] = data[index].view('<f4')
+        del data
+    finally:
+        buf.close()
+    logger.info("Loaded %i pre-trained word embeddings." % len(word2id))
+
+    dico = Dictionary.from_words(list(word2id.keys()), lang)
+    fix_null_embeddings(embeddings)
+    embeddings = torch.from_numpy(embeddings)
     embeddings = embeddings.cuda() if (params.cuda and not full_vocab) else embeddings
 
     assert embeddings.size() == (len(dico), params.emb_dim)
     return dico, embeddings
 
 
+def fix_null_embeddings(embeddings):
+    """
+    Avoid to have null embeddings.
+    """
+    embeddings[np.linalg.norm(embeddings, axis=1) == 0, 0] = 0.01
+
+
+def iter_blocks(iterable, bs):
+    """
+    Group the elements of an iterable into lists of `bs` elements.
+    """
+    block = []
+    for x in iterable:
+        block.append(x)
+        if len(block) == bs:
+            yield block
+            block = []
+    if len(block) > 0:
+        yield block
+
+
 def select_subset(word_list, max_vocab):
     """
     Select a subset of words to consider, to deal with words having embeddings
@@ -350,17 +529,19 @@ def load_pth_embeddings(params, emb_path, lang, full_vocab):
     # select a subset of word embeddings (to deal with casing)
     if not full_vocab:
         word2id, indexes = select_subset([dico[i] for i in range(len(dico))], params.max_vocab)
-        id2word = {v: k for k, v in word2id.items()}
-        dico = Dictionary(id2word, word2id, lang)
+        dico = Dictionary.from_words(list(word2id.keys()), lang)
         embeddings = embeddings[indexes]
 
     assert embeddings.size() == (len(dico), params.emb_dim)
     return dico, embeddings
 
 
-def load_bin_embeddings(params, emb_path, lang, full_vocab):
+def load_bin_embeddings(params, emb_path, lang, full_vocab, bs=4096):
     """
     Reload pretrained embeddings from a fastText binary file.
+    Only the selected words are generated, by blocks of `bs` words: a word
+    vector is the average of the input matrix rows of the word and of its
+    character n-grams (the word row itself if the model has no n-grams).
     """
     # reload fastText binary file
     lang = lang
@@ -368,18 +549,63 @@ def load_bin_embeddings(params, emb_path, lang, full_vocab):
     words = model.get_labels()
     assert model.get_dimension() == params.emb_dim
     logger.info("Loaded binary model. Generating embeddings ...")
-    embeddings = torch.from_numpy(np.concatenate([model.get_word_vector(w)[None] for w in words], 0))
-    logger.info("Generated embeddings for %i words." % len(words))
-    assert embeddings.size() == (len(words), params.emb_dim)
 
     # select a subset of word embeddings (to deal with casing)
     if not full_vocab:
         word2id, indexes = select_subset(words, params.max_vocab)
-        embeddings = embeddings[indexes]
+        indexes = indexes.numpy()
     else:
         word2id = {w: i for i, w in enumerate(words)}
-    id2word = {i: w for w, i in word2id.items()}
-    dico = Dictionary(id2word, word2id, lang)
+        indexes = np.arange(len(words))
+
+    # compose the word vectors from the input matrix (the rows of each word
+    # are added in order, as in fastText, so that the vectors are identical)
+    input_matrix = get_input_matrix(model)
+    embeddings = np.empty((len(indexes), params.emb_dim), dtype=np.float32)
+    if not has_subwords(model):
+        embeddings[:] = input_matrix[indexes]
+    else:
+        for i in range(0, len(indexes), bs):
+            subwords = [model.get_subwords(words[j])[1] for j in indexes[i:i + bs]]
+            lengths = np.array([len(x) for x in subwords])
+            starts = np.cumsum(lengths) - lengths
+            subwords = np.concatenate(subwords)
+            block = np.zeros((len(lengths), params.emb_dim), dtype=np.float32)
+            for k in range(lengths.max()):
+                mask = lengths > k
+                block[mask] += input_matrix[subwords[starts[mask] + k]]
+            block *= (1.0 / lengths[:, None]).astype(np.float32)
+            embeddings[i:i + bs] = block
+    del input_matrix
+    embeddings = torch.from_numpy(embeddings)
+    logger.info("Generated embeddings for %i words." % len(indexes))
+
+    dico = Dictionary.from_words(list(word2id.keys()), lang)
+
+    assert embeddings.size() == (len(dico), params.emb_dim)
+    return dico, embeddings
+
+
+def load_bundle_embeddings(params, emb_path, lang, full_vocab):
+    """
+    Reload aligned embeddings from a bundle (see `src.bundle`). The embeddings
+    are memory-mapped: float32 embeddings are not copied (pages are only
+    copied if they are modified, e.g. normalized), float16 embeddings are
+    upcast unless they are stored in float16 (`params.emb_dtype`).
+    The vocabulary of a bundle is already selected, it is only truncated to
+    `params.max_vocab` words.
+    """
+    bundle = Bundle(emb_path)
+    if lang not in bundle.langs:
+        raise Exception('Language "%s" not found in %s (%s)' % (lang, emb_path, ', '.join(bundle.langs)))
+    assert bundle.dim == params.emb_dim
+    n_words = params.max_vocab if params.max_vocab > 0 and not full_vocab else None
+    dico = bundle.get_dictionary(lang, n_words)
+    embeddings = torch.from_numpy(bundle.get_embeddings(lang, n_words))
+    if bundle.dtype != 'float32' and getattr(params, 'emb_dtype', 'float32') != bundle.dtype:
+        embeddings = embeddings.float()
+    logger.info("Loaded %i aligned word embeddings from the bundle." % len(dico))
+    embeddings = embeddings.cuda() if (params.cuda and not full_vocab) else embeddings
 
     assert embeddings.size() == (len(dico), params.emb_dim)
     return dico, embeddings
@@ -399,10 +625,14 @@ def load_embeddings(lang, emb_path, params, full_vocab=False):
     """
     assert type(full_vocab) is bool
     logger.info('Loading embeddings for language {}'.format(lang))
+    if emb_path.endswith('.bundle'):
+        return load_bundle_embeddings(params, emb_path, lang, full_vocab)
     if emb_path.endswith('.pth'):
         return load_pth_embeddings(params, emb_path, lang, full_vocab)
     if emb_path.endswith('.bin'):
-        return load_bin_embeddings(params, emb_path, lang, full_vocab)
+        if is_fasttext_model(emb_path):
+            return load_bin_embeddings(params, emb_path, lang, full_vocab)
+        return read_w2v_embeddings(params, emb_path, lang, full_vocab)
     else:
         return read_txt_embeddings(params, emb_path, lang, full_vocab)
 
@@ -424,9 +654,37 @@ def normalize_embeddings(emb, types, mean=None):
             raise Exception('Unknown normalization type: "%s"' % t)
     return mean.cpu() if mean is not None else None
 
-def export_embeddings(src_emb, tgt_emb, params):
+
+def map_embeddings(mapping, emb, bs=8192):
     """
-    Export embeddings to a text file.
+    Apply a mapping to all the embeddings of an embedding table, without autograd.
+    Reduced-precision tables are upcast to float32 block by block.
+    """
+    weight = emb.weight.data
+    with torch.no_grad():
+        if weight.dtype == torch.float32:
+            return mapping(weight)
+        mapped = torch.empty(weight.size(), dtype=torch.float32, device=weight.device)
+        for i in range(0, weight.size(0), bs):
+            mapped[i:i + bs] = mapping(weight[i:i + bs].float())
+        return mapped
+
+
+def load_best_mapping(exp_path, lang):
+    """
+    Reload the best mapping of a language, as saved by `Trainer.save_best`.
+    The mappings are pickled numpy arrays, written by the experiments
+    themselves, so they are not loaded with the default `weights_only`.
+    """
+    path = os.path.join(exp_path, 'best_mapping.%s.pth' % lang)
+    logger.info('* Reloading the mapping from %s ...' % path)
+    return torch.from_numpy(torch.load(path, weights_only=False))
+
+
+def export_embeddings(src_emb, tgt_emb, params, mapping=None):
+    """
+    Export embeddings to a text file, a PyTorch binary file per language,
+    or a single bundle with all the languages (and their `mapping` matrices).
     """
     if params.export == "txt":
         src_id2word = params.src_dico.id2word
@@ -458,3 +716,19 @@ def export_embeddings(src_emb, tgt_emb, params):
         for lang in params.tgt_lang:
             logger.info('Writing target embeddings to %s ...' % tgt_path[lang])
             torch.save({'dico': params.tgt_dico[lang], 'vectors': tgt_emb[lang]}, tgt_path[lang])
+
+    if params.export == "bundle":
+        path = os.path.join(params.exp_path, 'vectors.bundle')
+        langs = [params.src_lang] + params.tgt_lang
+        embeddings = dict([(params.src_lang, src_emb)] + [(lang, tgt_emb[lang]) for lang in params.tgt_lang])
+        dicos = dict([(params.src_lang, params.src_dico)] + [(lang, params.tgt_dico[lang]) for lang in params.tgt_lang])
+        metadata = {
+            'src_lang': params.src_lang,
+            'tgt_lang': params.tgt_lang,
+            'emb_dim': params.emb_dim,
+            'exp_path': params.exp_path,
+            'normalize_embeddings': params.normalize_embeddings,
+            'args': {k: v for k, v in vars(params).items() if isinstance(v, (str, int, float, bool))},
+        }
+        logger.info('Writing the embeddings of %s to %s ...' % (', '.join(langs), path))
+        write_bundle(path, embeddings, dicos, mapping, metadata, getattr(params, 'export_dtype', 'float32'))
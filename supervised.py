@@ -6,15 +6,16 @@
 #
 
 import os
-import json
 import argparse
-from collections import OrderedDict
 import torch
 
 from src.utils import bool_flag, initialize_exp
 from src.models import build_model
 from src.trainer import Trainer
-from src.evaluation import Evaluator
+from src.evaluation import Evaluator, PipelinedEvaluator
+from src.refinement import procrustes_refinement
+from src.instrument import log_stage_summary
+from src.profiler import PROFILERS, init_profiler
 
 
 #VALIDATION_METRIC = 'precision_at_1-nn'
@@ -30,7 +31,9 @@ parser.add_argument("--exp_path", type=str, default="", help="Where to store exp
 parser.add_argument("--exp_name", type=str, default="debug", help="Experiment name")
 parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
 parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
-parser.add_argument("--export", type=str, default="", help="Export embeddings after training (txt / pth)")
+parser.add_argument("--export", type=str, default="", help="Export embeddings after training (txt / pth / bundle)")
+parser.add_argument("--export_dtype", type=str, default="float32", help="Precision of the exported bundle (float32 / float16)")
+parser.add_argument("--resume", type=str, default="", help="Resume the experiment stored in this folder from its last checkpoint")
 
 # data
 parser.add_argument("--src_lang", type=str, default='en', help="Source language")
@@ -42,20 +45,32 @@ parser.add_argument("--map_id_init", type=bool_flag, default=True, help="Initial
 # training refinement
 parser.add_argument("--n_refinement", type=int, default=5, help="Number of refinement iterations (0 to disable the refinement procedure)")
 parser.add_argument("--generalized", type=bool_flag, default=False, help="Use GPA")
+parser.add_argument("--pipeline_eval", type=bool_flag, default=False, help="Evaluate each iteration in the background, while the next one is trained")
 parser.add_argument("--fine_tuning", type=int, default=0, help="Number of fine-tuning iterations (0 to disable); subtracted from n_refinement")
 # dictionary creation parameters (for refinement)
 parser.add_argument("--dico_train", type=str, default="default", help="Path to training dictionary (default: use identical character strings)")
 parser.add_argument("--dico_eval", type=str, default="default", help="Path to evaluation dictionary")
+parser.add_argument("--dico_path", type=str, default="", help="Folder of the default train / evaluation dictionaries (default: $MUSE_DIC_EVAL_PATH, or data/crosslingual/dictionaries)")
 parser.add_argument("--dico_method", type=str, default='csls_knn_10', help="Method used for dictionary generation (nn/invsm_beta_30/csls_knn_10)")
 parser.add_argument("--dico_build", type=str, default='S2T&T2S', help="S2T,T2S,S2T|T2S,S2T&T2S")
 parser.add_argument("--dico_threshold", type=float, default=0, help="Threshold confidence for dictionary generation")
 parser.add_argument("--dico_max_rank", type=int, default=10000, help="Maximum dictionary words rank (0 to disable)")
+parser.add_argument("--dico_prefilter", type=str, default="", help="Restrict the source and target words to the dico_max_rank most frequent ones before scoring them, with the CSLS / inverted softmax terms computed over the full vocabularies (full) or the restricted ones (window) (empty to disable)")
 parser.add_argument("--dico_min_size", type=int, default=0, help="Minimum generated dictionary size (0 to disable)")
 parser.add_argument("--dico_max_size", type=int, default=0, help="Maximum generated dictionary size (0 to disable)")
+parser.add_argument("--dico_workers", type=int, default=0, help="Number of concurrent workers building the per-language dictionaries (0: one per language)")
 # reload pre-trained embeddings
 parser.add_argument("--src_emb", type=str, default='', help="Reload source embeddings")
 parser.add_argument("--tgt_emb", type=str, default='', help="Reload target embeddings")
 parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")#renorm, center to be as Artetxe
+parser.add_argument("--emb_dtype", type=str, default="float32", help="Storage precision of the embeddings (float32 / float16 / bfloat16). Reduced precision embeddings are frozen")
+parser.add_argument("--shared_embeddings", type=bool_flag, default=False, help="Share the loaded embeddings with the other jobs of the host (memory-mapped, read-only)")
+parser.add_argument("--shared_dir", type=str, default="", help="Directory of the shared embeddings (default: /dev/shm)")
+# profiling
+parser.add_argument("--profile", type=str, default="", help="Stages to profile, comma-separated (e.g. \"iteration\", \"build_dictionary/candidates\", \"eval.word_translation\": see the stages of the log)")
+parser.add_argument("--profile_iters", type=str, default="", help="Iterations to profile, comma-separated (default: all)")
+parser.add_argument("--profiler", type=str, default="cprofile", help="Profilers (cprofile / torch / cprofile,torch)")
+parser.add_argument("--profile_top", type=int, default=20, help="Number of hot functions of the profile summaries")
 
 
 # parse parameters
@@ -67,61 +82,53 @@ params.tgt_emb = params.tgt_emb.strip().split(' ')
 assert not params.cuda or torch.cuda.is_available()
 assert params.dico_train in ["identical_char", "default","identical_num"] or os.path.isfile(params.dico_train)
 assert params.dico_build in ["S2T", "T2S", "S2T|T2S", "S2T&T2S"]
+assert params.dico_prefilter in ["", "full", "window"]
 assert params.dico_max_size == 0 or params.dico_max_size < params.dico_max_rank
 assert params.dico_max_size == 0 or params.dico_max_size > params.dico_min_size
 assert os.path.isfile(params.src_emb)
 assert all(os.path.isfile(emb) for emb in params.tgt_emb)
 assert params.dico_eval == 'default' or os.path.isfile(params.dico_eval)
-assert params.export in ["", "txt", "pth"]
+assert not params.dico_path or os.path.isdir(params.dico_path)
+assert params.emb_dtype in ["float32", "float16", "bfloat16"]
+assert not params.shared_embeddings or params.emb_dtype != "bfloat16", "shared embeddings are stored in float32 / float16"
+assert not params.shared_dir or os.path.isdir(params.shared_dir)
+assert params.export in ["", "txt", "pth", "bundle"]
+assert params.export_dtype in ["float32", "float16"]
 assert len(params.tgt_lang) == len(params.tgt_emb)
 assert len(params.tgt_lang) == 1 or params.generalized
 assert params.fine_tuning <= params.n_refinement
+assert not params.resume or os.path.isdir(params.resume)
+assert all(x in PROFILERS for x in params.profiler.split(','))
+assert all(x.isdigit() for x in params.profile_iters.split(',') if x)
+assert params.profile_top > 0
 
 # build logger / model / trainer / evaluator
 logger = initialize_exp(params)
+init_profiler(params)
 src_emb, tgt_emb, mapping, _ = build_model(params, False)
 trainer = Trainer(src_emb, tgt_emb, mapping, None, params)
 evaluator = Evaluator(trainer)
 
-#start generalized training with support
-support = True if params.generalized else False
 # load a training dictionary. if a dictionary path is not provided, use a default
 # one ("default") or create one based on identical character strings ("identical_char")
-trainer.load_training_dico(params.dico_train, support)
+# when resuming, the mapping and dictionary are restored from the checkpoint instead
+if params.resume:
+    start_iter = trainer.load_checkpoint()['n_iter'] + 1
+else:
+    start_iter = 0
+    trainer.load_training_dico(params.dico_train, params.generalized)
 
-"""
-Learning loop for Procrustes Iterative Learning
-"""
-for n_iter in range(params.n_refinement + 1):
+# evaluate iterations in the background
+pipeline = PipelinedEvaluator(trainer, VALIDATION_METRIC.format(params.tgt_lang[-1])) if params.pipeline_eval else None
 
-    if n_iter > params.n_refinement - params.fine_tuning:
-        support = False
-
-    logger.info('Starting iteration %i...' % n_iter)
-
-    # build a dictionary from aligned embeddings (unless
-    # it is the first iteration and we use the init one)
-    if n_iter > 0 or not hasattr(trainer, 'dico'):
-        trainer.build_dictionary(support)
-
-    # apply the Procrustes solution
-    if params.generalized:
-        trainer.generalized_procrustes(support,n_iter==0)
-    else:
-        trainer.simple_procrustes()
-
-    # embeddings evaluation
-    to_log = OrderedDict({'n_iter': n_iter})
-    biling_dict = True
-    evaluator.all_eval(to_log, biling_dict)
-
-    # JSON log / save best model / end of epoch
-    logger.info("__log__:%s" % json.dumps(to_log))
-    trainer.save_best(to_log, VALIDATION_METRIC.format(params.tgt_lang[-1]))
-    logger.info('End of iteration %i.\n\n' % n_iter)
+# learning loop for Procrustes iterative learning
+procrustes_refinement(trainer, evaluator, VALIDATION_METRIC.format(params.tgt_lang[-1]), start_iter, pipeline)
 
 
 # export embeddings
 if params.export:
     trainer.reload_best()
     trainer.export()
+
+# time / memory of each stage of the run
+log_stage_summary()
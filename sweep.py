@@ -0,0 +1,102 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python sweep.py --src_lang en --tgt_lang es --src_emb data/wiki.en.vec --tgt_emb data/wiki.es.vec --grid '{"dico_method": ["nn", "csls_knn_10"], "n_refinement": [1, 5]}'
+
+import os
+import argparse
+import torch
+
+from src.utils import bool_flag, initialize_exp
+from src.models import build_model
+from src.sweep import SWEEP_PARAMS, get_configs, share_data, run_sweep, write_results
+
+
+#VALIDATION_METRIC = 'precision_at_1-nn'
+#VALIDATION_METRIC = 'precision_at_1-csls_knn_10_{}'
+VALIDATION_METRIC = 'mean_cosine-csls_knn_10-S2T-10000_{}'
+#   default criterion in the MUSE code: 'precision_at_1-csls_knn_10'
+
+# main
+parser = argparse.ArgumentParser(description='Sweep of supervised training configurations')
+parser.add_argument("--seed", type=int, default=-1, help="Initialization seed")
+parser.add_argument("--verbose", type=int, default=2, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--exp_path", type=str, default="", help="Where to store experiment logs and models")
+parser.add_argument("--exp_name", type=str, default="debug", help="Experiment name")
+parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
+parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
+
+# sweep
+parser.add_argument("--grid", type=str, default="", help="Configurations (JSON, or JSON file): a list of configurations, or a dictionary of parameter values to combine (%s)" % ', '.join(SWEEP_PARAMS))
+parser.add_argument("--n_jobs", type=int, default=1, help="Number of configurations trained concurrently (in forked processes)")
+
+# data
+parser.add_argument("--src_lang", type=str, default='en', help="Source language")
+parser.add_argument("--tgt_lang", type=str, default='es', help="Target language")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--max_vocab", type=int, default=200000, help="Maximum vocabulary size (-1 to disable)")
+#mapping
+parser.add_argument("--map_id_init", type=bool_flag, default=True, help="Initialize the mapping as an identity matrix")
+# training refinement (defaults of the configurations)
+parser.add_argument("--n_refinement", type=int, default=5, help="Number of refinement iterations (0 to disable the refinement procedure)")
+parser.add_argument("--generalized", type=bool_flag, default=False, help="Use GPA")
+parser.add_argument("--fine_tuning", type=int, default=0, help="Number of fine-tuning iterations (0 to disable); subtracted from n_refinement")
+# dictionary creation parameters (defaults of the configurations)
+parser.add_argument("--dico_train", type=str, default="default", help="Path to training dictionary (default: use identical character strings)")
+parser.add_argument("--dico_eval", type=str, default="default", help="Path to evaluation dictionary")
+parser.add_argument("--dico_path", type=str, default="", help="Folder of the default train / evaluation dictionaries (default: $MUSE_DIC_EVAL_PATH, or data/crosslingual/dictionaries)")
+parser.add_argument("--dico_method", type=str, default='csls_knn_10', help="Method used for dictionary generation (nn/invsm_beta_30/csls_knn_10)")
+parser.add_argument("--dico_build", type=str, default='S2T&T2S', help="S2T,T2S,S2T|T2S,S2T&T2S")
+parser.add_argument("--dico_threshold", type=float, default=0, help="Threshold confidence for dictionary generation")
+parser.add_argument("--dico_max_rank", type=int, default=10000, help="Maximum dictionary words rank (0 to disable)")
+parser.add_argument("--dico_prefilter", type=str, default="", help="Restrict the source and target words to the dico_max_rank most frequent ones before scoring them, with the CSLS / inverted softmax terms computed over the full vocabularies (full) or the restricted ones (window) (empty to disable)")
+parser.add_argument("--dico_min_size", type=int, default=0, help="Minimum generated dictionary size (0 to disable)")
+parser.add_argument("--dico_max_size", type=int, default=0, help="Maximum generated dictionary size (0 to disable)")
+parser.add_argument("--dico_workers", type=int, default=0, help="Number of concurrent workers building the per-language dictionaries (0: one per language)")
+# reload pre-trained embeddings
+parser.add_argument("--src_emb", type=str, default='', help="Reload source embeddings")
+parser.add_argument("--tgt_emb", type=str, default='', help="Reload target embeddings")
+parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--emb_dtype", type=str, default="float32", help="Storage precision of the embeddings (float32 / float16 / bfloat16). Reduced precision embeddings are frozen")
+parser.add_argument("--shared_embeddings", type=bool_flag, default=False, help="Share the loaded embeddings with the other jobs of the host (memory-mapped, read-only)")
+parser.add_argument("--shared_dir", type=str, default="", help="Directory of the shared embeddings (default: /dev/shm)")
+
+
+# parse parameters
+params = parser.parse_args()
+params.tgt_lang = params.tgt_lang.strip().split(' ')
+params.tgt_emb = params.tgt_emb.strip().split(' ')
+
+# check parameters
+assert not params.cuda or torch.cuda.is_available()
+assert not params.cuda or params.n_jobs == 1, "CUDA configurations cannot run in forked processes"
+assert params.grid, "no configuration to sweep"
+assert params.n_jobs >= 1
+assert os.path.isfile(params.src_emb)
+assert all(os.path.isfile(emb) for emb in params.tgt_emb)
+assert params.dico_eval == 'default' or os.path.isfile(params.dico_eval)
+assert not params.dico_path or os.path.isdir(params.dico_path)
+assert params.emb_dtype in ["float32", "float16", "bfloat16"]
+assert not params.shared_embeddings or params.emb_dtype != "bfloat16", "shared embeddings are stored in float32 / float16"
+assert not params.shared_dir or os.path.isdir(params.shared_dir)
+assert len(params.tgt_lang) == len(params.tgt_emb)
+configs = get_configs(params.grid)
+
+# the workers are forked, so the parent does not start the intra-op thread pool
+# before they are (each worker then sets its own number of threads)
+if params.n_jobs > 1:
+    torch.set_num_threads(1)
+
+# build logger / model, and load the training dictionaries once for all the configurations
+logger = initialize_exp(params)
+src_emb, tgt_emb, mapping, _ = build_model(params, False)
+share_data(src_emb, tgt_emb, mapping, configs, params)
+
+# train and evaluate each configuration in its own folder
+logger.info('Running %i configurations (%i concurrent jobs) ...' % (len(configs), params.n_jobs))
+rows = run_sweep(configs, VALIDATION_METRIC.format(params.tgt_lang[-1]), params.n_jobs)
+write_results(rows, os.path.join(params.exp_path, 'results.tsv'))
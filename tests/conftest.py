@@ -0,0 +1,36 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import sys
+import subprocess
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def run_script():
+    """
+    Run a script of the repository, in a separate process.
+    """
+    def run(args):
+        return subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True, timeout=900)
+    return run
+
+
+@pytest.fixture(scope='session')
+def synthetic_dir(tmp_path_factory, run_script):
+    """
+    Small synthetic en / es / it embeddings, with their dictionaries in dictionaries/.
+    """
+    path = str(tmp_path_factory.mktemp('synthetic'))
+    proc = run_script(['generate.py', '--output_dir', path, '--langs', 'en es it',
+                       '--n_words', '3000', '--emb_dim', '20', '--verbose', '0'])
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    return path
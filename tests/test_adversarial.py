@@ -0,0 +1,28 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+import os
+
+
+def test_multi_target_adversarial_epoch(synthetic_dir, run_script, tmp_path):
+    proc = run_script([
+        'unsupervised.py', '--cuda', 'False', '--exp_path', str(tmp_path), '--exp_id', 'adv',
+        '--src_lang', 'en', '--tgt_lang', 'es it', '--src_emb', os.path.join(synthetic_dir, 'en.vec'),
+        '--tgt_emb', '%s %s' % (os.path.join(synthetic_dir, 'es.vec'), os.path.join(synthetic_dir, 'it.vec')),
+        '--emb_dim', '20', '--dico_path', os.path.join(synthetic_dir, 'dictionaries'),
+        '--n_epochs', '1', '--epoch_size', '1000', '--dis_most_frequent', '2000', '--n_refinement', '0',
+    ])
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    exp_path = os.path.join(str(tmp_path), 'debug', 'adv')
+    with io.open(os.path.join(exp_path, 'train.log'), 'r', encoding='utf-8') as f:
+        log = f.read()
+    assert 'End of epoch 0.' in log
+    for lang in ['es', 'it']:
+        assert 'Discriminator source / target %s / global accuracy' % lang in log
+    for lang in ['en', 'es', 'it']:
+        assert os.path.isfile(os.path.join(exp_path, 'best_mapping.%s.pth' % lang))
@@ -0,0 +1,41 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+
+from src.dictionary import Dictionary
+from src.evaluation.word_translation import get_word_ids
+
+
+def test_index_batch_empty_dictionary():
+    dico = Dictionary.from_words([], 'en')
+    assert dico.index_batch(['a', 'b']).tolist() == [-1, -1]
+    assert dico.find('a') == -1
+
+
+def test_word2id_lookups():
+    dico = Dictionary.from_words(['the', 'of', 'été'], 'en')
+    word2id = dico.word2id
+    assert get_word_ids(['été', 'x', 'the'], word2id).tolist() == [2, -1, 0]
+    assert 'of' in word2id and 'x' not in word2id
+    assert word2id['été'] == 2 and word2id.get('x', -1) == -1
+    dico.prune(2)
+    assert 'été' not in word2id
+    assert list(word2id) == ['the', 'of']
+    assert np.array_equal(dico.index_batch(['été', 'of']), [-1, 1])
+
+
+def test_single_word_lookups_use_the_index():
+    words = ['w%i' % i for i in range(10000)]
+    dico = Dictionary.from_words(words, 'en')
+    n_attributes = len(vars(dico))
+    word2id = dico.word2id
+    assert dico.find('w123') == 123 and dico.find('x') == -1
+    assert 'w9999' in word2id and 'x' not in word2id
+    assert word2id.get('w7') == 7
+    assert list(word2id.keys()) == words
+    assert not hasattr(dico, 'lookup') and len(vars(dico)) == n_attributes
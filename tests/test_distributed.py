@@ -0,0 +1,91 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import socket
+import argparse
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from src.models import build_model
+from src.trainer import Trainer
+from src.distributed import init_distributed
+
+
+N_PROCS = 2
+
+
+def get_params(synthetic_dir, exp_path):
+    """
+    Parameters of unsupervised.py (with its defaults), for a small two-target run.
+    """
+    return argparse.Namespace(
+        src_lang='en', tgt_lang=['es', 'it'], src_emb=os.path.join(synthetic_dir, 'en.vec'),
+        tgt_emb=[os.path.join(synthetic_dir, 'es.vec'), os.path.join(synthetic_dir, 'it.vec')],
+        emb_dim=20, max_vocab=200000, normalize_embeddings='', cuda=False, exp_path=exp_path,
+        map_id_init=True, map_beta=0.001, dis_layers=2, dis_hid_dim=64, dis_dropout=0., dis_input_dropout=0.1,
+        dis_steps=5, dis_lambda=1, dis_most_frequent=2000, dis_smooth=0.1, dis_clip_weights=0,
+        epoch_size=320, batch_size=32, map_optimizer='sgd,lr=0.1', dis_optimizer='sgd,lr=0.1',
+        lr_decay=0.98, min_lr=1e-6, lr_shrink=0.5,
+    )
+
+
+def run_worker(rank, port, synthetic_dir, tmp_dir):
+    """
+    One adversarial epoch of a data-parallel worker. The workers are initialized with
+    different seeds. Their weights are written to `tmp_dir`, and their experiment
+    files to `tmp_dir/rank<rank>`.
+    """
+    os.environ.update({'RANK': str(rank), 'WORLD_SIZE': str(N_PROCS),
+                       'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port)})
+    torch.set_num_threads(1)
+    torch.manual_seed(rank)
+    exp_path = os.path.join(tmp_dir, 'rank%i' % rank)
+    os.mkdir(exp_path)
+    params = get_params(synthetic_dir, exp_path)
+    init_distributed(params)
+    src_emb, tgt_emb, mapping, discriminator = build_model(params, True)
+    trainer = Trainer(src_emb, tgt_emb, mapping, discriminator, params)
+
+    stats = {'DIS_COSTS': []}
+    for _ in range(0, params.epoch_size, params.batch_size):
+        for _ in range(params.dis_steps):
+            trainer.dis_step(stats)
+        trainer.mapping_step(stats)
+    trainer.save_best({'metric': 1.}, 'metric')
+    trainer.save_checkpoint(0, phase='adversarial')
+    trainer.writer.wait()
+
+    torch.save({
+        'mapping': {lang: m.weight.data for lang, m in mapping.items()},
+        'discriminator': {lang: d.state_dict() for lang, d in discriminator.items()},
+    }, os.path.join(tmp_dir, 'weights.%i.pth' % rank))
+    dist.destroy_process_group()
+
+
+def test_data_parallel_epoch(synthetic_dir, tmp_path):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    mp.spawn(run_worker, args=(port, synthetic_dir, str(tmp_path)), nprocs=N_PROCS)
+
+    # identical weights on all the workers
+    weights = [torch.load(os.path.join(str(tmp_path), 'weights.%i.pth' % rank)) for rank in range(N_PROCS)]
+    assert not torch.equal(weights[0]['mapping']['es'], torch.eye(20))
+    for w in weights[1:]:
+        for lang in ['en', 'es', 'it']:
+            assert torch.equal(w['mapping'][lang], weights[0]['mapping'][lang])
+        for lang in ['es', 'it']:
+            for k, v in w['discriminator'][lang].items():
+                assert torch.equal(v, weights[0]['discriminator'][lang][k]), (lang, k)
+
+    # only the master writes the best mappings / checkpoints
+    assert sorted(os.listdir(os.path.join(str(tmp_path), 'rank0'))) == [
+        'best_mapping.en.pth', 'best_mapping.es.pth', 'best_mapping.it.pth', 'checkpoint.pth']
+    for rank in range(1, N_PROCS):
+        assert os.listdir(os.path.join(str(tmp_path), 'rank%i' % rank)) == []
@@ -0,0 +1,18 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+
+from src.utils import parse_txt_embeddings
+
+
+def test_parse_txt_embeddings_invalid_dimensions():
+    params = argparse.Namespace(src_lang='en', emb_dim=3, max_vocab=-1, cuda=False)
+    lines = ['4 3\n', 'a 1 2 3 4\n', 'b 5 6\n', 'c 7 8 9\n', 'd 1 0 1\n']
+    dico, embeddings = parse_txt_embeddings(iter(lines), params, 'en', False)
+    assert [dico[i] for i in range(len(dico))] == ['c', 'd']
+    assert embeddings.tolist() == [[7, 8, 9], [1, 0, 1]]
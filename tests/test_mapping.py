@@ -0,0 +1,25 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import torch
+from torch import nn
+
+from src.trainer import Trainer
+from src.checkpoint import AsyncWriter
+from src.utils import load_best_mapping
+
+
+def test_save_best_load_best_mapping(tmp_path):
+    params = argparse.Namespace(src_lang='en', tgt_lang=['es'], exp_path=str(tmp_path))
+    mapping = {lang: nn.Linear(4, 4, bias=False) for lang in ['en', 'es']}
+    trainer = argparse.Namespace(mapping=mapping, params=params, best_valid_metric=-1e12,
+                                 best_valid_metrics={}, writer=AsyncWriter())
+    Trainer.save_best(trainer, {'metric': 1.}, 'metric')
+    trainer.writer.wait()
+    for lang in ['en', 'es']:
+        assert torch.equal(load_best_mapping(str(tmp_path), lang), mapping[lang].weight.data)
@@ -0,0 +1,69 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from src.shared_store import get_shared_name
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# attach the shared embeddings, report them, and hold them until a line is read
+HOLDER = '''
+import os, sys, json, argparse
+from src.models import EMB_DTYPES, FrozenEmbedding
+from src.shared_store import attach_shared_embeddings
+params = argparse.Namespace(**json.loads(sys.argv[1]))
+dico, emb = attach_shared_embeddings(params.src_lang, sys.argv[2], params)
+frozen = FrozenEmbedding(emb, EMB_DTYPES[params.emb_dtype])
+print(json.dumps({'ino': os.stat(sys.argv[3]).st_ino, 'n_words': len(dico), 'dtype': str(emb.dtype),
+                  'zero_copy': frozen.weight.data_ptr() == emb.data_ptr()}))
+sys.stdout.flush()
+sys.stdin.readline()
+'''
+
+
+def start_holder(params, emb_path, data_path):
+    proc = subprocess.Popen([sys.executable, '-c', HOLDER, json.dumps(vars(params)), emb_path, data_path],
+                            cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    assert line, 'the holder failed to attach the embeddings'
+    return proc, json.loads(line)
+
+
+def stop_holder(proc):
+    proc.communicate('\n', timeout=60)
+    assert proc.returncode == 0
+
+
+def test_publish_attach_release(synthetic_dir, tmp_path):
+    params = argparse.Namespace(src_lang='en', emb_dim=20, max_vocab=200000, normalize_embeddings='',
+                                cuda=False, shared_dir=str(tmp_path), emb_dtype='float16')
+    emb_path = os.path.join(synthetic_dir, 'en.vec')
+    data_path = os.path.join(str(tmp_path), '%s.bundle' % get_shared_name('en', emb_path, params))
+
+    # the first holder publishes the embeddings, in the requested precision, without copy
+    proc1, info1 = start_holder(params, emb_path, data_path)
+    assert info1['n_words'] == 3000 and info1['dtype'] == 'torch.float16' and info1['zero_copy']
+
+    # the second one attaches to the same bundle
+    proc2, info2 = start_holder(params, emb_path, data_path)
+    assert info2['ino'] == info1['ino']
+
+    # the bundle is removed when the last holder exits
+    stop_holder(proc2)
+    assert os.path.isfile(data_path)
+    stop_holder(proc1)
+    assert not os.path.exists(data_path)
+
+    # embeddings of another precision are shared separately
+    params.emb_dtype = 'float32'
+    assert get_shared_name('en', emb_path, params) not in data_path
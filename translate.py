@@ -0,0 +1,151 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+# python translate.py --src_lang en --tgt_lang es --src_emb data/wiki.en.vec --tgt_emb data/wiki.es.vec --mapping_path dumped/debug/xxx --output en-es.tsv
+
+import os
+import io
+import sys
+import json
+import argparse
+from collections import deque
+
+from src.utils import bool_flag, initialize_exp, load_embeddings, normalize_embeddings, load_best_mapping, iter_blocks
+from src.dico_builder import translate_blocks
+
+
+# main
+parser = argparse.ArgumentParser(description='Bilingual lexicon induction')
+parser.add_argument("--verbose", type=int, default=2, help="Verbose level (2:debug, 1:info, 0:warning)")
+parser.add_argument("--exp_path", type=str, default="", help="Where to store experiment logs and models")
+parser.add_argument("--exp_name", type=str, default="debug", help="Experiment name")
+parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
+parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
+# data
+parser.add_argument("--src_lang", type=str, default="", help="Source language")
+parser.add_argument("--tgt_lang", type=str, default="", help="Target language")
+parser.add_argument("--src_emb", type=str, default="", help="Reload source embeddings")
+parser.add_argument("--tgt_emb", type=str, default="", help="Reload target embeddings")
+parser.add_argument("--max_vocab", type=int, default=200000, help="Maximum vocabulary size (-1 to disable)")
+parser.add_argument("--full_vocab", type=bool_flag, default=False, help="Translate from / to the entire vocabulary of the embedding files")
+parser.add_argument("--emb_dim", type=int, default=300, help="Embedding dimension")
+parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--mapping_path", type=str, default="", help="Experiment folder with the best mappings (best_mapping.<lang>.pth)")
+# translation
+parser.add_argument("--method", type=str, default="csls_knn_10", help="Scoring method (nn/invsm_beta_30/csls_knn_10)")
+parser.add_argument("--topk", type=int, default=10, help="Number of translations per source word")
+parser.add_argument("--queries", type=str, default="", help="File with one source word per line ('-' for stdin, empty for the whole source vocabulary)")
+parser.add_argument("--output", type=str, default="", help="Output file (empty for stdout)")
+parser.add_argument("--format", type=str, default="tsv", help="Output format (tsv / jsonl)")
+parser.add_argument("--batch_size", type=int, default=1024, help="Number of source words scored at once (bounds the memory to batch_size x target vocabulary scores)")
+parser.add_argument("--n_workers", type=int, default=1, help="Number of concurrent workers scoring the batches")
+
+
+# parse parameters
+params = parser.parse_args()
+
+# check parameters
+assert params.src_lang and params.tgt_lang
+assert os.path.isfile(params.src_emb)
+assert os.path.isfile(params.tgt_emb)
+assert os.path.isdir(params.mapping_path)
+assert params.method == 'nn' or params.method.startswith('csls_knn_') or params.method.startswith('invsm_beta_')
+assert params.topk >= 1 and params.batch_size >= 1 and params.n_workers >= 1
+assert params.format in ["tsv", "jsonl"]
+assert params.queries in ["", "-"] or os.path.isfile(params.queries)
+params.tgt_lang = [params.tgt_lang]
+params.tgt_emb = [params.tgt_emb]
+
+# build logger (the translations are written to stdout, the logs to stderr)
+logger = initialize_exp(params)
+
+
+def load_mapped_embeddings(lang, emb_path):
+    """
+    Reload embeddings, apply the best mapping of the experiment and normalize them.
+    """
+    dico, emb = load_embeddings(lang, emb_path, params, full_vocab=params.full_vocab)
+    normalize_embeddings(emb, params.normalize_embeddings)
+    W = load_best_mapping(params.mapping_path, lang).type_as(emb)
+    assert W.size() == (params.emb_dim, params.emb_dim)
+    emb = emb.cuda() if params.cuda else emb
+    W = W.cuda() if params.cuda else W
+    emb = emb.mm(W.transpose(0, 1))
+    emb.div_(emb.norm(2, 1, keepdim=True).expand_as(emb))
+    return dico, emb
+
+
+src_dico, src_emb = load_mapped_embeddings(params.src_lang, params.src_emb)
+tgt_dico, tgt_emb = load_mapped_embeddings(params.tgt_lang[0], params.tgt_emb[0])
+topk = min(params.topk, len(tgt_dico))
+
+# source words to translate
+n_unknown = 0
+
+
+def iter_queries():
+    """
+    Iterate over the source words to translate, with their index.
+    """
+    global n_unknown
+    if params.queries == "":
+        for i in range(len(src_dico)):
+            yield src_dico[i], i
+        return
+    f = sys.stdin if params.queries == "-" else io.open(params.queries, 'r', encoding='utf-8')
+    try:
+        for line in f:
+            line = line.split()
+            if len(line) == 0:
+                continue
+            word = line[0]
+            if word in src_dico:
+                yield word, src_dico.index(word)
+            elif word.lower() in src_dico:
+                yield word, src_dico.index(word.lower())
+            else:
+                n_unknown += 1
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# the words of each block are kept aside, only their indices are sent to the workers
+blocks = deque()
+
+
+def iter_ids():
+    """
+    Iterate over the indices of the blocks of source words.
+    """
+    for block in iter_blocks(iter_queries(), params.batch_size):
+        blocks.append([word for word, _ in block])
+        yield [i for _, i in block]
+
+
+# stream the translations
+out = sys.stdout if params.output == "" else io.open(params.output, 'w', encoding='utf-8')
+n_words = 0
+try:
+    for scores, targets in translate_blocks(iter_ids(), src_emb, tgt_emb, params.method, topk, params.n_workers):
+        words = blocks.popleft()
+        lines = []
+        for word, word_scores, word_targets in zip(words, scores, targets):
+            if params.format == "tsv":
+                lines.extend('%s\t%s\t%.5f\n' % (word, tgt_dico[j], s) for s, j in zip(word_scores, word_targets))
+            else:
+                translations = [{"word": tgt_dico[j], "score": round(float(s), 5)} for s, j in zip(word_scores, word_targets)]
+                lines.append(json.dumps({"word": word, "translations": translations}, ensure_ascii=False) + '\n')
+        out.write(''.join(lines))
+        n_words += len(words)
+finally:
+    if out is not sys.stdout:
+        out.close()
+    else:
+        out.flush()
+
+logger.info('Translated %i source words (%i unknown words skipped) with %s.' % (n_words, n_unknown, params.method))
@@ -14,11 +14,15 @@ import numpy as np
 import torch
 
 from src.utils import bool_flag, initialize_exp
+from src.distributed import init_distributed, is_master, broadcast_object
 from src.models import build_model
 from src.trainer import Trainer
 from src.evaluation import Evaluator
+from src.instrument import stage, log_stages, log_stage_summary
+from src.profiler import PROFILERS, init_profiler, profile, set_iteration
 
 
+# tracked for each target language (see Trainer.save_best)
 VALIDATION_METRIC = 'mean_cosine-csls_knn_10-S2T-10000_{}'
 
 
@@ -30,7 +34,9 @@ parser.add_argument("--exp_path", type=str, default="", help="Where to store exp
 parser.add_argument("--exp_name", type=str, default="debug", help="Experiment name")
 parser.add_argument("--exp_id", type=str, default="", help="Experiment ID")
 parser.add_argument("--cuda", type=bool_flag, default=True, help="Run on GPU")
-parser.add_argument("--export", type=str, default="txt", help="Export embeddings after training (txt / pth)")
+parser.add_argument("--export", type=str, default="txt", help="Export embeddings after training (txt / pth / bundle)")
+parser.add_argument("--export_dtype", type=str, default="float32", help="Precision of the exported bundle (float32 / float16)")
+parser.add_argument("--resume", type=str, default="", help="Resume the experiment stored in this folder from its last checkpoint")
 # data
 parser.add_argument("--src_lang", type=str, default='en', help="Source language")
 parser.add_argument("--tgt_lang", type=str, default='es', help="Target language")
@@ -48,6 +54,8 @@ parser.add_argument("--dis_steps", type=int, default=5, help="Discriminator step
 parser.add_argument("--dis_lambda", type=float, default=1, help="Discriminator loss feedback coefficient")
 parser.add_argument("--dis_most_frequent", type=int, default=75000, help="Select embeddings of the k most frequent words for discrimination (0 to disable)")
 parser.add_argument("--dis_smooth", type=float, default=0.1, help="Discriminator smooth predictions")
+parser.add_argument("--dis_prefetch", type=bool_flag, default=False, help="Prefetch discriminator batches in a background thread")
+parser.add_argument("--dis_eval_bs", type=int, default=8192, help="Block size for the discriminator evaluation")
 parser.add_argument("--dis_clip_weights", type=float, default=0, help="Clip discriminator weights (0 to disable)")
 # training adversarial
 parser.add_argument("--adversarial", type=bool_flag, default=True, help="Use adversarial training")
@@ -63,16 +71,27 @@ parser.add_argument("--lr_shrink", type=float, default=0.5, help="Shrink the lea
 parser.add_argument("--n_refinement", type=int, default=5, help="Number of refinement iterations (0 to disable the refinement procedure)")
 # dictionary creation parameters (for refinement)
 parser.add_argument("--dico_eval", type=str, default="default", help="Path to evaluation dictionary")
+parser.add_argument("--dico_path", type=str, default="", help="Folder of the default train / evaluation dictionaries (default: $MUSE_DIC_EVAL_PATH, or data/crosslingual/dictionaries)")
 parser.add_argument("--dico_method", type=str, default='csls_knn_10', help="Method used for dictionary generation (nn/invsm_beta_30/csls_knn_10)")
 parser.add_argument("--dico_build", type=str, default='S2T&T2S', help="S2T,T2S,S2T|T2S,S2T&T2S")
 parser.add_argument("--dico_threshold", type=float, default=0, help="Threshold confidence for dictionary generation")
 parser.add_argument("--dico_max_rank", type=int, default=15000, help="Maximum dictionary words rank (0 to disable)")
+parser.add_argument("--dico_prefilter", type=str, default="", help="Restrict the source and target words to the dico_max_rank most frequent ones before scoring them, with the CSLS / inverted softmax terms computed over the full vocabularies (full) or the restricted ones (window) (empty to disable)")
 parser.add_argument("--dico_min_size", type=int, default=0, help="Minimum generated dictionary size (0 to disable)")
 parser.add_argument("--dico_max_size", type=int, default=0, help="Maximum generated dictionary size (0 to disable)")
+parser.add_argument("--dico_workers", type=int, default=0, help="Number of concurrent workers building the per-language dictionaries (0: one per language)")
 # reload pre-trained embeddings
 parser.add_argument("--src_emb", type=str, default="", help="Reload source embeddings")
 parser.add_argument("--tgt_emb", type=str, default="", help="Reload target embeddings")
 parser.add_argument("--normalize_embeddings", type=str, default="", help="Normalize embeddings before training")
+parser.add_argument("--emb_dtype", type=str, default="float32", help="Storage precision of the embeddings (float32 / float16 / bfloat16). Reduced precision embeddings are frozen")
+parser.add_argument("--shared_embeddings", type=bool_flag, default=False, help="Share the loaded embeddings with the other jobs of the host (memory-mapped, read-only)")
+parser.add_argument("--shared_dir", type=str, default="", help="Directory of the shared embeddings (default: /dev/shm)")
+# profiling
+parser.add_argument("--profile", type=str, default="", help="Stages to profile, comma-separated (e.g. \"adversarial\", \"iteration\", \"build_dictionary/candidates\", \"eval.word_translation\": see the stages of the log)")
+parser.add_argument("--profile_iters", type=str, default="", help="Iterations to profile, comma-separated (default: all)")
+parser.add_argument("--profiler", type=str, default="cprofile", help="Profilers (cprofile / torch / cprofile,torch)")
+parser.add_argument("--profile_top", type=int, default=20, help="Number of hot functions of the profile summaries")
 
 
 # parse parameters
@@ -81,7 +100,7 @@ params.tgt_lang = params.tgt_lang.strip().split(' ')
 params.tgt_emb = params.tgt_emb.strip().split(' ')
 
 # check parameters
-assert len(params.tgt_lang)==1 and len(params.tgt_emb)==1
+assert len(params.tgt_lang) == len(params.tgt_emb)
 assert not params.cuda or torch.cuda.is_available()
 assert 0 <= params.dis_dropout < 1
 assert 0 <= params.dis_input_dropout < 1
@@ -91,64 +110,99 @@ assert 0 < params.lr_shrink <= 1
 assert os.path.isfile(params.src_emb)
 assert all(os.path.isfile(emb) for emb in params.tgt_emb)
 assert params.dico_eval == 'default' or os.path.isfile(params.dico_eval)
-assert params.export in ["", "txt", "pth"]
+assert params.dico_prefilter in ["", "full", "window"]
+assert not params.dico_path or os.path.isdir(params.dico_path)
+assert params.emb_dtype in ["float32", "float16", "bfloat16"]
+assert not params.shared_embeddings or params.emb_dtype != "bfloat16", "shared embeddings are stored in float32 / float16"
+assert not params.shared_dir or os.path.isdir(params.shared_dir)
+assert params.export in ["", "txt", "pth", "bundle"]
+assert params.export_dtype in ["float32", "float16"]
+assert not params.resume or os.path.isdir(params.resume)
+assert all(x in PROFILERS for x in params.profiler.split(','))
+assert all(x.isdigit() for x in params.profile_iters.split(',') if x)
+assert params.profile_top > 0
 
 # build model / trainer / evaluator
+# (data-parallel adversarial training when started with launch.py)
+init_distributed(params)
 logger = initialize_exp(params)
+if is_master(params):
+    init_profiler(params)
 src_emb, tgt_emb, mapping, discriminator = build_model(params, True)
 trainer = Trainer(src_emb, tgt_emb, mapping, discriminator, params)
 evaluator = Evaluator(trainer)
 
+# resume from the last checkpoint (adversarial epoch or refinement iteration)
+checkpoint = trainer.load_checkpoint() if params.resume else None
+adversarial_start, refinement_start = 0, 0
+if checkpoint is not None and checkpoint['phase'] == 'adversarial':
+    adversarial_start = checkpoint['n_iter'] + 1
+    if trainer.map_optimizer.param_groups[0]['lr'] < params.min_lr:
+        adversarial_start = params.n_epochs
+elif checkpoint is not None:
+    assert checkpoint['phase'] == 'refinement'
+    adversarial_start = params.n_epochs
+    refinement_start = checkpoint['n_iter'] + 1
+
 
 """
 Learning loop for Adversarial Training
 """
-if params.adversarial:
+if params.adversarial and adversarial_start < params.n_epochs:
     logger.info('----> ADVERSARIAL TRAINING <----\n\n')
 
     # training loop
-    for n_epoch in range(params.n_epochs):
+    for n_epoch in range(adversarial_start, params.n_epochs):
 
         logger.info('Starting adversarial training epoch %i...' % n_epoch)
+        set_iteration(n_epoch, 'epoch')
         tic = time.time()
         n_words_proc = 0
         stats = {'DIS_COSTS': []}
 
-        for n_iter in range(0, params.epoch_size, params.batch_size):
+        with stage('adversarial'):
+            for n_iter in range(0, params.epoch_size, params.batch_size):
 
-            # discriminator training
-            for _ in range(params.dis_steps):
-                trainer.dis_step(stats)
+                # discriminator training
+                for _ in range(params.dis_steps):
+                    trainer.dis_step(stats)
 
-            # mapping training (discriminator fooling)
-            n_words_proc += trainer.mapping_step(stats)
+                # mapping training (discriminator fooling)
+                n_words_proc += trainer.mapping_step(stats)
 
-            # log stats
-            if n_iter % 500 == 0:
-                stats_str = [('DIS_COSTS', 'Discriminator loss')]
-                stats_log = ['%s: %.4f' % (v, np.mean(stats[k]))
-                             for k, v in stats_str if len(stats[k]) > 0]
-                stats_log.append('%i samples/s' % int(n_words_proc / (time.time() - tic)))
-                logger.info(('%06i - ' % n_iter) + ' - '.join(stats_log))
+                # log stats
+                if n_iter % 500 == 0:
+                    stats_str = [('DIS_COSTS', 'Discriminator loss')]
+                    stats_log = ['%s: %.4f' % (v, np.mean(stats[k]))
+                                 for k, v in stats_str if len(stats[k]) > 0]
+                    # all data-parallel workers process the same number of samples
+                    stats_log.append('%i samples/s' % int(n_words_proc * params.world_size / (time.time() - tic)))
+                    logger.info(('%06i - ' % n_iter) + ' - '.join(stats_log))
 
-                # reset
-                tic = time.time()
-                n_words_proc = 0
-                for k, _ in stats_str:
-                    del stats[k][:]
+                    # reset
+                    tic = time.time()
+                    n_words_proc = 0
+                    for k, _ in stats_str:
+                        del stats[k][:]
 
-        # embeddings / discriminator evaluation
+        # embeddings / discriminator evaluation (by the master, shared with the workers)
         to_log = OrderedDict({'n_epoch': n_epoch})
-        evaluator.all_eval(to_log, True)
-        evaluator.eval_dis(to_log)
+        if is_master(params):
+            evaluator.all_eval(to_log, True)
+            evaluator.eval_dis(to_log)
+            log_stages(to_log)
+        if params.distributed:
+            to_log = broadcast_object(to_log)
+            trainer.sync_parameters()
 
         # JSON log / save best model / end of epoch
         logger.info("__log__:%s" % json.dumps(to_log))
-        trainer.save_best(to_log, VALIDATION_METRIC.format(params.tgt_lang[-1]))
+        trainer.save_best(to_log, VALIDATION_METRIC)
         logger.info('End of epoch %i.\n\n' % n_epoch)
 
         # update the learning rate (stop if too small)
-        trainer.update_lr(to_log, VALIDATION_METRIC.format(params.tgt_lang[-1]))
+        trainer.update_lr(to_log, VALIDATION_METRIC)
+        trainer.save_checkpoint(n_epoch, phase='adversarial')
         if trainer.map_optimizer.param_groups[0]['lr'] < params.min_lr:
             logger.info('Learning rate < 1e-6. BREAK.')
             break
@@ -157,33 +211,48 @@ if params.adversarial:
 """
 Learning loop for Procrustes Iterative Refinement
 """
-if params.n_refinement > 0:
+if params.n_refinement > refinement_start and is_master(params):
     # Get the best mapping according to VALIDATION_METRIC
+    # (unless we resume the refinement from the checkpointed mapping)
+    # The refinement is not data-parallel, only the master runs it.
     logger.info('----> ITERATIVE PROCRUSTES REFINEMENT <----\n\n')
-    trainer.reload_best()
+    if refinement_start == 0:
+        trainer.reload_best()
 
     # training loop
-    for n_iter in range(params.n_refinement):
+    for n_iter in range(refinement_start, params.n_refinement):
 
         logger.info('Starting refinement iteration %i...' % n_iter)
-
-        # build a dictionary from aligned embeddings
-        trainer.build_dictionary(support=False)
-
-        # apply the Procrustes solution
-        trainer.simple_procrustes()
-
-        # embeddings evaluation
+        set_iteration(n_iter)
         to_log = OrderedDict({'n_iter': n_iter})
-        evaluator.all_eval(to_log, biling_dict=True)
+
+        with profile('iteration'):
+            # build a dictionary from aligned embeddings / apply the Procrustes solution
+            # (with several target languages, each of them is mapped to the source space)
+            if len(params.tgt_lang) == 1:
+                trainer.build_dictionary(support=False)
+                trainer.simple_procrustes()
+            else:
+                for lang in params.tgt_lang:
+                    trainer.build_dictionary(support=False, lang=lang)
+                    trainer.simple_procrustes(lang)
+
+            # embeddings evaluation
+            evaluator.all_eval(to_log, biling_dict=True)
+        log_stages(to_log)
 
         # JSON log / save best model / end of epoch
         logger.info("__log__:%s" % json.dumps(to_log))
-        trainer.save_best(to_log, VALIDATION_METRIC.format(params.tgt_lang[-1]))
+        trainer.save_best(to_log, VALIDATION_METRIC)
+        trainer.save_checkpoint(n_iter, phase='refinement')
         logger.info('End of refinement iteration %i.\n\n' % n_iter)
 
 
 # export embeddings
-if params.export:
+if params.export and is_master(params):
     trainer.reload_best()
     trainer.export()
+
+# time / memory of each stage of the run
+if is_master(params):
+    log_stage_summary()